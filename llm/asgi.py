@@ -5,6 +5,13 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+The chat views (get_response, stream_response, handle_satisfaction) are async,
+so serve the project over ASGI: `manage.py runserver` does (daphne is in
+INSTALLED_APPS), and in production run `daphne llm.asgi:application` or
+`uvicorn llm.asgi:application`. A waiting or streaming conversation then does
+not hold a worker thread while the model generates. Under a WSGI server the
+stream_response answer is buffered and sent in one piece.
 """
 
 import os
@@ -14,3 +21,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm.settings")
 
 application = get_asgi_application()
+
+# Index warm-up, PDF watcher and outbox sender for this server process
+from processor.apps import start_background_services  # noqa: E402
+
+start_background_services()
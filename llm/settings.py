@@ -31,6 +31,7 @@ ALLOWED_HOSTS = ['*']
 # Application definition
 
 INSTALLED_APPS = [
+    "daphne",  # ASGI runserver, so the async chat views stream (see llm/asgi.py)
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -75,6 +76,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "llm.wsgi.application"
+ASGI_APPLICATION = "llm.asgi.application"
 
 
 # Database
@@ -132,3 +134,98 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Build the PDF index in a background thread when a server starts: runserver,
+# llm/wsgi.py or llm/asgi.py, not other management commands or tests
+# (see start_background_services in processor/apps.py)
+INDEX_WARMUP_ON_STARTUP = True
+
+# Vector index (see processor/vector_store.py): "chroma", or "numpy" for exact
+# search over an in-process float32 matrix. Changing it rebuilds the index.
+VECTOR_STORE_BACKEND = "chroma"
+
+# PDF ingestion (see processor/ingest_pipeline.py)
+# PDF_EXTRACT_WORKERS = 4  # Processes used for OCR; defaults to the number of CPUs
+# Embedded images below these sizes, or with less grayscale contrast, are not OCR'd
+OCR_MIN_IMAGE_WIDTH = 64  # pixels
+OCR_MIN_IMAGE_HEIGHT = 24  # pixels
+OCR_MIN_IMAGE_BYTES = 1024
+OCR_MIN_CONTRAST = 40  # Grayscale max-min (0-255)
+
+# Hot reload of policy PDFs: poll the PDF folder and swap in a rebuilt index.
+# A lock file next to the index lets only one worker process build at a time;
+# the others follow the manifest (also updated by `manage.py reindex_pdfs`).
+# PDF_WATCH_REBUILD = False leaves rebuilding to `manage.py reindex_pdfs`.
+PDF_WATCH_ENABLED = True
+PDF_WATCH_INTERVAL = 30  # seconds
+PDF_WATCH_REBUILD = True
+
+# Answer cache for near-duplicate questions (see processor/answer_cache.py)
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL = 3600  # seconds
+ANSWER_CACHE_SIMILARITY = 0.95  # Minimum cosine similarity between query embeddings
+
+# Hybrid retrieval (see retrieve() in processor/chat_service.py)
+HYBRID_CANDIDATES = 10  # Candidates taken from each ranking before fusion
+LEXICAL_FASTPATH_MIN_COVERAGE = 0.9  # Share of query terms (IDF-weighted) found in the top BM25 hit
+LEXICAL_FASTPATH_MIN_MARGIN = 1.5  # Top BM25 score over runner-up needed to skip the embedding call
+
+# Multi-chunk text queries: maximum LLM generations running at once per request
+TEXT_QUERY_CONCURRENCY = 4
+
+# Shared Ollama client (see processor/ollama_client.py)
+OLLAMA_HOST = None  # None: use the OLLAMA_HOST environment variable, else http://localhost:11434
+OLLAMA_TIMEOUT = 120  # seconds per request
+OLLAMA_CONNECT_TIMEOUT = 5  # seconds
+OLLAMA_MAX_RETRIES = 2  # Retries of failed connection attempts
+OLLAMA_MAX_CONNECTIONS = 20
+OLLAMA_KEEPALIVE_CONNECTIONS = 10  # Idle connections kept open for reuse
+
+# LLM admission control (see processor/llm_scheduler.py). Chat requests are
+# served before bulk text_processor jobs; beyond the queue depth requests get a
+# fast "busy" reply (HTTP 503) instead of piling onto the model server.
+LLM_MAX_IN_FLIGHT = 2  # Generations sent to Ollama at once
+LLM_MAX_QUEUE_DEPTH = 32  # Waiting generations before new ones are shed
+LLM_QUEUE_TIMEOUT = 60  # seconds a generation may wait for a slot
+
+# Prompt assembly (see processor/prompt_builder.py)
+PROMPT_CONTEXT_TOKEN_BUDGET = 1024  # Approximate tokens of retrieved context per prompt
+
+# Department routing for escalations (see processor/department_router.py)
+DEPARTMENT_ROUTER_MIN_MARGIN = 0.05  # Cosine-similarity lead needed to skip the LLM
+
+# Support emails (see processor/email_system.py and processor/email_outbox.py).
+# Escalations are queued in the EmailOutbox table and sent in the background.
+# To test against a local stand-in: `python -m aiosmtpd -n -l localhost:1025`
+# with SUPPORT_SMTP_HOST = "localhost", SUPPORT_SMTP_PORT = 1025, SUPPORT_SMTP_USE_TLS = False.
+SUPPORT_SMTP_HOST = "smtp.gmail.com"
+SUPPORT_SMTP_PORT = 587
+SUPPORT_SMTP_USE_TLS = True
+SUPPORT_SMTP_TIMEOUT = 30  # seconds
+EMAIL_OUTBOX_ENABLED = True  # Send from a thread in each web process
+EMAIL_OUTBOX_POLL_INTERVAL = 10  # seconds
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_BACKOFF = 30  # seconds before the first retry, doubled after each failure
+EMAIL_OUTBOX_IDLE_TIMEOUT = 60  # seconds an unused SMTP session stays open
+# Sender credentials are read on first send, from these settings, then the
+# SUPPORT_EMAIL_FROM / SUPPORT_EMAIL_PASSWORD environment variables, then the
+# file named by SUPPORT_EMAIL_PASSWORD_FILE (default /run/secrets/support_email_password).
+# SUPPORT_EMAIL_FROM = "you@gmail.com"
+# SUPPORT_EMAIL_PASSWORD_FILE = "/path/to/app_password"
+
+# Chat history per browser session (see processor/conversation_store.py).
+# "memory" keeps it in each process; use "db" when several worker processes
+# serve the same users without sticky sessions.
+CONVERSATION_STORE_BACKEND = "memory"
+CONVERSATION_MAX_TURNS = 50  # Turns kept per session
+CONVERSATION_MAX_SESSIONS = 10000  # Sessions kept in memory, least recently active dropped first
+CONVERSATION_TTL_DAYS = 30  # "db": `manage.py prune_conversations` (e.g. daily from cron) drops older turns
+
+# Per-request trace of chat turns (see processor/trace_log.py): one JSON line
+# per turn with the query, retrieved chunk ids, stage timings and answer size.
+# Written in the background; each worker process writes requests.<pid>.jsonl.
+TRACE_LOG_ENABLED = True
+TRACE_LOG_PATH = str(BASE_DIR / "chat_logs" / "trace" / "requests.jsonl")
+TRACE_LOG_FLUSH_INTERVAL = 1.0  # seconds
+TRACE_LOG_MAX_BYTES = 50 * 1024 * 1024  # Rotate and gzip past this size
+TRACE_LOG_BACKUPS = 10  # Compressed files kept
@@ -5,6 +5,9 @@ It exposes the WSGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
+
+The chat views are async and stream their answers only under ASGI; deploy
+with llm/asgi.py instead.
 """
 
 import os
@@ -14,3 +17,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "llm.settings")
 
 application = get_wsgi_application()
+
+# Index warm-up, PDF watcher and outbox sender for this server process
+from processor.apps import start_background_services  # noqa: E402
+
+start_background_services()
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    In-memory cache of generated answers.
+
+    An answer is reused when the output language and the retrieved chunk IDs are
+    the same and the new query's embedding is at least `similarity_threshold`
+    cosine-similar to the cached query (or, for queries answered without an
+    embedding, the normalised query text is identical). Requiring the same chunk
+    IDs means the reused answer was grounded on exactly the context the new
+    query would get.
+    Entries expire after `ttl` seconds, and the least recently used entry is
+    evicted beyond `max_entries`. The cache must be cleared whenever the index is
+    rebuilt, since chunk IDs are reused across generations.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # entry id -> (group key, unit query vector or None, query text, answer, created)
+        self._groups = {}  # (language, chunk ids) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _group_key(language, chunk_ids):
+        return (language.strip().lower(), tuple(chunk_ids))
+
+    @staticmethod
+    def _normalize_query(query):
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def _unit(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, language: str, chunk_ids, query_embedding, query_text: str = ""):
+        """Return the cached answer dict for a near-duplicate query, or None"""
+        group_key = self._group_key(language, chunk_ids)
+        query = self._unit(query_embedding)
+        text = self._normalize_query(query_text)
+        now = time.time()
+        with self._lock:
+            entry_ids = [i for i in self._groups.get(group_key, ()) if now - self._entries[i][4] <= self.ttl]
+            for expired in self._groups.get(group_key, set()) - set(entry_ids):
+                self._remove(expired)
+
+            match = next((i for i in entry_ids if text and self._entries[i][2] == text), None)
+            with_vectors = [i for i in entry_ids if self._entries[i][1] is not None]
+            if match is None and query is not None and with_vectors:
+                similarities = np.stack([self._entries[i][1] for i in with_vectors]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    match = with_vectors[best]
+
+            if match is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(match)
+            self.hits += 1
+            return self._entries[match][3]
+
+    def store(self, language: str, chunk_ids, query_embedding, answer: dict, query_text: str = ""):
+        group_key = self._group_key(language, chunk_ids)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (group_key, self._unit(query_embedding), self._normalize_query(query_text), answer, time.time())
+            self._groups.setdefault(group_key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id):
+        group_key = self._entries.pop(entry_id)[0]
+        group = self._groups[group_key]
+        group.discard(entry_id)
+        if not group:
+            del self._groups[group_key]
+
+    def clear(self, *args):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+        print("Answer cache cleared")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
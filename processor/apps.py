@@ -1,3 +1,6 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
@@ -19,5 +22,47 @@ class TextProcessorConfig(AppConfig):
         clear_chat_history()
 
 class ProcessorConfig(AppConfig):
+    default = True
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'processor'
+
+    def ready(self):
+        """
+        Keep the department directory cache in sync with its table. The
+        background services start here only under `manage.py runserver`;
+        llm/wsgi.py and llm/asgi.py start them for deployed servers, so
+        migrations, tests and other commands never do.
+        """
+        from .department_directory import department_directory
+        department_directory.connect_signals()
+
+        if _is_runserver():
+            start_background_services()
+
+
+def start_background_services():
+    """
+    Start building the PDF index in the background so the server can answer
+    requests (login pages, /healthz) while the corpus is embedded, and start
+    the outbox sender and PDF watcher when enabled. Safe to call repeatedly.
+    """
+    from django.conf import settings
+    from .index_service import start_index_warmup, start_pdf_watcher
+    if getattr(settings, 'INDEX_WARMUP_ON_STARTUP', True):
+        start_index_warmup()
+    from .email_outbox import EMAIL_OUTBOX_ENABLED, start_outbox_sender
+    if EMAIL_OUTBOX_ENABLED:
+        # Deliver messages queued before a restart
+        start_outbox_sender()
+    if getattr(settings, 'PDF_WATCH_ENABLED', False):
+        start_pdf_watcher(
+            getattr(settings, 'PDF_WATCH_INTERVAL', 30),
+            rebuild=getattr(settings, 'PDF_WATCH_REBUILD', True)
+        )
+
+
+def _is_runserver():
+    """True in the process that serves `runserver` requests (not its autoreloader parent)"""
+    if len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+        return False
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
@@ -1,84 +1,117 @@
-import ollama
-import os
-import mysql.connector  # Changed to MySQL connector
+import asyncio
+import time
+from contextlib import aclosing
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
 from .pdf_processor import (
-    initialize_pdf_collection, 
+    LLAMA_ERROR_RESPONSE,
     split_text, 
-    get_embedding, 
-    get_llama_response
+    get_embeddings, 
+    astream_llama_response
 )
-from .email_system import send_support_email, get_chat_history
+from .email_system import build_support_email, get_chat_history
+from .email_outbox import queue_support_email
+from .index_service import IndexNotReady, get_collection, on_collection_swap
+from .answer_cache import AnswerCache
+from . import metrics
+from .ollama_client import get_client, get_async_client
+from .llm_scheduler import BULK, INTERACTIVE, SchedulerBusy, scheduler
+from .department_router import department_router
+from .department_directory import department_directory
+from .conversation_store import conversation_store
+from .trace_log import record_turn
 
-# Initialize the collection once at module level
-global_collection = initialize_pdf_collection()
+# Answers are reused for near-duplicate questions until the PDFs are re-indexed
+answer_cache = AnswerCache(
+    max_entries=getattr(settings, 'ANSWER_CACHE_MAX_ENTRIES', 1000),
+    ttl=getattr(settings, 'ANSWER_CACHE_TTL', 3600),
+    similarity_threshold=getattr(settings, 'ANSWER_CACHE_SIMILARITY', 0.95)
+)
+on_collection_swap(answer_cache.clear)
 
-def log_chat_history(user_message, bot_message, source=""):
-    """
-    Log chat history to a file, preserving previous conversations
-    until a new session is started.
-    """
-    # Create logs directory if it doesn't exist
-    log_dir = "chat_logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-
-    # Use a consistent filename for each user
-    filename = os.path.join(log_dir, "userhistory.txt")
-
-    # Append to the file instead of overwriting
-    with open(filename, "a") as f:
-        f.write(f"USER: {user_message}\n")
-        f.write(f"BOT: {bot_message}")
-        if source and source != "Support System":
-            f.write(f" (Source: {source})")
-        f.write("\n\n")
-
-# Add a new function to clear history at the start of a new session
-def clear_chat_history():
-    """
-    Clear the chat history file when a new session starts.
-    Call this function when initializing your application.
-    """
-    log_dir = "chat_logs"
-    filename = os.path.join(log_dir, "userhistory.txt")
-    
-    if os.path.exists(filename):
-        os.remove(filename)
-        print("Chat history cleared for new session")
+# Hybrid retrieval: BM25 fast path and rank fusion with vector search
+RETRIEVAL_RESULTS = 2
+HYBRID_CANDIDATES = getattr(settings, 'HYBRID_CANDIDATES', 10)
+LEXICAL_FASTPATH_MIN_COVERAGE = getattr(settings, 'LEXICAL_FASTPATH_MIN_COVERAGE', 0.9)
+LEXICAL_FASTPATH_MIN_MARGIN = getattr(settings, 'LEXICAL_FASTPATH_MIN_MARGIN', 1.5)
+RRF_K = 60  # Reciprocal rank fusion constant
+
+# Upper bound on simultaneous LLM generations for one multi-chunk text query
+TEXT_QUERY_CONCURRENCY = getattr(settings, 'TEXT_QUERY_CONCURRENCY', 4)
+
+def log_chat_history(user_message, bot_message, source="", session_key=None):
+    """Record one exchange in the session's conversation history"""
+    conversation_store.append(session_key, user_message, bot_message, source)
+
+def clear_chat_history(session_key=None):
+    """Forget the session's conversation, e.g. once it has been escalated"""
+    conversation_store.clear(session_key)
+    print("Chat history cleared for session")
 
 def initialize_collection():
-    """Ensure the collection is initialized"""
-    global global_collection
-    if global_collection is None:
-        print("Collection is None, reinitializing...")
-        global_collection = initialize_pdf_collection()
-    return global_collection
-
-def process_text_query(user_text, output_language):
+    """Return the collection if the background warm-up has finished, else None"""
+    try:
+        return get_collection()
+    except IndexNotReady:
+        return None
+
+def process_text_query(user_text, output_language, session_key=None):
     """Process a text query and return results"""
     # Ensure collection is initialized
     collection = initialize_collection()
     if collection is None:
         return [{'query': user_text, 
-                'response': 'Database initialization failed. Please contact an administrator.',
+                'response': 'The policy documents are still being loaded. Please try again in a moment.',
                 'matches': [],
                 'source_pdf': 'Error'}]
 
-    client = ollama.Client()
+    # Shed the job up front when the model server is already saturated
+    scheduler.admit(BULK)
+    client = get_client()
     print("Ollama client initialized")
 
     query_chunks = split_text(user_text)
-    results = []
 
-    for i, query_text in enumerate(query_chunks, 1):
+    # One embedding batch and one vector query for all chunks
+    try:
+        retrievals = retrieve_many(query_chunks, client)
+    except Exception as e:
+        print(f"Error during query processing: {e}")
+        retrievals = [e] * len(query_chunks)
+
+    async def answer_all():
+        limit = asyncio.Semaphore(TEXT_QUERY_CONCURRENCY)
+
+        async def answer(query_text, retrieval):
+            if isinstance(retrieval, Exception):
+                raise retrieval
+            async with limit:
+                generation_started = time.perf_counter()
+                response = await aanswer_with_cache(query_text, output_language, retrieval, priority=BULK)
+                return response, (time.perf_counter() - generation_started) * 1000
+
+        return await asyncio.gather(
+            *(answer(query_text, retrieval) for query_text, retrieval in zip(query_chunks, retrievals)),
+            return_exceptions=True
+        )
+
+    # Generate the answers concurrently; results are collected in chunk order below
+    generations = async_to_sync(answer_all)()
+
+    results = []
+    for i, (query_text, retrieval, generation) in enumerate(zip(query_chunks, retrievals, generations), 1):
         print(f"Processing chunk {i} of {len(query_chunks)}")
         try:
-            source_pdf, closest_matches = query_collection(query_text, client)
-            context = " ".join(closest_matches)
-            llama_response = get_llama_response(context, query_text, output_language, client)
+            if isinstance(generation, Exception):
+                raise generation
+            llama_response, generation_ms = generation
+            source_pdf, closest_matches = retrieval["source"], retrieval["documents"]
             
             # Log the conversation
-            log_chat_history(query_text, llama_response, source_pdf)
+            log_chat_history(query_text, llama_response, source_pdf, session_key)
+            record_turn("text_processor", query_text, output_language, retrieval, llama_response, {
+                "retrieval": retrieval["ms"], "generation": generation_ms
+            }, outcome=answer_outcome(llama_response))
             
             # Create result entry
             results.append({
@@ -91,7 +124,11 @@ def process_text_query(user_text, output_language):
             print(f"Error during query processing: {e}")
             # Add an error result
             error_response = f"Error processing this section: {str(e)}"
-            log_chat_history(query_text, error_response, "Error")
+            log_chat_history(query_text, error_response, "Error", session_key)
+            record_turn(
+                "text_processor", query_text, output_language, None if isinstance(retrieval, Exception) else retrieval,
+                error_response, {}, outcome="error", error=str(e)
+            )
             
             results.append({
                 'query': query_text,
@@ -102,28 +139,87 @@ def process_text_query(user_text, output_language):
 
     return results
 
+def answer_outcome(llama_response):
+    """Trace outcome of a generated answer: the model server failing shows up only in its text"""
+    return "model_error" if LLAMA_ERROR_RESPONSE in llama_response else "ok"
+
 def query_collection(query_text, client):
     """Query the collection and return results"""
-    global global_collection
-    
-    # Ensure collection is initialized
-    if global_collection is None:
-        global_collection = initialize_pdf_collection()
-        if global_collection is None:
-            raise Exception("Failed to initialize database connection")
-    
-    query_embedding = get_embedding(query_text, client)
-    
-    query_results = global_collection.query(
-        query_embeddings=[query_embedding],
-        n_results=2,
-        include=["documents", "distances", "metadatas"]
-    )
-    
-    closest_matches = query_results["documents"][0]
-    distances = query_results["distances"][0]
-    metadatas = query_results["metadatas"][0]
-    
+    retrieval = retrieve(query_text, client)
+    return retrieval["source"], retrieval["documents"]
+
+def retrieve(query_text, client):
+    """
+    Fetch the closest chunks for a query.
+
+    When the BM25 index finds a confident lexical match (nearly all query terms
+    in the top chunk, well ahead of the runner-up) the embedding call is skipped
+    entirely. Otherwise the query is embedded and vector and BM25 rankings are
+    merged with reciprocal rank fusion.
+
+    Returns a dict with the query embedding (None on the lexical fast path), the
+    matched chunk ids, documents, distances (None for lexical-only matches),
+    source PDF and the retrieval path taken.
+    """
+    return retrieve_many([query_text], client)[0]
+
+def retrieve_many(query_texts, client):
+    """
+    retrieve() for several queries at once: every query that needs a vector
+    search is embedded in one batch and looked up with one multi-embedding query.
+    """
+    # Raises IndexNotReady while the background warm-up is still running
+    collection = get_collection()
+    started = time.perf_counter()
+
+    lexical = collection.lexical_index
+    lexical_hits = [lexical.search(q, HYBRID_CANDIDATES) if lexical is not None else None for q in query_texts]
+    needs_vectors = [i for i, hits in enumerate(lexical_hits) if not (hits and is_confident_lexical_match(hits))]
+
+    vector_results = {}
+    if needs_vectors:
+        embeddings = get_embeddings([query_texts[i] for i in needs_vectors], client)
+        fuse_any = any(lexical_hits[i] and lexical_hits[i]["indices"] for i in needs_vectors)
+        query_results = collection.query(
+            query_embeddings=embeddings,
+            n_results=HYBRID_CANDIDATES if fuse_any else RETRIEVAL_RESULTS
+        )
+        for row, i in enumerate(needs_vectors):
+            vector_results[i] = (embeddings[row], *(query_results[key][row] for key in ("ids", "documents", "distances", "metadatas")))
+
+    retrievals = []
+    for i, hits in enumerate(lexical_hits):
+        query_embedding = None
+        if i not in vector_results:
+            path = "lexical"
+            top = hits["indices"][:RETRIEVAL_RESULTS]
+            chunk_ids = [lexical.ids[j] for j in top]
+            closest_matches = [lexical.documents[j] for j in top]
+            metadatas = [lexical.metadatas[j] for j in top]
+            distances = [None] * len(top)
+        else:
+            query_embedding, chunk_ids, closest_matches, distances, metadatas = vector_results[i]
+            if hits and hits["indices"]:
+                path = "hybrid"
+                chunk_ids, closest_matches, distances, metadatas = fuse_rankings(
+                    lexical, hits, chunk_ids, closest_matches, distances, metadatas
+                )
+            else:
+                path = "vector"
+                chunk_ids, closest_matches, distances, metadatas = (
+                    values[:RETRIEVAL_RESULTS] for values in (chunk_ids, closest_matches, distances, metadatas)
+                )
+        retrievals.append(build_retrieval(query_embedding, chunk_ids, closest_matches, distances, metadatas, path))
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for retrieval in retrievals:
+        retrieval["ms"] = elapsed_ms
+        metrics.increment(f"retrieval_{retrieval['path']}")
+        metrics.observe(f"retrieval_{retrieval['path']}_ms", elapsed_ms)
+    print(f"Retrieved {len(retrievals)} queries via {[r['path'] for r in retrievals]} ({elapsed_ms:.1f} ms)")
+    return retrievals
+
+def build_retrieval(query_embedding, chunk_ids, closest_matches, distances, metadatas, path):
     # Get source from first metadata
     source_pdf = metadatas[0].get("source", "Unknown source") if metadatas else "Unknown source"
     
@@ -134,27 +230,75 @@ def query_collection(query_text, client):
         print(f"Distance: {distance}")
         print(f"Source PDF: {source_pdf}")
     
-    return source_pdf, closest_matches
+    return {
+        "embedding": query_embedding,
+        "ids": chunk_ids,
+        "documents": closest_matches,
+        "distances": distances,
+        "source": source_pdf,
+        "path": path
+    }
 
-def get_last_user_query():
-    """Extract the last user query from history file"""
-    try:
-        filename = os.path.join("chat_logs", "userhistory.txt")
-        if os.path.exists(filename):
-            with open(filename, "r") as f:
-                content = f.read()
-                # Find the last USER entry
-                user_entries = [line.strip() for line in content.split('\n') if line.strip().startswith("USER:")]
-                if user_entries:
-                    last_user_query = user_entries[-1][6:].strip()  # Remove "USER: " prefix
-                    return last_user_query
-    except Exception as e:
-        print(f"Error reading user history: {e}")
-    return None
+def is_confident_lexical_match(lexical_hits):
+    """True when the top BM25 hit covers the query and clearly beats the runner-up"""
+    scores = lexical_hits["scores"]
+    if not scores or lexical_hits["coverage"] < LEXICAL_FASTPATH_MIN_COVERAGE:
+        return False
+    return len(scores) == 1 or scores[0] >= LEXICAL_FASTPATH_MIN_MARGIN * scores[1]
 
-def categorize_department(query, client):
-    """Categorize which department should handle the query using direct department names"""
-    
+def fuse_rankings(lexical, lexical_hits, ids, documents, distances, metadatas):
+    """Merge vector and BM25 rankings with reciprocal rank fusion and keep the top results"""
+    candidates = {}
+    for rank, chunk_id in enumerate(ids):
+        candidates[chunk_id] = [1.0 / (RRF_K + rank + 1), documents[rank], distances[rank], metadatas[rank]]
+    for rank, index in enumerate(lexical_hits["indices"]):
+        chunk_id = lexical.ids[index]
+        if chunk_id not in candidates:
+            candidates[chunk_id] = [0.0, lexical.documents[index], None, lexical.metadatas[index]]
+        candidates[chunk_id][0] += 1.0 / (RRF_K + rank + 1)
+
+    ranked = sorted(candidates.items(), key=lambda item: item[1][0], reverse=True)[:RETRIEVAL_RESULTS]
+    return (
+        [chunk_id for chunk_id, _ in ranked],
+        [candidate[1] for _, candidate in ranked],
+        [candidate[2] for _, candidate in ranked],
+        [candidate[3] for _, candidate in ranked],
+    )
+
+async def astream_answer(query, output_language, retrieval, priority=INTERACTIVE):
+    """
+    Yield the answer for the retrieved context as the model generates it, or
+    the cached answer to a near-duplicate query in one piece. Generation holds a
+    scheduler slot of `priority` until the stream ends or is closed.
+    """
+    cached = answer_cache.lookup(output_language, retrieval["ids"], retrieval["embedding"], query)
+    if cached is not None:
+        print("Answer cache hit")
+        yield cached["response"]
+        return
+
+    parts = []
+    pieces = astream_llama_response(retrieval["documents"], query, output_language, get_async_client())
+    async with scheduler.aslot(priority), aclosing(pieces):
+        async for piece in pieces:
+            parts.append(piece)
+            yield piece
+    llama_response = "".join(parts).strip()
+    if llama_response and LLAMA_ERROR_RESPONSE not in llama_response:
+        answer_cache.store(output_language, retrieval["ids"], retrieval["embedding"], {"response": llama_response}, query)
+
+async def aanswer_with_cache(query, output_language, retrieval, priority=INTERACTIVE):
+    """The complete answer from astream_answer"""
+    async with aclosing(astream_answer(query, output_language, retrieval, priority)) as pieces:
+        parts = [piece async for piece in pieces]
+    return "".join(parts).strip()
+
+def get_last_user_query(session_key=None):
+    """The session's most recent customer question"""
+    return conversation_store.last_user_query(session_key)
+
+def department_prompt(query):
+    """Prompt asking the model which department should handle the query"""
     # Define departments and their responsibilities with a clear instruction
     department_info = """
     Please determine which department should handle this customer query. Choose exactly one department from the list below:
@@ -189,19 +333,45 @@ def categorize_department(query, client):
     Respond ONLY with the full name of the ONE most appropriate department.
     Do not include any explanation or additional text, just the department name.
     """
+    return department_info.format(query=query)
+
+async def acategorize_department(query):
+    """
+    Choose the department for an escalated query: by embedding similarity when
+    the decision is clear, otherwise by asking the model
+    """
+    department = await sync_to_async(department_router.route, thread_sensitive=False)(query, get_client())
+    if department is None:
+        department = await allm_department(query)
+    
+    # Get the email ID for the department
+    email = await sync_to_async(get_department_email)(department)
+    
+    # Print department and email to terminal
+    print(f"\nROUTING TICKET TO: {department} ({email})")
     
-    prompt = department_info.format(query=query)
+    return department, email
+
+async def allm_department(query):
+    """Categorize which department should handle the query using direct department names"""
+    started = time.perf_counter()
+    prompt = department_prompt(query)
     
     # Send to llama for department categorization
-    response = client.generate(
-        model="llama_rag_model:latest",
-        prompt=prompt
-    )
+    async with scheduler.aslot(INTERACTIVE):
+        response = await get_async_client().generate(
+            model="llama_rag_model:latest",
+            prompt=prompt
+        )
     
     # Extract the department name from the response
     raw_response = response['response'].strip()
     print(f"Raw model response: '{raw_response}'")
-    
+    metrics.observe("department_route_llm_ms", (time.perf_counter() - started) * 1000)
+    return pick_department(query, raw_response)
+
+def pick_department(query, raw_response):
+    """Department named in the model's answer, or a keyword match on the query when it names none"""
     # List of valid department names for validation
     valid_departments = [
         "Baggage Services Department",
@@ -255,62 +425,15 @@ def categorize_department(query, client):
             department = "Customer Experience Department"
             print("No keyword match found. Defaulting to Customer Experience Department")
     
-    # Get the email ID for the department
-    email = get_department_email(department)
-    
-    # Print department and email to terminal
-    print(f"\nROUTING TICKET TO: {department} ({email})")
-    
-    return department, email
+    return department
 
 def get_department_email(department_name):
-    """Get department email from MySQL database"""
-    try:
-        # Connect to the MySQL database
-        conn = mysql.connector.connect(
-            host="localhost",  # Replace with your MySQL host
-            user="root",  # Replace with your MySQL username
-            password="admin",  # Replace with your MySQL password
-            database="airline_db"
-        )
-        cursor = conn.cursor()
-        
-        # Add debug prints
-        print(f"Searching for email of: '{department_name}'")
-        
-        # Execute the query with exact match
-        sql = "SELECT email FROM processor_departmentemail WHERE LOWER(department_name) = LOWER(%s)"
-        print(f"Executing SQL: {sql} with parameter: {department_name}")
-        
-        cursor.execute(sql, (department_name,))
-        result = cursor.fetchone()
-        
-        # Print the raw result
-        print(f"Database query result: {result}")
-        
-        # If no exact match, try partial match
-        if not result:
-            sql = "SELECT email FROM processor_departmentemail WHERE LOWER(department_name) LIKE LOWER(%s)"
-            search_term = f"%{department_name.split()[0]}%"
-            cursor.execute(sql, (search_term,))
-            result = cursor.fetchone()
-            print(f"Partial match query with '{search_term}' result: {result}")
-        
-        # Close the database connection
-        cursor.close()
-        conn.close()
-        
-        if result:
-            print(f"Found email for department '{department_name}': {result[0]}")
-            return result[0]  # Return the email ID
-        else:
-            print(f"WARNING: No email found for department: '{department_name}'")
-            return "support@airline.com"  # Default email if department not found
-    except Exception as e:
-        print(f"Database error: {e}")
-        return "support@airline.com"  # Changed default error email
+    """Get department email from the in-memory department directory"""
+    email = department_directory.lookup(department_name)
+    print(f"Found email for department '{department_name}': {email}")
+    return email
 
-def handle_satisfaction_response(query, is_authenticated, user_data=None):
+async def ahandle_satisfaction_response(query, is_authenticated, user_data=None, session_key=None):
     """
     Handle YES/NO responses to satisfaction questions
     
@@ -320,12 +443,12 @@ def handle_satisfaction_response(query, is_authenticated, user_data=None):
         user_data (dict, optional): User's contact information, includes:
             - email (str): User's email address
             - phone (str): User's phone number
+        session_key (str, optional): Session whose conversation is escalated
     """
-    client = ollama.Client()
-    
+    started = time.perf_counter()
     if query.strip().upper() == 'NO':
         # When user says NO, extract their previous query and categorize it
-        last_user_query = get_last_user_query()
+        last_user_query = await sync_to_async(get_last_user_query)(session_key)
         
         if not user_data or not user_data.get('email'):
             # If user data not provided, ask for contact information
@@ -333,7 +456,8 @@ def handle_satisfaction_response(query, is_authenticated, user_data=None):
             
             # Log the conversation
             if is_authenticated:
-                log_chat_history(query, response_message, "Support System")
+                await sync_to_async(log_chat_history)(query, response_message, "Support System", session_key)
+            trace_satisfaction(query, response_message, started, "needs_contact_info")
             
             return {
                 'response': response_message,
@@ -345,33 +469,31 @@ def handle_satisfaction_response(query, is_authenticated, user_data=None):
         # We have user data, proceed with department routing and email
         if last_user_query:
             # Categorize department
-            department, department_email = categorize_department(last_user_query, client)
-            
-            # Get the full chat history
-            chat_history = get_chat_history()
+            department, department_email = await acategorize_department(last_user_query)
             
-            # Send email to department
-            email_sent = send_support_email(
-                department_email,
-                user_data.get('email', 'Not provided'),
-                user_data.get('phone', 'Not provided'),
-                chat_history
+            # Queue the conversation for the department; the outbox sender delivers it in the background
+            email_queued = await sync_to_async(escalate_conversation)(
+                department_email, user_data, session_key
             )
-            clear_chat_history()
             
-            if email_sent:
+            outcome = "escalated" if email_queued else "escalation_not_queued"
+            if email_queued:
                 response_message = f"Thank you. Your request has been forwarded to our {department}. They will contact you at {user_data.get('email')} within 12 hours."
             else:
-                # If email sending fails, still acknowledge the request but note the technical issue
+                # If the email could not be queued, still acknowledge the request but note the technical issue
                 response_message = f"Thank you. Your request has been recorded for our {department}. However, due to a technical issue, there may be a delay in response. They will aim to contact you at {user_data.get('email')} within 12 hours."
                 # Log the email failure for internal tracking
-                print(f"ALERT: Failed to send support email to {department_email} for user {user_data.get('email')}")
+                print(f"ALERT: Failed to queue support email to {department_email} for user {user_data.get('email')}")
         else:
             response_message = "Thank you. Our support team will reach you within 12 hours."
+            outcome = "no_history"
         
         # Log the conversation
         if is_authenticated:
-            log_chat_history(f"Contact information provided: {user_data}", response_message, "Support System")
+            await sync_to_async(log_chat_history)(
+                f"Contact information provided: {user_data}", response_message, "Support System", session_key
+            )
+        trace_satisfaction(query, response_message, started, outcome)
         
         return {
             'response': response_message,
@@ -383,31 +505,94 @@ def handle_satisfaction_response(query, is_authenticated, user_data=None):
         
         # Log the conversation
         if is_authenticated:
-            log_chat_history(query, response_message, "Support System")
+            await sync_to_async(log_chat_history)(query, response_message, "Support System", session_key)
+        trace_satisfaction(query, response_message, started, "satisfied")
         
         return {
             'response': response_message,
             'source': "Support System"
         }
 
-def process_chat_query(query, output_language, is_authenticated):
+def trace_satisfaction(query, response_message, started, outcome):
+    """Trace a reply to the satisfaction question, with how it was handled as the outcome"""
+    record_turn("satisfaction", query, None, None, response_message, {
+        "total": (time.perf_counter() - started) * 1000
+    }, outcome=outcome)
+
+def escalate_conversation(department_email, user_data, session_key=None):
+    """Email the session's conversation to the department and forget it; False if the email could not be queued"""
+    # Get the full chat history
+    chat_history = get_chat_history(session_key)
+    
+    subject, body = build_support_email(
+        user_data.get('email', 'Not provided'),
+        user_data.get('phone', 'Not provided'),
+        chat_history
+    )
+    email_queued = queue_support_email(department_email, subject, body)
+    clear_chat_history(session_key)
+    return email_queued
+
+async def aprocess_chat_query(query, output_language, is_authenticated, session_key=None):
     """Process a chat query and return the response"""
-    client = ollama.Client()
+    events = await astream_chat_query(query, output_language, is_authenticated, session_key, endpoint="chat")
+    parts = []
+    async with aclosing(events):
+        async for event in events:
+            if "token" in event:
+                parts.append(event["token"])
+            else:
+                done = event
     
-    # Query collection and get response
+    return {
+        'response': "".join(parts).strip(),
+        'source': done["source"],
+        'send_satisfaction_prompt': True  # Flag to send a separate satisfaction message
+    }
+
+async def astream_chat_query(query, output_language, is_authenticated, session_key=None, endpoint="stream"):
+    """
+    Answer a chat query as a stream of events.
+
+    Admission control and retrieval (in a worker thread) run before this returns, so SchedulerBusy,
+    IndexNotReady and retrieval errors surface before any response is sent. The returned async generator yields
+    {"token": ...} events as the model produces the answer, then a final
+    {"done": True, "source": ..., "send_satisfaction_prompt": True} event.
+    """
+    started = time.perf_counter()
     try:
-        source_pdf, closest_matches = query_collection(query, client)
-        context = " ".join(closest_matches)
-        llama_response = get_llama_response(context, query, output_language, client)
-        
-        # Log the conversation
-        if is_authenticated:
-            log_chat_history(query, llama_response, source_pdf)
-        
-        return {
-            'response': llama_response,
-            'source': source_pdf,
-            'send_satisfaction_prompt': True  # Flag to send a separate satisfaction message
-        }
+        scheduler.admit(INTERACTIVE)
+        retrieval = await sync_to_async(retrieve, thread_sensitive=False)(query, get_client())
+    except (IndexNotReady, SchedulerBusy):
+        raise
     except Exception as e:
-        raise Exception(f"Error processing query: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error processing query: {str(e)}")
+    return astream_events(query, output_language, is_authenticated, retrieval, started, session_key, endpoint)
+
+async def astream_events(query, output_language, is_authenticated, retrieval, started, session_key=None, endpoint="stream"):
+    parts = []
+    first_token_ms = None
+    # Closing this stream (e.g. the client went away) closes the generation and frees its slot
+    async with aclosing(astream_answer(query, output_language, retrieval)) as pieces:
+        async for piece in pieces:
+            if not parts:
+                # Time to first token: what the user actually waits for
+                first_token_ms = (time.perf_counter() - started) * 1000
+                metrics.observe("chat_first_token_ms", first_token_ms)
+            parts.append(piece)
+            yield {"token": piece}
+    total_ms = (time.perf_counter() - started) * 1000
+    metrics.observe("chat_stream_ms", total_ms)
+
+    llama_response = "".join(parts).strip()
+    if is_authenticated:
+        await sync_to_async(log_chat_history)(query, llama_response, retrieval["source"], session_key)
+    record_turn(endpoint, query, output_language, retrieval, llama_response, {
+        "retrieval": retrieval["ms"], "first_token": first_token_ms or total_ms, "total": total_ms
+    }, outcome=answer_outcome(llama_response))
+
+    yield {
+        "done": True,
+        "source": retrieval["source"],
+        "send_satisfaction_prompt": True
+    }
@@ -0,0 +1,146 @@
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+# "memory": per-process ring buffers (one worker, or sticky sessions).
+# "db": the ConversationTurn table, shared by every worker process.
+CONVERSATION_STORE_BACKEND = getattr(settings, 'CONVERSATION_STORE_BACKEND', 'memory')
+CONVERSATION_MAX_TURNS = getattr(settings, 'CONVERSATION_MAX_TURNS', 50)  # Turns kept per session
+CONVERSATION_MAX_SESSIONS = getattr(settings, 'CONVERSATION_MAX_SESSIONS', 10000)  # Sessions kept in memory
+CONVERSATION_TTL_DAYS = getattr(settings, 'CONVERSATION_TTL_DAYS', 30)  # Age at which `manage.py prune_conversations` drops turns
+
+SUPPORT_SOURCE = "Support System"  # Turns with this source are not customer questions
+
+# Conversations logged without a session key (e.g. outside a request) share one history
+GLOBAL_SESSION = ""
+
+
+def render_history(turns) -> str:
+    """Turns as text in the USER:/BOT: format used in support emails"""
+    lines = []
+    for user_message, bot_message, source in turns:
+        lines.append(f"USER: {user_message}\n")
+        lines.append(f"BOT: {bot_message}")
+        if source and source != SUPPORT_SOURCE:
+            lines.append(f" (Source: {source})")
+        lines.append("\n\n")
+    return "".join(lines)
+
+
+class _Conversation:
+    __slots__ = ("turns", "last_query")
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)  # (user message, bot message, source)
+        self.last_query = None
+
+
+class MemoryConversationStore:
+    """
+    Conversations held in this process: one bounded ring buffer of turns per
+    session, with the least recently active sessions evicted beyond
+    `max_sessions`. The last customer question is kept alongside the buffer,
+    so looking it up never scans the history.
+    """
+
+    def __init__(self, max_turns: int, max_sessions: int):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session key -> _Conversation
+        self._lock = threading.Lock()
+
+    def append(self, session_key, user_message, bot_message, source=""):
+        key = session_key or GLOBAL_SESSION
+        with self._lock:
+            conversation = self._sessions.get(key)
+            if conversation is None:
+                conversation = self._sessions[key] = _Conversation(self.max_turns)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(key)
+            conversation.turns.append((user_message, bot_message, source))
+            if source != SUPPORT_SOURCE:
+                conversation.last_query = user_message
+
+    def last_user_query(self, session_key):
+        with self._lock:
+            conversation = self._sessions.get(session_key or GLOBAL_SESSION)
+            return conversation.last_query if conversation else None
+
+    def turns(self, session_key) -> list:
+        with self._lock:
+            conversation = self._sessions.get(session_key or GLOBAL_SESSION)
+            return list(conversation.turns) if conversation else []
+
+    def clear(self, session_key):
+        with self._lock:
+            self._sessions.pop(session_key or GLOBAL_SESSION, None)
+
+
+class DatabaseConversationStore:
+    """
+    Conversations in the ConversationTurn table, so every worker process sees
+    the same history. Each append drops the session's turns beyond the newest
+    `max_turns`; turns of abandoned sessions are removed by prune_expired.
+    """
+
+    def __init__(self, max_turns: int):
+        self.max_turns = max_turns
+
+    def append(self, session_key, user_message, bot_message, source=""):
+        from .models import ConversationTurn
+        key = session_key or GLOBAL_SESSION
+        ConversationTurn.objects.create(
+            session_key=key,
+            user_message=user_message,
+            bot_message=bot_message,
+            source=source or "",
+        )
+        # Newest turn that no longer fits; everything from it back is dropped
+        stale = list(
+            ConversationTurn.objects.filter(session_key=key)
+            .order_by('-id')
+            .values_list('id', flat=True)[self.max_turns:self.max_turns + 1]
+        )
+        if stale:
+            ConversationTurn.objects.filter(session_key=key, id__lte=stale[0]).delete()
+
+    def last_user_query(self, session_key):
+        from .models import ConversationTurn
+        return (
+            ConversationTurn.objects.filter(session_key=session_key or GLOBAL_SESSION)
+            .exclude(source=SUPPORT_SOURCE)
+            .order_by('-id')
+            .values_list('user_message', flat=True)
+            .first()
+        )
+
+    def turns(self, session_key) -> list:
+        from .models import ConversationTurn
+        rows = (
+            ConversationTurn.objects.filter(session_key=session_key or GLOBAL_SESSION)
+            .order_by('-id')
+            .values_list('user_message', 'bot_message', 'source')[:self.max_turns]
+        )
+        return list(reversed(rows))
+
+    def clear(self, session_key):
+        from .models import ConversationTurn
+        ConversationTurn.objects.filter(session_key=session_key or GLOBAL_SESSION).delete()
+
+    def prune_expired(self, max_age_days: float = CONVERSATION_TTL_DAYS) -> int:
+        """Delete turns older than `max_age_days`; returns the number deleted"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import ConversationTurn
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+        deleted, _ = ConversationTurn.objects.filter(created_at__lt=cutoff).delete()
+        return deleted
+
+
+if CONVERSATION_STORE_BACKEND == 'db':
+    conversation_store = DatabaseConversationStore(CONVERSATION_MAX_TURNS)
+else:
+    conversation_store = MemoryConversationStore(CONVERSATION_MAX_TURNS, CONVERSATION_MAX_SESSIONS)
@@ -0,0 +1,73 @@
+import threading
+
+DEFAULT_DEPARTMENT_EMAIL = "support@airline.com"
+
+
+class DepartmentDirectory:
+    """
+    In-process copy of the DepartmentEmail table.
+
+    Loaded through the ORM on the first lookup and dropped whenever a
+    DepartmentEmail row is saved or deleted (see connect_signals), so lookups
+    are a dict access instead of a database round trip.
+    """
+
+    def __init__(self):
+        self._emails = None  # (lower-cased department name, email) pairs in id order
+        self._by_name = None  # lower-cased department name -> email
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._by_name is None:
+                from .models import DepartmentEmail
+                rows = [(name.lower(), email) for name, email in DepartmentEmail.objects.order_by("id").values_list("department_name", "email")]
+                self._emails = rows
+                self._by_name = dict(rows)
+                print(f"Loaded {len(rows)} department emails")
+            return self._emails, self._by_name
+
+    def clear(self):
+        with self._lock:
+            self._emails = None
+            self._by_name = None
+
+    def invalidate(self, using=None, **kwargs):
+        """
+        Signal receiver: reload on the next lookup. Cleared again once the
+        transaction commits, so a lookup made before then cannot keep old rows.
+        """
+        from django.db import transaction
+        self.clear()
+        transaction.on_commit(self.clear, using=using)
+
+    def lookup(self, department_name: str) -> str:
+        """
+        Email for a department: exact (case-insensitive) name match first, then
+        the first department whose name contains the first word of the query.
+        """
+        try:
+            emails, by_name = self._load()
+        except Exception as e:
+            print(f"Database error: {e}")
+            return DEFAULT_DEPARTMENT_EMAIL
+
+        email = by_name.get(department_name.lower())
+        if email is None and department_name.split():
+            first_word = department_name.split()[0].lower()
+            email = next((address for name, address in emails if first_word in name), None)
+            print(f"Partial match with '{first_word}' result: {email}")
+
+        if email is None:
+            print(f"WARNING: No email found for department: '{department_name}'")
+            return DEFAULT_DEPARTMENT_EMAIL
+        return email
+
+    def connect_signals(self):
+        from django.db.models.signals import post_delete, post_save
+        from .models import DepartmentEmail
+        post_save.connect(self.invalidate, sender=DepartmentEmail, dispatch_uid="department_directory_save")
+        post_delete.connect(self.invalidate, sender=DepartmentEmail, dispatch_uid="department_directory_delete")
+
+
+department_directory = DepartmentDirectory()
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .pdf_processor import get_embeddings
+
+# Minimum cosine-similarity lead of the best department over the runner-up;
+# closer calls are left to the LLM (override in llm/settings.py)
+DEPARTMENT_ROUTER_MIN_MARGIN = getattr(settings, 'DEPARTMENT_ROUTER_MIN_MARGIN', 0.05)
+
+# What each department handles, phrased the way customers ask. Every line is
+# embedded and a department's prototype is the mean of its lines.
+DEPARTMENT_DESCRIPTIONS = {
+    "Baggage Services Department": [
+        "Questions regarding carry-on and checked baggage limits",
+        "Lost, delayed, or damaged baggage inquiries",
+        "Prohibited item clarification and excess baggage charges",
+        "How many kilograms of luggage can I take on the plane?",
+        "My suitcase did not arrive at the destination airport",
+    ],
+    "Customer Experience Department": [
+        "Booking changes, cancellations, and refund processing",
+        "Assistance with check-in procedures and upgrades",
+        "Loyalty program inquiries and point redemptions",
+        "I want to change the date of my reservation and get a refund",
+        "How do I use my miles to upgrade my seat?",
+    ],
+    "Flight Operations Department": [
+        "Flight cancellations, delays, and rebooking requests",
+        "Emergency guidelines and onboard safety instructions",
+        "Compensation for disrupted flights",
+        "My flight was delayed by five hours, what compensation do I get?",
+        "The airline cancelled my flight, how do I get rebooked?",
+    ],
+    "Special Services Department": [
+        "Wheelchair requests and assistance for passengers with disabilities",
+        "Medical equipment handling and medical condition accommodations",
+        "Pet travel arrangements and service animal guidelines",
+        "Can I bring my dog in the cabin?",
+        "I need to travel with an oxygen concentrator",
+    ],
+    "Security and Compliance Department": [
+        "Passenger data protection and privacy concerns",
+        "Identity verification and security checks",
+        "Emergency contact support and crisis management",
+        "How is my personal information stored and shared?",
+        "What identification documents do I need at the security check?",
+    ],
+}
+
+
+class DepartmentRouter:
+    """
+    Routes an escalated query to a department with one embedding and a cosine
+    similarity against precomputed department prototypes, instead of a full
+    LLM generation. Prototype embeddings go through the embedding cache, so
+    they are only computed the first time a process routes a query.
+    """
+
+    def __init__(self, descriptions: dict, min_margin: float):
+        self.departments = list(descriptions)
+        self.descriptions = descriptions
+        self.min_margin = min_margin
+        self._prototypes = None  # (departments x dim) matrix of unit vectors
+        self._lock = threading.Lock()
+
+    def _load_prototypes(self, client):
+        with self._lock:
+            if self._prototypes is None:
+                lines = [line for department in self.departments for line in self.descriptions[department]]
+                vectors = np.asarray(get_embeddings(lines, client), dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                prototypes = []
+                start = 0
+                for department in self.departments:
+                    end = start + len(self.descriptions[department])
+                    prototypes.append(vectors[start:end].mean(axis=0))
+                    start = end
+                prototypes = np.stack(prototypes)
+                prototypes /= np.maximum(np.linalg.norm(prototypes, axis=1, keepdims=True), 1e-12)
+                self._prototypes = prototypes
+            return self._prototypes
+
+    def classify(self, query: str, client):
+        """Return (best department, margin over the runner-up, {department: similarity})"""
+        prototypes = self._load_prototypes(client)
+        query_vector = np.asarray(get_embeddings([query], client)[0], dtype=np.float32)
+        similarities = prototypes @ (query_vector / max(float(np.linalg.norm(query_vector)), 1e-12))
+        ranked = np.argsort(similarities)[::-1]
+        margin = float(similarities[ranked[0]] - similarities[ranked[1]])
+        scores = {department: round(float(score), 4) for department, score in zip(self.departments, similarities)}
+        return self.departments[ranked[0]], margin, scores
+
+    def route(self, query: str, client):
+        """The department when the prototypes agree clearly enough, else None (ask the LLM)"""
+        started = time.perf_counter()
+        try:
+            department, margin, scores = self.classify(query, client)
+        except Exception as e:
+            print(f"Embedding router failed, falling back to the LLM: {e}")
+            return None
+        metrics.observe("department_route_embedding_ms", (time.perf_counter() - started) * 1000)
+        print(f"Embedding router scores: {scores} (margin {margin:.3f})")
+        if margin < self.min_margin:
+            metrics.increment("department_route_llm_fallback")
+            return None
+        metrics.increment("department_route_embedding")
+        return department
+
+
+department_router = DepartmentRouter(DEPARTMENT_DESCRIPTIONS, DEPARTMENT_ROUTER_MIN_MARGIN)
@@ -0,0 +1,155 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics
+
+# Send from a thread in each web process; turn off when `manage.py send_outbox --loop` runs separately
+EMAIL_OUTBOX_ENABLED = getattr(settings, 'EMAIL_OUTBOX_ENABLED', True)
+EMAIL_OUTBOX_POLL_INTERVAL = getattr(settings, 'EMAIL_OUTBOX_POLL_INTERVAL', 10)  # seconds between checks for due messages
+EMAIL_OUTBOX_MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 8)
+EMAIL_OUTBOX_BACKOFF = getattr(settings, 'EMAIL_OUTBOX_BACKOFF', 30)  # seconds before the first retry, doubled after each failure
+EMAIL_OUTBOX_MAX_BACKOFF = getattr(settings, 'EMAIL_OUTBOX_MAX_BACKOFF', 3600)
+EMAIL_OUTBOX_IDLE_TIMEOUT = getattr(settings, 'EMAIL_OUTBOX_IDLE_TIMEOUT', 60)  # seconds an unused SMTP session stays open
+EMAIL_OUTBOX_LEASE = 300  # seconds a claimed message is hidden from other senders
+
+_sender_thread = None
+_sender_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def queue_support_email(to_email: str, subject: str, body: str) -> bool:
+    """Store a message in the outbox and wake the sender. Returns False if it could not be stored."""
+    from .models import EmailOutbox
+    try:
+        EmailOutbox.objects.create(to_email=to_email, subject=subject, body=body)
+    except Exception as e:
+        print(f"Failed to queue support email: {e}")
+        return False
+    metrics.increment("email_queued")
+    if EMAIL_OUTBOX_ENABLED:
+        start_outbox_sender()
+        transaction.on_commit(_wakeup.set)
+    return True
+
+
+def start_outbox_sender():
+    """Start the background sender thread once per process"""
+    global _sender_thread
+    with _sender_lock:
+        if _sender_thread is None or not _sender_thread.is_alive():
+            _sender_thread = threading.Thread(target=run_sender, name="email-outbox", daemon=True)
+            _sender_thread.start()
+
+
+def run_sender():
+    """Send due messages until the process exits, waking early when a message is queued"""
+    sender = OutboxSender()
+    while True:
+        _wakeup.wait(EMAIL_OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            close_old_connections()
+            sender.send_due()
+        except Exception as e:
+            print(f"Email outbox sender error: {e}")
+        finally:
+            close_old_connections()
+        sender.close_if_idle()
+
+
+class OutboxSender:
+    """
+    Sends due outbox messages over one SMTP session, reused across messages
+    and reopened when the server drops it. A failed message is retried with
+    exponential backoff and marked failed after EMAIL_OUTBOX_MAX_ATTEMPTS.
+    """
+
+    def __init__(self):
+        self.smtp = None
+        self.last_used = 0.0
+
+    def send_due(self) -> int:
+        """Send every message that is due; returns the number sent"""
+        from .models import EmailOutbox
+        sent = 0
+        now = timezone.now()
+        due = EmailOutbox.objects.filter(status=EmailOutbox.PENDING, next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        for message in list(due[:100]):
+            # Claim the message so another worker process does not send it too;
+            # if this process dies mid-send it becomes due again after the lease.
+            claimed = EmailOutbox.objects.filter(
+                pk=message.pk, status=EmailOutbox.PENDING, next_attempt_at=message.next_attempt_at
+            ).update(next_attempt_at=now + timedelta(seconds=EMAIL_OUTBOX_LEASE))
+            if not claimed:
+                continue
+            if self._send(message):
+                sent += 1
+        return sent
+
+    def _send(self, message) -> bool:
+        import smtplib
+        from .email_system import build_message
+        started = time.perf_counter()
+        msg = build_message(message.to_email, message.subject, message.body)
+        try:
+            try:
+                self._session().send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                # The server closed the reused session: reconnect once and resend
+                print(f"SMTP session lost ({e}), reconnecting")
+                self.close()
+                self._session().send_message(msg)
+        except Exception as e:
+            self.close()
+            self._record_failure(message, e)
+            return False
+
+        self.last_used = time.monotonic()
+        message.status = message.SENT
+        message.sent_at = timezone.now()
+        message.attempts += 1
+        message.last_error = ""
+        message.save(update_fields=['status', 'sent_at', 'attempts', 'last_error'])
+        metrics.increment("email_sent")
+        metrics.observe("email_send_ms", (time.perf_counter() - started) * 1000)
+        print(f"[*] Support email {message.pk} sent to {message.to_email}")
+        return True
+
+    def _record_failure(self, message, error):
+        message.attempts += 1
+        message.last_error = str(error)
+        if message.attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+            message.status = message.FAILED
+            metrics.increment("email_failed")
+            print(f"ALERT: Giving up on support email {message.pk} to {message.to_email} after {message.attempts} attempts: {error}")
+        else:
+            delay = min(EMAIL_OUTBOX_BACKOFF * 2 ** (message.attempts - 1), EMAIL_OUTBOX_MAX_BACKOFF)
+            message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+            metrics.increment("email_retried")
+            print(f"Failed to send support email {message.pk} (attempt {message.attempts}), retrying in {delay}s: {error}")
+        message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    def _session(self):
+        from .email_system import open_smtp_session
+        if self.smtp is None:
+            self.smtp = open_smtp_session()
+        return self.smtp
+
+    def close_if_idle(self):
+        if self.smtp is not None and time.monotonic() - self.last_used > EMAIL_OUTBOX_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+            print("[*] Connection closed")
+        except Exception:
+            self.smtp.close()
+        self.smtp = None
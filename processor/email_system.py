@@ -1,33 +1,62 @@
-import getpass
-import smtplib
-import traceback
 import os
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
 
-# Gmail SMTP settings
-HOST = "smtp.gmail.com"
-PORT = 587
+from django.conf import settings
 
-# Email credentials - replace with your Gmail account
-FROM_EMAIL = "prabhjotsingh0423@gmail.com"  # Replace with your Gmail address
-PASSWORD = getpass.getpass("Enter your Gmail app password: ")  # You need to create an app password in your Google account
+# smtplib and the email package are imported on first send, keeping this
+# module cheap to import for every worker and management command.
 
-def send_support_email(department_email, user_email, user_phone, chat_history):
+# SMTP server for support emails (Gmail by default). Point these at a local
+# stand-in to test without a real mailbox, e.g.
+#   python -m aiosmtpd -n -l localhost:1025
+# with SUPPORT_SMTP_HOST = "localhost", SUPPORT_SMTP_PORT = 1025, SUPPORT_SMTP_USE_TLS = False
+HOST = getattr(settings, 'SUPPORT_SMTP_HOST', "smtp.gmail.com")
+PORT = getattr(settings, 'SUPPORT_SMTP_PORT', 587)
+USE_TLS = getattr(settings, 'SUPPORT_SMTP_USE_TLS', True)
+SMTP_TIMEOUT = getattr(settings, 'SUPPORT_SMTP_TIMEOUT', 30)  # seconds
+SMTP_DEBUG = getattr(settings, 'SUPPORT_SMTP_DEBUG', 0)  # smtplib debug level
+
+# Email credentials, resolved on first send (see get_credentials). For Gmail
+# the password is an app password created in your Google account.
+DEFAULT_FROM_EMAIL = "prabhjotsingh0423@gmail.com"
+DEFAULT_PASSWORD_FILE = "/run/secrets/support_email_password"
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+def get_credentials():
     """
-    Send an email to the department's email address with the user's chat history
-    and contact information using Gmail SMTP.
+    (sender address, password or None), looked up once, on first use, from:
+    the SUPPORT_EMAIL_FROM / SUPPORT_EMAIL_PASSWORD settings, then environment
+    variables of the same names, then the secrets file named by
+    SUPPORT_EMAIL_PASSWORD_FILE (setting or environment variable).
+    Never prompts, so headless workers start unattended.
     """
-    try:
-        TO_EMAIL = department_email   # Keep your recipient
-        
-        # Create a proper MIME message
-        msg = MIMEMultipart()
-        msg['From'] = FROM_EMAIL
-        msg['To'] = TO_EMAIL
-        msg['Subject'] = "Mail sent using Python"
-        
-        body = f"""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            from_email = getattr(settings, 'SUPPORT_EMAIL_FROM', None) or os.environ.get('SUPPORT_EMAIL_FROM') or DEFAULT_FROM_EMAIL
+            password = getattr(settings, 'SUPPORT_EMAIL_PASSWORD', None) or os.environ.get('SUPPORT_EMAIL_PASSWORD')
+            if not password:
+                password_file = (
+                    getattr(settings, 'SUPPORT_EMAIL_PASSWORD_FILE', None)
+                    or os.environ.get('SUPPORT_EMAIL_PASSWORD_FILE')
+                    or DEFAULT_PASSWORD_FILE
+                )
+                try:
+                    with open(password_file, "r") as f:
+                        password = f.read().strip() or None
+                except OSError:
+                    password = None
+            if not password:
+                print("WARNING: No support email password configured; sending without SMTP login")
+            _credentials = (from_email, password)
+        return _credentials
+
+def build_support_email(user_email, user_phone, chat_history):
+    """Subject and body of the email sent to a department for an escalated chat"""
+    subject = "Mail sent using Python"
+    body = f"""
         New support request received:
         
         User Contact Information:
@@ -37,59 +66,59 @@ def send_support_email(department_email, user_email, user_phone, chat_history):
         Chat History:
         {chat_history}
         """
-        
-        msg.attach(MIMEText(body, 'plain'))
+    return subject, body
 
-        # Create SMTP session
-        smtp = smtplib.SMTP(HOST, PORT)
-        
-        # Debug output
-        smtp.set_debuglevel(1)
-        
+def build_message(to_email, subject, body):
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    
+    msg = MIMEMultipart()
+    msg['From'] = get_credentials()[0]
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+def open_smtp_session():
+    """
+    Connect, start TLS and log in. The caller keeps the session open to send
+    several messages and closes it with quit().
+    """
+    import smtplib
+    
+    from_email, password = get_credentials()
+    smtp = smtplib.SMTP(HOST, PORT, timeout=SMTP_TIMEOUT)
+    smtp.set_debuglevel(SMTP_DEBUG)
+    try:
         # Identify ourselves to the server
         smtp.ehlo()
-        print("[*] Connected to server")
-        
-        # Start TLS encryption
-        smtp.starttls()
-        print("[*] TLS encryption started")
-        
-        # Re-identify ourselves over TLS connection
-        smtp.ehlo()
-        
-        # Login to server
-        smtp.login(FROM_EMAIL, PASSWORD)
-        print("[*] Logged in successfully")
-        
-        # Send email
-        smtp.send_message(msg)
-        print("[*] Email sent successfully!")
+        print(f"[*] Connected to {HOST}:{PORT}")
         
-        # Close connection
-        smtp.quit()
-        print("[*] Connection closed")
+        if USE_TLS:
+            # Start TLS encryption and re-identify over the TLS connection
+            smtp.starttls()
+            smtp.ehlo()
+            print("[*] TLS encryption started")
         
-        return True
-
-        
-    except Exception as e:
-        print(f"Failed to send support email: {e}")
-        traceback.print_exc()  # Print full stack trace for debugging
-        return False
+        if password:
+            smtp.login(from_email, password)
+            print("[*] Logged in successfully")
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
 
-def get_chat_history():
+def get_chat_history(session_key=None):
     """
-    Read the chat history from the log file.
+    Render the session's conversation for a support email.
     
     Returns:
-        str: The content of the chat history or an error message
+        str: The chat history or a placeholder when there is none
     """
+    from .conversation_store import conversation_store, render_history
     try:
-        filepath = os.path.join("chat_logs", "userhistory.txt")
-        if os.path.exists(filepath):
-            with open(filepath, "r") as f:
-                return f.read()
-        return "No chat history available."
+        turns = conversation_store.turns(session_key)
+        return render_history(turns) if turns else "No chat history available."
     except Exception as e:
         print(f"Error reading chat history: {e}")
-        return f"Error retrieving chat history: {str(e)}"
\ No newline at end of file
+        return f"Error retrieving chat history: {str(e)}"
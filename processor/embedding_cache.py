@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+
+def normalize_text(text: str) -> str:
+    """Normalise text before hashing so whitespace and Unicode variants share an entry"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by model name and normalised text hash.
+
+    Vectors are stored as float32 blobs in a SQLite file, which is safe to share
+    between threads (one connection per thread) and between worker processes.
+    When the cache grows past `max_entries` the least recently used entries are
+    evicted. Hit and miss counters are kept per process.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model: str, texts: list) -> list:
+        """Return the cached vector for each text, or None where it is not cached"""
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        conn = self._connection()
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((key, array("f", blob).tolist()) for key, blob in rows)
+
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+
+        results = [found.get(key) for key in keys]
+        hits = sum(1 for result in results if result is not None)
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: list, vectors: list):
+        now = time.time()
+        rows = [(cache_key(model, text), array("f", vector).tobytes(), now) for text, vector in zip(texts, vectors)]
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._evict(conn)
+
+    def _evict(self, conn):
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        # Evict a little more than needed so eviction doesn't run on every insert
+        excess += self.max_entries // 20
+        deleted = conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        ).rowcount
+        with self._stats_lock:
+            self.evictions += deleted
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        lookups = hits + misses
+        try:
+            (size,) = self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        except sqlite3.Error:
+            size = None
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "evictions": evictions,
+            "entries": size,
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,169 @@
+import threading
+import time
+
+# The active collection is built once in a background thread and shared by all
+# request threads; requests never build it themselves.
+_collection = None
+_ready = threading.Event()
+_lock = threading.Lock()
+_warmup_thread = None  # Only one build (warm-up or reload) runs at a time
+_watcher_thread = None
+_swap_listeners = []  # Called with the new collection after every swap to a new generation
+_last_error = None
+_started_at = None
+_ready_at = None
+
+
+class IndexNotReady(Exception):
+    """Raised when a query arrives before the policy index has finished building"""
+
+
+def start_index_warmup():
+    """
+    Start building the index in a background thread, if it isn't built or building already.
+
+    Safe to call from any number of threads: only one build ever runs at a time,
+    and a failed build is retried on the next call.
+    """
+    global _warmup_thread, _started_at
+    if _ready.is_set():
+        return
+    with _lock:
+        if _ready.is_set() or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+        _started_at = time.time()
+        _warmup_thread = threading.Thread(target=_build_index, name="index-warmup", daemon=True)
+        _warmup_thread.start()
+        print("Started background index warm-up")
+
+
+def _build_index():
+    global _last_error, _ready_at
+    from .pdf_processor import initialize_pdf_collection
+
+    try:
+        collection = initialize_pdf_collection()
+        error = None if collection is not None else "PDF collection initialization failed"
+    except Exception as e:
+        collection = None
+        error = str(e)
+    if collection is None:
+        _last_error = error
+        print(f"Index warm-up failed: {error}")
+        return
+    _last_error = None
+    _ready_at = time.time()
+    swap_collection(collection)
+    print(f"Index ready after {_ready_at - _started_at:.1f}s")
+
+
+def start_index_reload() -> bool:
+    """
+    Rebuild the index in the background and swap it in when complete.
+
+    Queries keep using the current collection until the swap. Returns False
+    if a build is already running.
+    """
+    global _warmup_thread
+    with _lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return False
+        _warmup_thread = threading.Thread(target=_reload_index, name="index-reload", daemon=True)
+        _warmup_thread.start()
+        print("Started background index reload")
+        return True
+
+
+def _reload_index():
+    global _last_error
+    from .pdf_processor import sync_pdf_collection
+
+    started = time.time()
+    try:
+        collection = sync_pdf_collection()
+    except Exception as e:
+        _last_error = f"Reload failed: {e}"
+        print(f"Index reload failed, keeping the current collection: {e}")
+        return
+    _last_error = None
+    swap_collection(collection)
+    print(f"Index reload finished in {time.time() - started:.1f}s")
+
+
+def swap_collection(collection):
+    """Atomically make `collection` the one all new queries use"""
+    global _collection
+    with _lock:
+        previous = _collection
+        _collection = collection
+        _ready.set()
+    if previous is not None and previous.name != collection.name:
+        print(f"Swapped active collection {previous.name} -> {collection.name}")
+        for listener in _swap_listeners:
+            listener(collection)
+
+
+def on_collection_swap(listener):
+    """Register a callback run whenever a new collection generation is swapped in"""
+    _swap_listeners.append(listener)
+
+
+def start_pdf_watcher(interval: float, rebuild: bool = True):
+    """
+    Poll PDF_FOLDER_PATH and the index manifest every `interval` seconds.
+
+    A changed folder triggers a background rebuild (when `rebuild` is true), and a
+    manifest switched to a new generation by another process, for example
+    `manage.py reindex_pdfs`, is swapped in without rebuilding.
+    """
+    global _watcher_thread
+    with _lock:
+        if _watcher_thread is not None and _watcher_thread.is_alive():
+            return
+        _watcher_thread = threading.Thread(target=_watch_pdfs, args=(interval, rebuild), name="pdf-watcher", daemon=True)
+        _watcher_thread.start()
+    print(f"Watching PDF folder for changes every {interval}s")
+
+
+def _watch_pdfs(interval, rebuild):
+    from .pdf_processor import load_manifest, open_active_collection, pdf_folder_signature
+
+    seen = pdf_folder_signature()
+    while True:
+        time.sleep(interval)
+        try:
+            building = _warmup_thread is not None and _warmup_thread.is_alive()
+            active_name = load_manifest().get("collection")
+            if _ready.is_set() and not building and active_name and active_name != _collection.name:
+                print(f"Manifest points at {active_name}, swapping it in")
+                swap_collection(open_active_collection())
+
+            signature = pdf_folder_signature()
+            if rebuild and signature != seen and _ready.is_set() and start_index_reload():
+                print("PDF folder changed")
+                seen = signature
+        except Exception as e:
+            print(f"Error in PDF watcher: {e}")
+
+
+def get_collection():
+    """Return the ready collection, or raise IndexNotReady (and kick off a build) without blocking"""
+    if not _ready.is_set():
+        start_index_warmup()
+        raise IndexNotReady("The policy documents are still being loaded. Please try again in a moment.")
+    return _collection
+
+
+def index_status() -> dict:
+    """Readiness details for the /readyz endpoint"""
+    building = _warmup_thread is not None and _warmup_thread.is_alive()
+    status = {
+        "ready": _ready.is_set(),
+        "building": building,
+        "collection": _collection.name if _collection is not None else None,
+        "error": _last_error,
+    }
+    if _started_at is not None:
+        end = _ready_at if _ready_at is not None else time.time()
+        status["warmup_seconds"] = round(end - _started_at, 1)
+    return status
@@ -0,0 +1,257 @@
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+
+import fitz
+
+from .pdf_processor import (
+    EMBEDDING_BATCH_SIZE,
+    PDF_EXTRACT_WORKERS,
+    add_chunks_in_batches,
+    chunk_pages,
+    ocr_image,
+)
+
+# Pipeline settings
+PIPELINE_PAGE_QUEUE_SIZE = 16  # Pages waiting for OCR
+PIPELINE_TEXT_QUEUE_SIZE = 16  # OCR'd pages waiting to be chunked
+PIPELINE_CHUNK_QUEUE_SIZE = EMBEDDING_BATCH_SIZE * 2  # Chunks waiting to be embedded
+PIPELINE_OCR_WINDOW = PDF_EXTRACT_WORKERS * 2  # Pages with OCR in flight at once
+PIPELINE_PROGRESS_INTERVAL = 5.0  # Seconds between progress reports
+
+STAGES = ("pages", "images", "chunks", "embedded")
+
+_DONE = object()  # End-of-stream marker passed down the queues
+
+
+def _ocr_here(data, width, height) -> Future:
+    """ocr_image in this thread, with its outcome in a Future like a pool submission"""
+    future = Future()
+    try:
+        future.set_result(ocr_image(data, width, height))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class IngestPipeline:
+    """
+    Staged ingestion: page extraction -> OCR -> chunking -> batched embedding and upsert.
+
+    Each stage runs in its own thread and hands work to the next through a
+    bounded queue, so a fast stage blocks instead of buffering a whole PDF and
+    peak memory stays flat whatever the size of the document. OCR runs in a
+    process pool with a bounded window of pages in flight, and pages leave the
+    OCR stage in their original order so chunk IDs stay stable.
+
+    Items on the queues are (kind, filename, payload) tuples where kind is
+    "start", "page" or "end" (and "chunk" after the chunking stage).
+    """
+
+    def __init__(self, collection, client, on_file_done=None, workers: int = PDF_EXTRACT_WORKERS, lexical_index=None):
+        self.collection = collection
+        self.lexical_index = lexical_index
+        self.client = client
+        self.on_file_done = on_file_done
+        self.workers = workers
+        self.pages = queue.Queue(maxsize=PIPELINE_PAGE_QUEUE_SIZE)
+        self.texts = queue.Queue(maxsize=PIPELINE_TEXT_QUEUE_SIZE)
+        self.chunks = queue.Queue(maxsize=PIPELINE_CHUNK_QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.finished = threading.Event()
+        self.errors = []
+        self.counts = dict.fromkeys(STAGES, 0)
+        self.counts_lock = threading.Lock()
+        self.started = 0.0
+
+    def run(self, pending: list) -> dict:
+        """Index the (filename, pdf_path, content_hash) entries in `pending` and return per-stage counts"""
+        self.started = time.perf_counter()
+        # Spawn fresh workers: forking this multithreaded server process could copy
+        # a lock held by another thread into the child and deadlock it
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        ) if self.workers > 1 else None
+        threads = [
+            threading.Thread(target=self._stage, args=("extract", self._extract, None, self.pages, pending), daemon=True),
+            threading.Thread(target=self._stage, args=("ocr", self._ocr, self.pages, self.texts, pool), daemon=True),
+            threading.Thread(target=self._stage, args=("chunk", self._chunk, self.texts, self.chunks), daemon=True),
+            threading.Thread(target=self._report_progress, daemon=True),
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            self._stage("embed", self._embed, self.chunks, None)
+            for thread in threads[:-1]:
+                thread.join()
+        finally:
+            self.finished.set()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        self._print_progress("done")
+        if self.errors:
+            raise self.errors[0]
+        return dict(self.counts, seconds=time.perf_counter() - self.started)
+
+    # Plumbing
+
+    def _stage(self, name, work, in_q, out_q, *args):
+        """Run one stage; on failure stop the pipeline but keep draining so no stage blocks forever"""
+        reader = _Reader(in_q) if in_q is not None else None
+        try:
+            work(reader, out_q, *args) if reader is not None else work(out_q, *args)
+        except Exception as e:
+            print(f"Ingest stage '{name}' failed: {e}")
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            if reader is not None:
+                reader.drain()
+            if out_q is not None:
+                out_q.put(_DONE)
+
+    def _count(self, stage, n=1):
+        with self.counts_lock:
+            self.counts[stage] += n
+
+    def _report_progress(self):
+        while not self.finished.wait(PIPELINE_PROGRESS_INTERVAL):
+            self._print_progress("running")
+
+    def _print_progress(self, state):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        with self.counts_lock:
+            counts = dict(self.counts)
+        stages = ", ".join(f"{stage}={count} ({count / elapsed:.1f}/s)" for stage, count in counts.items())
+        queued = f"queued pages={self.pages.qsize()} texts={self.texts.qsize()} chunks={self.chunks.qsize()}"
+        print(f"Ingest {state} after {elapsed:.1f}s: {stages}; {queued}")
+
+    # Stages
+
+    def _extract(self, out_q, pending):
+        for filename, pdf_path, _ in pending:
+            if self.stop.is_set():
+                break
+            print(f"Processing PDF: {filename}")
+            out_q.put(("start", filename, None))
+            try:
+                with fitz.open(pdf_path) as doc:
+                    for page in doc:
+                        if self.stop.is_set():
+                            break
+                        images = []
+                        for img_index, img in enumerate(page.get_images(full=True), start=1):
+                            base_image = doc.extract_image(img[0])
+                            images.append((img_index, base_image["image"], base_image.get("width", 0), base_image.get("height", 0)))
+                        out_q.put(("page", filename, (page.get_text(), images)))
+                        self._count("pages")
+            except Exception as e:
+                print(f"Error extracting text from {pdf_path}: {e}")
+            finally:
+                out_q.put(("end", filename, None))
+
+    def _ocr(self, reader, out_q, pool):
+        in_flight = deque()
+
+        def release(limit):
+            # Emit finished pages in their original order
+            while len(in_flight) > limit:
+                kind, filename, payload = in_flight.popleft()
+                if kind == "page":
+                    text, futures = payload
+                    payload = [text]
+                    for img_index, future in futures:
+                        try:
+                            image_text = future.result()
+                        except BrokenExecutor:
+                            # The pool is gone, not just this image: fail the stage so
+                            # the file is not recorded as synced without its OCR text
+                            raise
+                        except Exception as e:
+                            print(f"Error during OCR of image {img_index} in {filename}: {e}")
+                            continue
+                        self._count("images")
+                        if image_text is not None:
+                            payload.append(f"\n[Image {img_index} Text]: {image_text}")
+                out_q.put((kind, filename, payload))
+
+        for kind, filename, payload in reader:
+            if kind == "page":
+                text, images = payload
+                futures = [
+                    (img_index, pool.submit(ocr_image, data, width, height) if pool else _ocr_here(data, width, height))
+                    for img_index, data, width, height in images
+                ]
+                payload = (text, futures)
+            in_flight.append((kind, filename, payload))
+            release(PIPELINE_OCR_WINDOW)
+        release(0)
+
+    def _chunk(self, reader, out_q):
+        for kind, filename, _ in reader:
+            if kind != "start":
+                continue
+            out_q.put(("start", filename, None))
+            pieces = reader.file_pieces()
+            for chunk in chunk_pages(pieces, self.client):
+                if chunk:
+                    out_q.put(("chunk", filename, chunk))
+                    self._count("chunks")
+            for _ in pieces:  # Consume anything the chunker did not read
+                pass
+            out_q.put(("end", filename, None))
+
+    def _embed(self, reader, _):
+        batch = []
+        added = 0
+        for kind, filename, payload in reader:
+            if kind == "start":
+                added = 0
+            elif kind == "chunk":
+                batch.append(payload)
+                if len(batch) >= EMBEDDING_BATCH_SIZE:
+                    added += add_chunks_in_batches(
+                        self.collection, filename, batch, self.client, start_index=added, lexical_index=self.lexical_index
+                    )
+                    self._count("embedded", len(batch))
+                    batch = []
+            elif kind == "end":
+                if batch:
+                    added += add_chunks_in_batches(
+                        self.collection, filename, batch, self.client, start_index=added, lexical_index=self.lexical_index
+                    )
+                    self._count("embedded", len(batch))
+                    batch = []
+                if self.on_file_done and not self.stop.is_set():
+                    self.on_file_done(filename, added)
+
+
+class _Reader:
+    """Iterates a stage's input queue until the end-of-stream marker"""
+
+    def __init__(self, in_q):
+        self.in_q = in_q
+        self.done = False
+
+    def __iter__(self):
+        while not self.done:
+            item = self.in_q.get()
+            if item is _DONE:
+                self.done = True
+                return
+            yield item
+
+    def file_pieces(self):
+        """Yield the text pieces of the current file up to its "end" item"""
+        for kind, _, payload in self:
+            if kind == "end":
+                return
+            yield from payload
+
+    def drain(self):
+        for _ in self:
+            pass
@@ -0,0 +1,104 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it me my of on or "
+    "the to what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of one collection generation.
+
+    Built alongside the vector store during ingestion and saved next to it. It
+    holds the chunk documents and metadata too, so a confident lexical match can
+    be answered without touching the embedding model or the vector store.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.doc_lengths = []
+        self.postings = defaultdict(list)  # term -> [(doc index, term frequency)]
+        self.idf = {}
+
+    def add(self, ids, documents, metadatas):
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            index = len(self.ids)
+            tokens = tokenize(document)
+            self.ids.append(chunk_id)
+            self.documents.append(document)
+            self.metadatas.append(metadata)
+            self.doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((index, frequency))
+        self.idf = {}
+
+    def finalize(self):
+        """Precompute IDF once all chunks are added"""
+        self._compute_idf()
+
+    def _compute_idf(self):
+        n = len(self.ids)
+        self.idf = {term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in self.postings.items()}
+        self.average_length = (sum(self.doc_lengths) / n) if n else 0.0
+
+    def search(self, query: str, n_results: int = 10) -> dict:
+        """
+        Score chunks against the query.
+
+        Returns the top indices and scores plus `coverage` for the best hit: the
+        IDF-weighted share of the query's terms that appear in it.
+        """
+        if not self.idf and self.ids:
+            self._compute_idf()
+        terms = list(dict.fromkeys(tokenize(query)))
+        scores = defaultdict(float)
+        matched = defaultdict(float)
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / max(self.average_length, 1e-9))
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+                matched[index] += idf
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+        # Unknown query terms count against coverage with the highest IDF in the corpus
+        max_idf = max(self.idf.values(), default=0.0)
+        query_weight = sum(self.idf.get(term, max_idf) for term in terms)
+        coverage = matched[top[0][0]] / query_weight if top and query_weight else 0.0
+        return {
+            "indices": [index for index, _ in top],
+            "scores": [score for _, score in top],
+            "coverage": coverage,
+        }
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        index = cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index.add(data["ids"], data["documents"], data["metadatas"])
+        index.finalize()
+        return index
@@ -0,0 +1,166 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+# Priority classes: lower runs first
+INTERACTIVE = 0  # Chat widget questions and department routing
+BULK = 1  # Multi-chunk text_processor jobs
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+LLM_MAX_IN_FLIGHT = getattr(settings, 'LLM_MAX_IN_FLIGHT', 2)
+LLM_MAX_QUEUE_DEPTH = getattr(settings, 'LLM_MAX_QUEUE_DEPTH', 32)
+LLM_QUEUE_TIMEOUT = getattr(settings, 'LLM_QUEUE_TIMEOUT', 60)  # seconds
+
+
+class SchedulerBusy(Exception):
+    """Raised when a generation is shed because the queue is full or the wait timed out"""
+
+
+class _Ticket:
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.abandoned = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class LLMScheduler:
+    """
+    Admission control for calls to the local model server.
+
+    At most `max_in_flight` generations run at once; the rest wait in a priority
+    queue (interactive before bulk, FIFO within a class). A request arriving when
+    `max_queue_depth` requests are already waiting is rejected at once with
+    SchedulerBusy, as is one that waits longer than `queue_timeout` seconds.
+    Bulk requests may only fill half of the queue, keeping room for chat users.
+    Works for threads (slot) and coroutines (aslot) alike.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue_depth: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._queue = []  # (priority, sequence, ticket)
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+
+    def admit(self, priority: int = INTERACTIVE):
+        """Raise SchedulerBusy now if a request of this class would be shed"""
+        with self._lock:
+            if self._is_full(priority):
+                self._shed(priority)
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE):
+        """Hold one generation slot for the duration of the block"""
+        ticket = self._enqueue(_Ticket(priority))
+        if not ticket.event.wait(self.queue_timeout):
+            self._abandon(ticket)
+        self._record_wait(ticket)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = INTERACTIVE):
+        """slot() for coroutines: waits on the event loop instead of blocking a thread"""
+        ticket = self._enqueue(_Ticket(priority, asyncio.get_running_loop()))
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+        except asyncio.CancelledError:
+            self._abandon(ticket, cancelled=True)
+            raise
+        self._record_wait(ticket)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _is_full(self, priority):
+        depth = self.max_queue_depth if priority == INTERACTIVE else self.max_queue_depth // 2
+        return sum(self._waiting.values()) >= depth
+
+    def _shed(self, priority):
+        metrics.increment(f"llm_shed_{PRIORITY_NAMES[priority]}")
+        raise SchedulerBusy("Our assistant is handling a lot of requests right now. Please try again in a moment.")
+
+    def _enqueue(self, ticket):
+        with self._lock:
+            if self._is_full(ticket.priority):
+                self._shed(ticket.priority)
+            heapq.heappush(self._queue, (ticket.priority, next(self._sequence), ticket))
+            self._waiting[ticket.priority] += 1
+            self._dispatch()
+        return ticket
+
+    def _dispatch(self):
+        # Caller holds the lock
+        while self._in_flight < self.max_in_flight and self._queue:
+            _, _, ticket = heapq.heappop(self._queue)
+            if ticket.abandoned:
+                continue
+            self._waiting[ticket.priority] -= 1
+            self._in_flight += 1
+            ticket.grant()
+
+    def _abandon(self, ticket, cancelled=False):
+        """Stop waiting: shed the request on timeout, or hand the slot on if the caller was cancelled"""
+        with self._lock:
+            if ticket.granted and not cancelled:
+                return  # Granted just as the wait timed out: use the slot
+            if ticket.granted:
+                self._in_flight -= 1
+                self._dispatch()
+            else:
+                ticket.abandoned = True
+                self._waiting[ticket.priority] -= 1
+        if not cancelled:
+            metrics.increment(f"llm_timeout_{PRIORITY_NAMES[ticket.priority]}")
+            self._shed(ticket.priority)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._dispatch()
+
+    def _record_wait(self, ticket):
+        metrics.observe(f"llm_queue_wait_{PRIORITY_NAMES[ticket.priority]}_ms", (time.perf_counter() - ticket.enqueued) * 1000)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queued_interactive": self._waiting[INTERACTIVE],
+                "queued_bulk": self._waiting[BULK],
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+
+scheduler = LLMScheduler(LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUE_DEPTH, LLM_QUEUE_TIMEOUT)
+metrics.register_gauge("llm_scheduler", scheduler.stats)
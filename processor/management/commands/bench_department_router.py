@@ -0,0 +1,103 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from processor.chat_service import allm_department
+from processor.department_router import department_router
+from processor.ollama_client import close_async_client, get_client
+
+SAMPLE_QUERIES = [
+    "My bag was damaged on the flight from Delhi",
+    "What is the cabin baggage weight limit?",
+    "Can I carry a power bank in my checked luggage?",
+    "How much do I pay for an extra suitcase?",
+    "I want to cancel my booking and get a refund",
+    "How do I change the name on my reservation?",
+    "Online check-in is not working for my ticket",
+    "How can I redeem my loyalty points?",
+    "My flight was cancelled, please rebook me",
+    "The flight was delayed by six hours, am I owed compensation?",
+    "What are the safety instructions for an emergency landing?",
+    "I missed my connection because the first flight was late",
+    "I need a wheelchair at the airport",
+    "Can I travel with my cat in the cabin?",
+    "I have a CPAP machine, can I use it on board?",
+    "Is a service dog allowed on international flights?",
+    "How do you protect my passport details?",
+    "Please delete my personal data from your systems",
+    "What ID do I need to show at security?",
+    "Who do I contact in an emergency while my family is travelling?",
+]
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return (
+        f"p50 {samples[len(samples) // 2]:.1f} ms, "
+        f"p95 {samples[min(len(samples) - 1, int(len(samples) * 0.95))]:.1f} ms, "
+        f"max {samples[-1]:.1f} ms, mean {statistics.fmean(samples):.1f} ms"
+    )
+
+
+async def time_llm_department(queries):
+    """The LLM router's choice for each query in turn, on one event loop, and the time each took"""
+    choices, timings = [], []
+    try:
+        for query in queries:
+            started = time.perf_counter()
+            choices.append(await allm_department(query))
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        await close_async_client()
+    return choices, timings
+
+
+class Command(BaseCommand):
+    help = "Compare the embedding department router with the LLM router: latency and agreement"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries-file", help="Text file with one query per line (default: built-in samples)")
+
+    def handle(self, *args, **options):
+        if options["queries_file"]:
+            with open(options["queries_file"], "r", encoding="utf-8") as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = SAMPLE_QUERIES
+
+        client = get_client()
+        department_router.classify(queries[0], client)  # Compute the prototypes before timing
+
+        llm_choices, llm_ms = asyncio.run(time_llm_department(queries))
+
+        embedding_ms, routed_ms = [], []
+        agree = confident = confident_agree = routed_agree = 0
+        for i, (query, llm_choice) in enumerate(zip(queries, llm_choices)):
+            started = time.perf_counter()
+            choice, margin, _ = department_router.classify(query, client)
+            embedding_ms.append((time.perf_counter() - started) * 1000)
+
+            # What acategorize_department does: the embedding choice when clear, else the LLM's
+            is_confident = margin >= department_router.min_margin
+            routed_ms.append(embedding_ms[-1] + (0 if is_confident else llm_ms[i]))
+            agree += choice == llm_choice
+            confident += is_confident
+            confident_agree += is_confident and choice == llm_choice
+            routed_agree += (choice if is_confident else llm_choice) == llm_choice
+
+            marker = "" if choice == llm_choice else "  <- differs"
+            self.stdout.write(f"{margin:6.3f}  {choice:36} {llm_choice:36} {query}{marker}")
+
+        n = len(queries)
+        self.stdout.write("")
+        self.stdout.write(f"LLM router:        {summary(llm_ms)}")
+        self.stdout.write(f"Embedding router:  {summary(embedding_ms)}")
+        self.stdout.write(f"Hybrid (deployed): {summary(routed_ms)}")
+        self.stdout.write(f"Embedding choice agrees with the LLM on {agree}/{n} queries ({agree / n:.0%})")
+        self.stdout.write(
+            f"Margin >= {department_router.min_margin}: {confident}/{n} queries skip the LLM, "
+            f"agreeing on {confident_agree}/{max(confident, 1)}"
+        )
+        self.stdout.write(f"Hybrid agrees with the LLM on {routed_agree}/{n} queries ({routed_agree / n:.0%})")
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from processor.pdf_processor import iter_pdf_text, iter_split_text
+
+
+def legacy_split_text(text: str, max_chunk_size: int = 200) -> list:
+    """The original character-at-a-time split_text, kept as the benchmark baseline"""
+    chunks = []
+    current_chunk = ""
+
+    i = 0
+    while i < len(text):
+        current_chunk += text[i]
+        i += 1
+
+        if len(current_chunk) >= max_chunk_size:
+            if '.' in current_chunk:
+                split_index = current_chunk.rfind('.') + 1
+            elif ',' in current_chunk:
+                split_index = current_chunk.rfind(',') + 1
+            elif ' ' in current_chunk:
+                split_index = current_chunk.rfind(' ')
+            else:
+                split_index = max_chunk_size
+
+            chunks.append(current_chunk[:split_index].strip())
+            current_chunk = current_chunk[split_index:].strip()
+
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+SAMPLE_PAGE = (
+    "Passengers may carry one cabin bag of up to 7 kg and one personal item. "
+    "Checked baggage allowance depends on the fare, route and frequent flyer tier, "
+    "and excess baggage is charged per kilogram at the airport counter. "
+    "Refunds for cancelled tickets are processed within 7 working days "
+)
+
+
+class Command(BaseCommand):
+    help = "Compare throughput of the streaming text splitter against the original split_text"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf", help="Benchmark on the text of this PDF instead of synthetic pages")
+        parser.add_argument("--pages", type=int, default=2000, help="Number of synthetic pages")
+        parser.add_argument("--chunk-size", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options["pdf"]:
+            pages = list(iter_pdf_text(options["pdf"]))
+        else:
+            pages = [SAMPLE_PAGE * 8 + f"Page {n}.\n" for n in range(options["pages"])]
+        text = "".join(pages)
+        size = options["chunk_size"]
+        megabytes = len(text) / 1e6
+
+        legacy_chunks = legacy_split_text(text, size)
+        streaming_chunks = list(iter_split_text(pages, size))
+        if legacy_chunks != streaming_chunks:
+            self.stderr.write("Streaming splitter output differs from split_text!")
+            return
+
+        for name, run in (
+            ("split_text (original)", lambda: legacy_split_text(text, size)),
+            ("iter_split_text (streaming)", lambda: list(iter_split_text(pages, size))),
+        ):
+            best = float("inf")
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - started)
+            self.stdout.write(
+                f"{name:30s} {best * 1000:9.1f} ms  {megabytes / best:8.2f} MB/s  ({len(legacy_chunks)} chunks)"
+            )
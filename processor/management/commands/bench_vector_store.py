@@ -0,0 +1,83 @@
+import os
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from processor.vector_store import ChromaVectorStore, NumpyVectorStore
+
+
+def rss_mb():
+    """Current resident set size in MB, or None where /proc is unavailable (e.g. Windows)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, AttributeError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Compare query latency and memory of the Chroma and NumPy vector store backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, default=5000, help="Number of indexed chunks")
+        parser.add_argument("--dim", type=int, default=384, help="Embedding size (all-minilm is 384)")
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--batch", type=int, default=1, help="Query embeddings per query call")
+        parser.add_argument("--top-k", type=int, default=2)
+
+    def handle(self, *args, **options):
+        import chromadb
+
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((options["chunks"], options["dim"]), dtype=np.float32)
+        queries = rng.standard_normal((options["queries"], options["dim"]), dtype=np.float32)
+        ids = [f"bench.pdf_chunk{i}" for i in range(len(vectors))]
+        documents = [f"Chunk {i} " + "x" * 180 for i in range(len(vectors))]
+        metadatas = [{"source": "bench.pdf"} for _ in ids]
+
+        def build_chroma():
+            client = chromadb.EphemeralClient()
+            return ChromaVectorStore(client.create_collection(f"bench_{os.getpid()}_{time.time_ns()}"))
+
+        def build_numpy():
+            return NumpyVectorStore("bench", os.devnull)
+
+        results = {}
+        for name, build in (("numpy", build_numpy), ("chroma", build_chroma)):
+            before = rss_mb()
+            tracemalloc.start()
+            started = time.perf_counter()
+            store = build()
+            for start in range(0, len(ids), 1000):
+                end = start + 1000
+                store.add(ids[start:end], documents[start:end], vectors[start:end].tolist(), metadatas[start:end])
+            store.query(queries[:1].tolist(), options["top_k"])  # Warm up and assemble
+            build_seconds = time.perf_counter() - started
+            # Traced: Python and NumPy allocations, on every platform (tracing also slows the
+            # build a little). RSS also counts native index memory, where it can be read.
+            traced = tracemalloc.get_traced_memory()[0] / 1e6
+            tracemalloc.stop()
+            after = rss_mb()
+            rss = f"+{after - before:7.1f} MB RSS" if before is not None and after is not None else "RSS n/a"
+
+            latencies = []
+            for start in range(0, len(queries), options["batch"]):
+                batch = queries[start:start + options["batch"]].tolist()
+                started = time.perf_counter()
+                store.query(batch, options["top_k"])
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            results[name] = store.query(queries[:5].tolist(), options["top_k"])["ids"]
+            self.stdout.write(
+                f"{name:7s} build {build_seconds:6.2f}s  {traced:7.1f} MB traced  {rss}  "
+                f"query p50 {statistics.median(latencies):7.3f} ms  "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.3f} ms  "
+                f"({options['batch']} queries/call)"
+            )
+
+        # Chroma's HNSW index is approximate, so report agreement rather than require it
+        agree = sum(a == b for a, b in zip(results["numpy"], results["chroma"]))
+        self.stdout.write(f"Top-{options['top_k']} agreement on 5 sample queries: {agree}/5")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from processor.conversation_store import CONVERSATION_TTL_DAYS, DatabaseConversationStore, conversation_store
+
+
+class Command(BaseCommand):
+    help = "Delete stored chat turns older than CONVERSATION_TTL_DAYS (CONVERSATION_STORE_BACKEND = \"db\")"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=CONVERSATION_TTL_DAYS, help="Maximum age of a turn in days")
+
+    def handle(self, *args, **options):
+        if not isinstance(conversation_store, DatabaseConversationStore):
+            self.stdout.write("Conversations are kept in memory; nothing to prune")
+            return
+        deleted = conversation_store.prune_expired(options["days"])
+        self.stdout.write(f"Deleted {deleted} turn(s) older than {options['days']:g} days")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from processor.pdf_processor import sync_pdf_collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-index changed policy PDFs into a new collection generation and activate it. "
+        "Running servers with PDF_WATCH_ENABLED swap to it on their next poll."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Re-index every PDF, not only changed ones")
+
+    def handle(self, *args, **options):
+        collection = sync_pdf_collection(force=options["force"], wait=True)
+        self.stdout.write(self.style.SUCCESS(f"Active collection: {collection.name} ({collection.count()} chunks)"))
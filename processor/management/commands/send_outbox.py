@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from processor.email_outbox import OutboxSender, run_sender
+
+
+class Command(BaseCommand):
+    help = "Send the support emails waiting in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running and send messages as they become due (use with EMAIL_OUTBOX_ENABLED = False)"
+        )
+
+    def handle(self, *args, **options):
+        if options["loop"]:
+            run_sender()
+            return
+        sender = OutboxSender()
+        try:
+            sent = sender.send_due()
+        finally:
+            sender.close()
+        self.stdout.write(f"Sent {sent} message(s)")
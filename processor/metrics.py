@@ -0,0 +1,62 @@
+import threading
+from collections import deque
+
+# Process-wide counters and latency samples, exported by the /metrics view
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_gauges = {}
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=1000)  # Window used for percentiles
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def percentile(p):
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))], 2) if recent else None
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 2) if self.count else None,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "max": round(self.max, 2),
+        }
+
+
+def increment(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name: str, value: float):
+    """Record one sample (e.g. a latency in ms) for `name`"""
+    with _lock:
+        _timings.setdefault(name, _Timing()).add(value)
+
+
+def register_gauge(name: str, read):
+    """Export the current value of `read()` under `name`"""
+    _gauges[name] = read
+
+
+def snapshot() -> dict:
+    with _lock:
+        result = {
+            "counters": dict(_counters),
+            "timings": {name: timing.summary() for name, timing in _timings.items()},
+        }
+    result["gauges"] = {name: read() for name, read in _gauges.items()}
+    return result
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class DepartmentEmail(models.Model):
     department_name = models.CharField(max_length=100, unique=True)
@@ -13,4 +14,42 @@ class ProcessedText(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     input_text = models.TextField()
     output_text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class EmailOutbox(models.Model):
+    """Support emails waiting to be sent by the background sender (see processor/email_outbox.py)"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='processor_outbox_due_idx')]
+
+    def __str__(self):
+        return f"{self.to_email}: {self.subject} ({self.status})"
+
+
+class ConversationTurn(models.Model):
+    """One question and answer of a chat session (CONVERSATION_STORE_BACKEND = "db")"""
+    session_key = models.CharField(max_length=40)
+    user_message = models.TextField()
+    bot_message = models.TextField()
+    source = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['session_key', 'id'], name='processor_turn_session_idx')]
+
+    def __str__(self):
+        return f"{self.session_key}: {self.user_message[:50]}"
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+import ollama
+from django.conf import settings
+
+# Connection settings for the Ollama server (override in llm/settings.py)
+OLLAMA_HOST = getattr(settings, 'OLLAMA_HOST', None)  # None: OLLAMA_HOST env var or http://localhost:11434
+OLLAMA_TIMEOUT = getattr(settings, 'OLLAMA_TIMEOUT', 120)  # seconds per request
+OLLAMA_CONNECT_TIMEOUT = getattr(settings, 'OLLAMA_CONNECT_TIMEOUT', 5)  # seconds
+OLLAMA_MAX_RETRIES = getattr(settings, 'OLLAMA_MAX_RETRIES', 2)  # Retries of failed connection attempts
+OLLAMA_MAX_CONNECTIONS = getattr(settings, 'OLLAMA_MAX_CONNECTIONS', 20)
+OLLAMA_KEEPALIVE_CONNECTIONS = getattr(settings, 'OLLAMA_KEEPALIVE_CONNECTIONS', 10)
+
+_lock = threading.Lock()
+_client = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncClient
+
+
+def _client_options(transport_class):
+    limits = httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_KEEPALIVE_CONNECTIONS,
+    )
+    return {
+        "host": OLLAMA_HOST,
+        "timeout": httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        # httpx retries only failed connects, so a request is never sent twice
+        "transport": transport_class(limits=limits, retries=OLLAMA_MAX_RETRIES),
+    }
+
+
+def get_client() -> ollama.Client:
+    """
+    The process-wide Ollama client.
+
+    It keeps a pool of keep-alive connections to the model server, so requests
+    skip TCP setup. The underlying httpx client is thread-safe.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = ollama.Client(**_client_options(httpx.HTTPTransport))
+    return _client
+
+
+def get_async_client() -> ollama.AsyncClient:
+    """
+    The shared ollama.AsyncClient for the running event loop.
+
+    An async connection pool belongs to the loop that created it, so there is
+    one client per loop: a single one under the ASGI server (see llm/asgi.py).
+    Code that runs its own short-lived loop, such as asyncio.run() in a
+    management command, closes its client with close_async_client().
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = ollama.AsyncClient(**_client_options(httpx.AsyncHTTPTransport))
+    return client
+
+
+async def close_async_client():
+    """Close the running loop's AsyncClient and its connections, if it has one"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
@@ -1,176 +1,541 @@
 import os
 import io
+import json
+import time
+import hashlib
+from contextlib import aclosing, contextmanager
+from itertools import islice
 import fitz
 import pytesseract
 from PIL import Image
-import ollama
-import chromadb
+from django.conf import settings
+from .semantic_chunker import semantic_split_text
+from .embedding_cache import EmbeddingCache
+from .vector_store import get_vector_backend
+from .lexical_index import BM25Index
+from .prompt_builder import build_messages, record_prompt_eval
 
 # Constants
 COLLECTION_NAME = "pdfs_collection"
 PDF_FOLDER_PATH = "D:\\RAG\\RAG\\venv4\pdf"
-doc_chunks = {}  # Store chunk-to-document mapping
+CHROMA_PERSIST_PATH = "chroma_db"  # On-disk vector index
+VECTOR_STORE_BACKEND = getattr(settings, 'VECTOR_STORE_BACKEND', "chroma")  # "chroma" or "numpy" (exact search over an in-process float32 matrix)
+INDEX_MANIFEST_PATH = os.path.join(CHROMA_PERSIST_PATH, "manifest.json")
+INDEX_LOCK_PATH = os.path.join(CHROMA_PERSIST_PATH, "index.lock")  # Held while a generation is built and activated
+LEXICAL_INDEX_DIR = os.path.join(CHROMA_PERSIST_PATH, "lexical")  # BM25 index per collection generation
+CHUNKING_STRATEGY = "fixed"  # "fixed" (split_text rules) or "semantic" (cluster semantic chunking)
+CHUNKER_VERSIONS = {  # Bump when extraction or chunking changes to force a rebuild
+    "fixed": "split_text-200-v3",
+    "semantic": "semantic-cluster-v2",
+}
+CHUNKER_VERSION = CHUNKER_VERSIONS[CHUNKING_STRATEGY]
+PDF_EXTRACT_WORKERS = getattr(settings, 'PDF_EXTRACT_WORKERS', os.cpu_count() or 1)  # Processes used for OCR during ingestion
+EMBEDDING_MODEL = "all-minilm"
+OCR_CACHE_DIR = os.path.join(CHROMA_PERSIST_PATH, "ocr_cache")  # OCR text keyed by image hash
+OCR_MIN_IMAGE_WIDTH = getattr(settings, 'OCR_MIN_IMAGE_WIDTH', 64)  # Narrower images (icons, bullets, rules) are not OCR'd
+OCR_MIN_IMAGE_HEIGHT = getattr(settings, 'OCR_MIN_IMAGE_HEIGHT', 24)
+OCR_MIN_IMAGE_BYTES = getattr(settings, 'OCR_MIN_IMAGE_BYTES', 1024)
+OCR_MIN_CONTRAST = getattr(settings, 'OCR_MIN_CONTRAST', 40)  # Grayscale max-min below this means a near-blank image
+EMBEDDING_BATCH_SIZE = 64  # Chunks embedded and added to the vector store per round-trip
+LLAMA_ERROR_RESPONSE = "No response received from Llama3.2."
+EMBEDDING_CACHE_PATH = os.path.join(CHROMA_PERSIST_PATH, "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # Least recently used embeddings are evicted beyond this
+_ocr_cache = {}  # Image hash -> OCR text (None for skipped images), per process
 collection = None
+_vector_backend = None
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
 
 def initialize_pdf_collection():
+    """
+    Open the active collection, first bringing it up to date with PDF_FOLDER_PATH.
+
+    Only PDFs whose content hash differs from the manifest are re-extracted and
+    re-embedded, and chunks of PDFs that were deleted from the folder are dropped.
+    A change of chunker or embedding model rebuilds the whole index.
+    """
     print("Initializing PDF collection...")
     global collection  # Ensure we're using the global variable
-    
-    try:
-        client = ollama.Client()
-        chroma_client = chromadb.Client()
-        
-        # Check if collection already exists
-        try:
-            # Try to get existing collection first
-            collection = chroma_client.get_collection(COLLECTION_NAME)
-            print(f"Using existing collection: {COLLECTION_NAME}")
-            return collection  # Return the collection object
-        except Exception as e:
-            print(f"Collection doesn't exist yet: {e}")
-            
-            # Only try to delete if actually got an error from get_collection
-            try:
-                chroma_client.delete_collection(COLLECTION_NAME)
-                print(f"Deleted existing collection: {COLLECTION_NAME}")
-            except Exception as e:
-                print(f"Error deleting collection (may not exist): {e}")
-
-        # Create new collection
-        collection = chroma_client.create_collection(COLLECTION_NAME)
-        print(f"Created new collection: {COLLECTION_NAME}")
-
-        # Check if PDF folder exists
-        if not os.path.exists(PDF_FOLDER_PATH):
-            print(f"Warning: PDF folder not found at {PDF_FOLDER_PATH}")
-            return collection
-            
-        # Process PDFs
-        for filename in os.listdir(PDF_FOLDER_PATH):
-            if filename.endswith(".pdf"):
-                pdf_path = os.path.join(PDF_FOLDER_PATH, filename)
-                print(f"Processing PDF: {filename}")
-
-                pdf_text = extract_text_from_pdf(pdf_path)
-                if not pdf_text.strip():
-                    print(f"No text found in {filename}. Skipping.")
-                    continue
-
-                chunks = split_text(pdf_text)
-                print(f"Split PDF into {len(chunks)} chunks")
-
-                # Add each chunk's text and embedding to the collection
-                for i, chunk_text in enumerate(chunks, 1):
-                    chunk_id = f"{filename}_chunk{i}"
-                    embedding = get_embedding(chunk_text, client)
-                    
-                    # Double-check collection is not None before adding
-                    if collection is None:
-                        print("Error: Collection became None during processing")
-                        collection = chroma_client.create_collection(COLLECTION_NAME)
-                        
-                    collection.add(
-                        documents=[chunk_text],
-                        embeddings=[embedding],
-                        ids=[chunk_id],
-                        metadatas=[{"source": filename}]  # Add metadata with source filename
-                    )
-                    doc_chunks[chunk_text] = filename  # Store the mapping
-                    print(f"Added chunk {i} of {filename} to ChromaDB.")
 
+    try:
+        collection = sync_pdf_collection()
         print("PDF collection initialization complete")
         return collection
-        
     except Exception as e:
         print(f"Critical error during initialization: {e}")
-        # Try to recreate the client and collection if an error occurred
+        # Fall back to the last complete collection if there is one
         try:
-            chroma_client = chromadb.Client()
-            collection = chroma_client.create_collection(COLLECTION_NAME)
-            print(f"Recreated collection after error")
+            collection = open_active_collection()
+            print(f"Reopened collection after error")
             return collection
         except Exception as e2:
             print(f"Failed to recover from error: {e2}")
             return None
 
+def get_vector_backend_for_index():
+    """Process-wide backend for VECTOR_STORE_BACKEND under CHROMA_PERSIST_PATH"""
+    global _vector_backend
+    if _vector_backend is None:
+        _vector_backend = get_vector_backend(VECTOR_STORE_BACKEND, CHROMA_PERSIST_PATH)
+    return _vector_backend
+
+def open_active_collection():
+    """Open the vector store the manifest points at, without checking the PDFs"""
+    manifest = load_manifest()
+    return attach_lexical_index(get_vector_backend_for_index().open(manifest.get("collection", COLLECTION_NAME)))
+
+def lexical_index_path(name: str) -> str:
+    return os.path.join(LEXICAL_INDEX_DIR, f"{name}.json")
+
+def attach_lexical_index(store):
+    """Load the BM25 index saved with a collection generation, if there is one"""
+    path = lexical_index_path(store.name)
+    try:
+        if os.path.exists(path):
+            store.lexical_index = BM25Index.load(path)
+        else:
+            print(f"No lexical index for {store.name}; queries will use vector search only")
+    except Exception as e:
+        print(f"Error loading lexical index for {store.name}: {e}")
+    return store
+
+def sync_pdf_collection(force: bool = False, wait: bool = False):
+    """
+    Return a collection that matches the PDFs on disk.
+
+    If nothing changed the active collection is returned as is. Otherwise a new
+    collection generation is built next to it: chunks of unchanged PDFs are copied
+    over with their embeddings, and new or changed PDFs go through the ingest
+    pipeline. The manifest is switched to the new generation only once it is
+    complete, so readers of the old collection never see a half-built index.
+    With force=True every PDF is re-indexed.
+
+    Only one process builds at a time (INDEX_LOCK_PATH). When another worker is
+    already building, the active collection is returned and the PDF watcher
+    swaps in the new generation once the manifest points at it; with wait=True,
+    or when there is no active collection yet, this waits for the other build
+    and then syncs.
+    """
+    with index_build_lock(blocking=False) as acquired:
+        if acquired:
+            return _sync_pdf_collection(force)
+    if not (force or wait):
+        try:
+            active = open_active_collection()
+            print(f"Another process is building the index; using {active.name} until it is done")
+            return active
+        except Exception as e:
+            print(f"No active collection to use while another process builds the index: {e}")
+    print("Waiting for another process to finish building the index...")
+    with index_build_lock():
+        return _sync_pdf_collection(force)
+
+def _sync_pdf_collection(force: bool):
+    # Caller holds the index build lock
+    backend = get_vector_backend_for_index()
+    manifest = load_manifest()
+    active_name = manifest.get("collection", COLLECTION_NAME)
+    active = None
+    if manifest.get("vector_store", "chroma") == VECTOR_STORE_BACKEND:
+        try:
+            active = attach_lexical_index(backend.open(active_name))
+        except Exception as e:
+            print(f"Active collection {active_name} not found: {e}")
+
+    if (manifest.get("chunker_version") != CHUNKER_VERSION or manifest.get("embedding_model") != EMBEDDING_MODEL
+            or manifest.get("vector_store", "chroma") != VECTOR_STORE_BACKEND):
+        print("Index manifest missing or built with a different chunker/model/vector store. Rebuilding index...")
+        force = True
+
+    # Check if PDF folder exists
+    if not os.path.exists(PDF_FOLDER_PATH):
+        print(f"Warning: PDF folder not found at {PDF_FOLDER_PATH}")
+        if active is not None:
+            return active
+        empty = backend.create(active_name)
+        empty.persist()
+        return empty
+
+    pdf_files = sorted(f for f in os.listdir(PDF_FOLDER_PATH) if f.endswith(".pdf"))
+    hashes = {filename: file_sha256(os.path.join(PDF_FOLDER_PATH, filename)) for filename in pdf_files}
+
+    unchanged = []
+    pending = []
+    for filename in pdf_files:
+        if not force and active is not None and manifest["files"].get(filename, {}).get("sha256") == hashes[filename]:
+            unchanged.append(filename)
+        else:
+            pending.append((filename, os.path.join(PDF_FOLDER_PATH, filename), hashes[filename]))
+    removed = [filename for filename in manifest["files"] if filename not in hashes]
+
+    if active is not None and not pending and not removed:
+        print(f"Using collection: {active_name} ({active.count()} chunks), all {len(unchanged)} PDFs unchanged")
+        return active
+
+    print(f"Building new index generation: {len(unchanged)} unchanged, {len(pending)} new or changed, {len(removed)} removed PDFs")
+    new_name = f"{COLLECTION_NAME}_{time.strftime('%Y%m%d%H%M%S')}_{os.getpid()}"
+    new_collection = backend.create(new_name)
+    lexical = BM25Index()
+    files = {}
+    try:
+        for filename in unchanged:
+            if not manifest["files"][filename].get("chunks"):
+                # Yielded no text when it was indexed; not retried until the file changes
+                files[filename] = manifest["files"][filename]
+                continue
+            copied = copy_source_chunks(active, new_collection, filename, lexical)
+            files[filename] = dict(manifest["files"][filename], chunks=copied)
+            print(f"Unchanged PDF, reused {copied} chunks: {filename}")
+
+        def finish_file(filename, added):
+            # Files without text are recorded too, so they are not re-extracted
+            # (and re-OCR'd) on every start
+            files[filename] = {"sha256": hashes[filename], "chunks": added}
+            if not added:
+                print(f"WARNING: No text found in {filename}; it will be skipped until the file changes.")
+                return
+            print(f"Added {added} chunks of {filename} to the index.")
+
+        # Stream the pending PDFs through extraction, OCR, chunking and embedding
+        if pending:
+            from .ingest_pipeline import IngestPipeline
+            from .ollama_client import get_client
+            pipeline = IngestPipeline(new_collection, get_client(), on_file_done=finish_file, lexical_index=lexical)
+            stats = pipeline.run(pending)
+            rate = stats["embedded"] / stats["seconds"] if stats["seconds"] > 0 else float("inf")
+            print(f"Indexed {stats['embedded']} chunks from {stats['pages']} pages in {stats['seconds']:.2f}s ({rate:.1f} chunks/s)")
+        new_collection.persist()
+        lexical.finalize()
+        lexical.save(lexical_index_path(new_name))
+        new_collection.lexical_index = lexical
+    except Exception:
+        backend.delete(new_name)
+        raise
+
+    # Switching the manifest is the commit point of the new generation
+    manifest = new_manifest()
+    manifest["collection"] = new_name
+    manifest["files"] = files
+    save_manifest(manifest)
+    print(f"Activated collection {new_name} ({new_collection.count()} chunks)")
+
+    # Drop generations older than the one just replaced, which is kept until
+    # the next rebuild so requests and workers still holding it can finish
+    for name in list_generations(backend):
+        if generation_stamp(name) < generation_stamp(active_name):
+            backend.delete(name)
+            if os.path.exists(lexical_index_path(name)):
+                os.remove(lexical_index_path(name))
+            print(f"Deleted old collection generation: {name}")
+    return new_collection
+
+def copy_source_chunks(source, target, filename: str, lexical_index=None, batch_size: int = 1000) -> int:
+    """Copy one PDF's chunks, embeddings included, from one vector store to another"""
+    result = source.get_source(filename)
+    ids = result["ids"]
+    if lexical_index is not None:
+        lexical_index.add(ids, result["documents"], result["metadatas"])
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        target.add(
+            ids=ids[start:end],
+            documents=result["documents"][start:end],
+            embeddings=result["embeddings"][start:end],
+            metadatas=result["metadatas"][start:end]
+        )
+    return len(ids)
+
+def list_generations(backend) -> list:
+    """Names of all collection generations in the vector store backend"""
+    return [name for name in backend.list_names() if name == COLLECTION_NAME or name.startswith(f"{COLLECTION_NAME}_")]
+
+def generation_stamp(name: str) -> str:
+    """Build time of a collection generation as YYYYmmddHHMMSS ("" for the original collection)"""
+    return name[len(COLLECTION_NAME) + 1:].split("_")[0]
+
+@contextmanager
+def index_build_lock(blocking: bool = True):
+    """
+    Cross-process lock on INDEX_LOCK_PATH, held while a collection generation is
+    built, activated and old ones deleted. Yields whether the lock was acquired
+    (always True when blocking).
+    """
+    os.makedirs(os.path.dirname(INDEX_LOCK_PATH), exist_ok=True)
+    with open(INDEX_LOCK_PATH, "a+") as f:
+        acquired = _lock_file(f, blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _unlock_file(f)
+
+def _lock_file(f, blocking: bool) -> bool:
+    if os.name == "nt":
+        import msvcrt
+        while True:
+            f.seek(0)
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(1)
+    import fcntl
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def _unlock_file(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def pdf_folder_signature() -> tuple:
+    """Cheap fingerprint of the PDF folder (names, sizes and modification times)"""
+    if not os.path.exists(PDF_FOLDER_PATH):
+        return ()
+    entries = []
+    for entry in os.scandir(PDF_FOLDER_PATH):
+        if entry.name.endswith(".pdf"):
+            stat = entry.stat()
+            entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(entries))
+
+def new_manifest() -> dict:
+    """Empty manifest for the current chunker, embedding model and vector store"""
+    return {
+        "chunker_version": CHUNKER_VERSION,
+        "embedding_model": EMBEDDING_MODEL,
+        "vector_store": VECTOR_STORE_BACKEND,
+        "files": {}
+    }
+
+def load_manifest() -> dict:
+    """Read the index manifest, or return an empty one if it is missing or unreadable"""
+    try:
+        if os.path.exists(INDEX_MANIFEST_PATH):
+            with open(INDEX_MANIFEST_PATH, "r") as f:
+                manifest = json.load(f)
+            manifest.setdefault("files", {})
+            return manifest
+    except Exception as e:
+        print(f"Error reading index manifest: {e}")
+    return {"files": {}}
+
+def save_manifest(manifest: dict):
+    """Write the manifest atomically so a crash never leaves a half-written file"""
+    os.makedirs(os.path.dirname(INDEX_MANIFEST_PATH), exist_ok=True)
+    tmp_path = f"{INDEX_MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, INDEX_MANIFEST_PATH)
+
+def file_sha256(path: str) -> str:
+    """Content hash of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def add_chunks_in_batches(collection, filename: str, chunks, client, batch_size: int = EMBEDDING_BATCH_SIZE, start_index: int = 0, lexical_index=None) -> int:
+    """
+    Embed and add a PDF's chunks to the collection, one embedding call and
+    one collection.add per batch instead of one of each per chunk.
+
+    `chunks` may be any iterable, so a lazy chunk stream is never materialised.
+    Chunk IDs are numbered from start_index + 1. Chunks are also added to
+    `lexical_index` when one is given.
+    """
+    added = start_index
+    chunks = iter(chunks)
+    while True:
+        batch = list(islice(chunks, batch_size))
+        if not batch:
+            break
+        start = added
+        embeddings = get_embeddings(batch, client)
+        ids = [f"{filename}_chunk{i}" for i in range(start + 1, start + len(batch) + 1)]
+        metadatas = [{"source": filename} for _ in batch]  # Add metadata with source filename
+        collection.add(
+            documents=batch,
+            embeddings=embeddings,
+            ids=ids,
+            metadatas=metadatas
+        )
+        if lexical_index is not None:
+            lexical_index.add(ids, batch, metadatas)
+        added += len(batch)
+        print(f"Added chunks {start + 1}-{added} of {filename} to the index.")
+    return added - start_index
+
+def chunk_pages(pages, client):
+    """Chunk a PDF's text with the configured CHUNKING_STRATEGY"""
+    if CHUNKING_STRATEGY == "semantic":
+        return semantic_split_text(pages, lambda texts: get_embeddings(texts, client))
+    return iter_split_text(pages)
+
 def split_text(text: str, max_chunk_size: int = 200) -> list:
     print("Starting text splitting...")
-    chunks = []
-    current_chunk = ""
-    
-    i = 0
-    while i < len(text):
-        current_chunk += text[i]
-        i += 1
-        
-        if len(current_chunk) >= max_chunk_size:
+    chunks = list(iter_split_text([text], max_chunk_size))
+    print(f"Text split into {len(chunks)} chunks")
+    return chunks
+
+def iter_split_text(pieces, max_chunk_size: int = 200):
+    """
+    Streaming version of split_text over an iterable of text pieces (e.g. pages).
+
+    Cuts each max_chunk_size window at its last period, then comma, then space,
+    exactly like split_text, but works a window at a time instead of a character
+    at a time and only ever holds one window plus the current piece in memory.
+    """
+    carry = ""
+    for piece in pieces:
+        pos = 0
+        while pos < len(piece):
+            take = max_chunk_size - len(carry)
+            window = carry + piece[pos:pos + take]
+            pos += take
+            if len(window) < max_chunk_size:
+                carry = window
+                break
+
             # Find appropriate split point
-            if '.' in current_chunk:
-                split_index = current_chunk.rfind('.') + 1
-            elif ',' in current_chunk:
-                split_index = current_chunk.rfind(',') + 1
-            elif ' ' in current_chunk:
-                split_index = current_chunk.rfind(' ')
-            else:
+            split_index = window.rfind('.') + 1
+            if not split_index:
+                split_index = window.rfind(',') + 1
+            if not split_index:
+                split_index = window.rfind(' ')
+            if split_index == -1:
                 split_index = max_chunk_size
-            
-            chunks.append(current_chunk[:split_index].strip())
-            current_chunk = current_chunk[split_index:].strip()
 
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
-    print(f"Text split into {len(chunks)} chunks")
-    return chunks
+            yield window[:split_index].strip()
+            carry = window[split_index:].strip()
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+    if carry.strip():
+        yield carry.strip()
+
+def iter_pdf_text(pdf_path: str):
+    """Yield a PDF's text page by page, followed by the OCR text of each page's images"""
     print(f"Extracting text from PDF: {pdf_path}")
-    text = ""
     try:
         with fitz.open(pdf_path) as doc:
             for page_num, page in enumerate(doc, 1):
                 print(f"Processing page {page_num}")
-                text += page.get_text()
+                yield page.get_text()
                 for img_index, img in enumerate(page.get_images(full=True), start=1):
                     print(f"Processing image {img_index} on page {page_num}")
                     xref = img[0]
                     base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image = Image.open(io.BytesIO(image_bytes))
-                    image_text = pytesseract.image_to_string(image)
-                    text += f"\n[Image {img_index} Text]: {image_text}"
+                    image_text = ocr_image(base_image["image"], base_image.get("width", 0), base_image.get("height", 0))
+                    if image_text is None:
+                        continue
+                    yield f"\n[Image {img_index} Text]: {image_text}"
     except Exception as e:
         print(f"Error extracting text from {pdf_path}: {e}")
-    return text
+
+def ocr_image(image_bytes: bytes, width: int, height: int):
+    """
+    OCR an embedded image, or return None if the skip rules say it carries no text.
+
+    Results are cached by the hash of the image bytes, in memory and on disk,
+    so a logo repeated on every page of every PDF is only OCR'd once per corpus,
+    including across the extraction worker processes.
+    """
+    if len(image_bytes) < OCR_MIN_IMAGE_BYTES or width < OCR_MIN_IMAGE_WIDTH or height < OCR_MIN_IMAGE_HEIGHT:
+        print(f"Skipping small image ({width}x{height}, {len(image_bytes)} bytes)")
+        return None
+
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    if image_hash in _ocr_cache:
+        return _ocr_cache[image_hash]
+
+    cache_path = os.path.join(OCR_CACHE_DIR, f"{image_hash}.txt")
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            image_text = f.read()
+        _ocr_cache[image_hash] = image_text
+        print(f"OCR cache hit for image {image_hash[:12]}")
+        return image_text
+
+    image = Image.open(io.BytesIO(image_bytes))
+    low, high = image.convert("L").getextrema()
+    if high - low < OCR_MIN_CONTRAST:
+        print(f"Skipping low-contrast image {image_hash[:12]}")
+        image_text = None
+    else:
+        image_text = pytesseract.image_to_string(image)
+
+    if image_text is not None:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(image_text)
+        os.replace(tmp_path, cache_path)
+    _ocr_cache[image_hash] = image_text
+    return image_text
 
 def get_embedding(text: str, client) -> list:
-    print("Generating embedding...")
-    result = client.embeddings(model="all-minilm", prompt=text)
-    print("Embedding generated successfully")
-    return result['embedding']
-
-def get_llama_response(context: str, query: str, output_language: str, client) -> str:
-    print("Generating Llama response...")
-    prompt = f"""You are a helpful AI assistant. Use the following context to answer the question provided.
-    Give the response in {output_language} language.
-   
-    Context:
-    {context}
-   
-    Question:
-    {query}
-   
-    Answer based on the context:"""
+    return get_embeddings([text], client)[0]
+
+def get_embeddings(texts: list, client) -> list:
+    """
+    Embed a batch of texts with a single request to Ollama.
+
+    Texts already in the embedding cache are not sent; only the misses are
+    embedded, then stored for the next time.
+    """
+    if not texts:
+        return []
+    try:
+        embeddings = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    except Exception as e:
+        print(f"Error reading embedding cache: {e}")
+        embeddings = [None] * len(texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        print(f"Embedding cache hit for all {len(texts)} texts")
+        return embeddings
+
+    print(f"Generating {len(missing)} embeddings ({len(texts) - len(missing)} cached)...")
+    missing_texts = [texts[i] for i in missing]
+    result = client.embed(model=EMBEDDING_MODEL, input=missing_texts)
+    print("Embeddings generated successfully")
+    new_embeddings = [list(embedding) for embedding in result['embeddings']]
+    for i, embedding in zip(missing, new_embeddings):
+        embeddings[i] = embedding
+    try:
+        embedding_cache.put_many(EMBEDDING_MODEL, missing_texts, new_embeddings)
+    except Exception as e:
+        print(f"Error writing embedding cache: {e}")
+    return embeddings
+
+async def astream_llama_response(documents: list, query: str, output_language: str, client):
+    """Yield the answer piece by piece as the model generates it, from an ollama.AsyncClient"""
+    print("Streaming Llama response...")
+    messages = build_messages(documents, query, output_language)
+    streamed = False
     try:
-        response = client.chat(
+        stream = await client.chat(
             model="llama_rag_model:latest",
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
+            messages=messages,
+            stream=True
         )
-        print("Llama response generated successfully")
-        return response.get("message", {}).get("content", "").strip()
+        async with aclosing(stream):
+            async for part in stream:
+                content = part.get("message", {}).get("content", "")
+                if content:
+                    streamed = True
+                    yield content
+                if part.get("done"):
+                    record_prompt_eval(part, messages)
+        print("Llama response streamed successfully")
     except Exception as e:
         print(f"Error with Llama3.2 API: {e}")
-        return "No response received from Llama3.2."
\ No newline at end of file
+        yield f"\n{LLAMA_ERROR_RESPONSE}" if streamed else LLAMA_ERROR_RESPONSE
@@ -0,0 +1,125 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+# Tokens of retrieved context allowed in one prompt (override in llm/settings.py)
+PROMPT_CONTEXT_TOKEN_BUDGET = getattr(settings, 'PROMPT_CONTEXT_TOKEN_BUDGET', 1024)
+
+# Identical for every request, so Ollama can reuse its cached evaluation of this
+# prefix. Anything that varies per request goes after it.
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant for SkyWings Airlines. Use the context provided "
+    "with each question to answer it. Answer based on the context, and say so when "
+    "the context does not contain the answer. Reply in the language requested after "
+    "the question."
+)
+
+QUESTION_MARKER = "\n\nQuestion:\n"
+
+# Cold prompt evaluations by context, least recently used first (see record_prompt_eval)
+PROMPT_BASELINE_MAX_ENTRIES = 1000
+_baselines = OrderedDict()  # context hash -> (prompt_eval_count, prompt_eval_duration in ms)
+_baselines_lock = threading.Lock()
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate the model's token count: one token per punctuation mark and
+    one per started four characters of each word. Close enough to budget by
+    without loading the model's tokenizer.
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _TOKEN_PIECES.findall(text))
+
+
+def pack_context(documents, budget: int = PROMPT_CONTEXT_TOKEN_BUDGET):
+    """
+    Take retrieved chunks in rank order while they fit in `budget` tokens.
+    The first chunk that does not fit is cut at a word boundary, and the rest
+    are dropped. Returns (packed documents, tokens used).
+    """
+    packed = []
+    used = 0
+    for document in documents:
+        tokens = count_tokens(document)
+        if used + tokens <= budget:
+            packed.append(document)
+            used += tokens
+            continue
+        words = []
+        for word in document.split():
+            cost = count_tokens(word)
+            if used + cost > budget:
+                break
+            words.append(word)
+            used += cost
+        if words:
+            packed.append(" ".join(words))
+        break
+    return packed, used
+
+
+def build_messages(documents, query: str, output_language: str, budget: int = PROMPT_CONTEXT_TOKEN_BUDGET) -> list:
+    """
+    Chat messages for a RAG answer, ordered from most to least stable: the fixed
+    system prompt, then the retrieved context, then the question and the output
+    language. Requests that share chunks share everything up to the question.
+    """
+    packed, used = pack_context(documents, budget)
+    if used < sum(count_tokens(document) for document in documents):
+        metrics.increment("prompt_context_truncated")
+    metrics.observe("prompt_context_tokens", used)
+    context = "\n\n".join(packed)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context}{QUESTION_MARKER}{query}\n\nAnswer in {output_language}."},
+    ]
+
+
+def context_key(messages) -> str:
+    """Hash of the prompt up to the question: the part Ollama can reuse between requests"""
+    user = messages[-1]["content"]
+    prefix = user[:user.find(QUESTION_MARKER)] if QUESTION_MARKER in user else user
+    return hashlib.sha256(f"{messages[0]['content']}\0{prefix}".encode("utf-8")).hexdigest()
+
+
+def record_prompt_eval(response, messages):
+    """
+    Export Ollama's prompt evaluation figures for one generation.
+
+    prompt_eval_count and prompt_eval_duration are reported as measured. Ollama
+    only evaluates the part of a prompt it has not cached, so the largest
+    evaluation seen for a context (system prompt and retrieved chunks) is kept
+    as its cold baseline. Later prompts with the same context count as warm and
+    report the tokens and time they took less than that baseline. Only the
+    questions after the context differ, so a saving is exact to within the
+    difference in question length.
+    """
+    evaluated = response.get("prompt_eval_count") or 0
+    duration_ms = (response.get("prompt_eval_duration") or 0) / 1e6
+    if not evaluated:
+        return
+    metrics.observe("prompt_eval_tokens", evaluated)
+    metrics.observe("prompt_eval_ms", duration_ms)
+
+    key = context_key(messages)
+    with _baselines_lock:
+        baseline = _baselines.get(key)
+        if baseline is None or evaluated >= baseline[0]:
+            _baselines[key] = (evaluated, duration_ms)
+            if len(_baselines) > PROMPT_BASELINE_MAX_ENTRIES:
+                _baselines.popitem(last=False)
+        _baselines.move_to_end(key)
+    if baseline is None or evaluated >= baseline[0]:
+        metrics.increment("prompt_eval_cold")
+        return
+    metrics.increment("prompt_eval_warm")
+    metrics.observe("prompt_reused_tokens", baseline[0] - evaluated)
+    metrics.observe("prompt_eval_saved_ms", max(baseline[1] - duration_ms, 0.0))
@@ -0,0 +1,146 @@
+import re
+import textwrap
+from itertools import islice
+
+import numpy as np
+
+# Cluster semantic chunking settings
+SEMANTIC_MAX_CHUNK_SIZE = 600  # Hard cap on characters per chunk
+SEMANTIC_BATCH_SIZE = 64  # Sentences embedded per request
+SEMANTIC_WINDOW_SIZE = 256  # Sentences held in memory and segmented together
+SEMANTIC_BREAK_PERCENTILE = 25  # Adjacent-sentence similarities below this percentile start a new topic
+SEMANTIC_MERGE_THRESHOLD = 0.75  # Chunks this similar to the centroid of the group before them join it
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+def _clean_sentence(sentence: str, max_sentence_size: int) -> list:
+    """Collapse whitespace and wrap a sentence longer than the chunk cap"""
+    sentence = " ".join(sentence.split())
+    if not sentence:
+        return []
+    if len(sentence) > max_sentence_size:
+        return textwrap.wrap(sentence, max_sentence_size)
+    return [sentence]
+
+
+def iter_sentences(pieces, max_sentence_size: int = SEMANTIC_MAX_CHUNK_SIZE):
+    """
+    Split text pieces (e.g. pages) into sentences, wrapping any sentence longer
+    than the chunk cap. Only the unfinished sentence at the end of a piece is
+    carried into the next one.
+    """
+    tail = ""
+    for piece in pieces:
+        parts = _SENTENCE_END.split(tail + piece)
+        tail = parts.pop()
+        for part in parts:
+            yield from _clean_sentence(part, max_sentence_size)
+        if len(tail) > max_sentence_size:
+            # No sentence end in sight: emit the wrapped lines except the last
+            lines = _clean_sentence(tail, max_sentence_size)
+            yield from lines[:-1]
+            tail = lines[-1] + (" " if tail[-1].isspace() else "")
+    yield from _clean_sentence(tail, max_sentence_size)
+
+
+def embed_sentences(sentences: list, embed, batch_size: int = SEMANTIC_BATCH_SIZE) -> np.ndarray:
+    """Embed sentences in batches and return them as a row-normalised float32 matrix"""
+    rows = []
+    for start in range(0, len(sentences), batch_size):
+        rows.extend(embed(sentences[start:start + batch_size]))
+    vectors = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def semantic_split_text(
+    pieces,
+    embed,
+    max_chunk_size: int = SEMANTIC_MAX_CHUNK_SIZE,
+    break_percentile: float = SEMANTIC_BREAK_PERCENTILE,
+    merge_threshold: float = SEMANTIC_MERGE_THRESHOLD,
+    window_size: int = SEMANTIC_WINDOW_SIZE,
+):
+    """
+    Cluster semantic chunking: a drop-in alternative to iter_split_text.
+
+    Sentences are read from `pieces` as they arrive and embedded with `embed` (a
+    function taking a list of strings and returning a list of vectors), at most
+    `window_size` sentences at a time. Within a window a new segment starts
+    wherever the similarity between neighbouring sentences falls into the lowest
+    `break_percentile`, and segments are packed into chunks of at most
+    `max_chunk_size` characters. A chunk then joins the group before it when it
+    is at least `merge_threshold` similar to the group's centroid and the group
+    still fits under the cap. The last group of a window may still grow, so it
+    is carried into the next window instead of being emitted.
+    """
+    sentence_stream = iter_sentences(pieces, max_chunk_size)
+    carry, carry_vectors = [], None
+    produced = 0
+    while True:
+        window = list(islice(sentence_stream, window_size))
+        final = len(window) < window_size
+        sentences, vectors = carry, carry_vectors
+        if window:
+            print(f"Semantic chunking {len(window)} sentences...")
+            vectors = embed_sentences(window, embed)
+            if carry:
+                vectors = np.concatenate((carry_vectors, vectors))
+            sentences = carry + window
+
+        groups = cluster_sentences(sentences, vectors, max_chunk_size, break_percentile, merge_threshold)
+        if not final and groups:
+            first, last = groups.pop()
+            carry, carry_vectors = sentences[first:last], vectors[first:last]
+        for first, last in groups:
+            produced += 1
+            yield " ".join(sentences[first:last])
+        if final:
+            break
+    print(f"Semantic chunking produced {produced} chunks")
+
+
+def cluster_sentences(sentences, vectors, max_chunk_size, break_percentile, merge_threshold) -> list:
+    """Group consecutive sentences into chunks; returns (first, last) sentence ranges"""
+    n = len(sentences)
+    if n <= 1:
+        return [(0, n)] if n else []
+    lengths = np.fromiter((len(s) + 1 for s in sentences), dtype=np.int64, count=n)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    # Topic boundaries from adjacent-sentence cosine similarity
+    adjacent = np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+    breaks = np.flatnonzero(adjacent < np.percentile(adjacent, break_percentile)) + 1
+    bounds = np.concatenate(([0], breaks, [n]))
+
+    # Pack each topic segment into chunks under the size cap, one step per chunk
+    starts = []
+    for segment_start, segment_end in zip(bounds[:-1], bounds[1:]):
+        start = int(segment_start)
+        while start < segment_end:
+            starts.append(start)
+            end = int(np.searchsorted(offsets, offsets[start] + max_chunk_size, side="right")) - 1
+            start = min(max(end, start + 1), int(segment_end))
+    starts = np.asarray(starts)
+    ends = np.append(starts[1:], n)
+    sums = np.add.reduceat(vectors, starts, axis=0)
+    sizes = offsets[ends] - offsets[starts]
+    unit_sums = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+    # Merge each chunk into the running group when it is close to the group's centroid
+    groups = [[int(starts[0]), int(ends[0])]]
+    group_sum = sums[0].copy()
+    group_size = sizes[0]
+    for j in range(1, len(starts)):
+        if group_size + sizes[j] <= max_chunk_size:
+            centroid = group_sum / max(float(np.linalg.norm(group_sum)), 1e-12)
+            if float(centroid @ unit_sums[j]) >= merge_threshold:
+                groups[-1][1] = int(ends[j])
+                group_sum += sums[j]
+                group_size += sizes[j]
+                continue
+        groups.append([int(starts[j]), int(ends[j])])
+        group_sum = sums[j].copy()
+        group_size = sizes[j]
+    return [tuple(group) for group in groups]
@@ -1,3 +1,1338 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import math
+import os
+import random
+import smtplib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fitz
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from . import apps, chat_service, email_outbox, email_system, index_service, ingest_pipeline, metrics, ollama_client, pdf_processor, prompt_builder, views
+from .answer_cache import AnswerCache
+from .chat_service import fuse_rankings, is_confident_lexical_match
+from . import conversation_store as conversation_store_module
+from .conversation_store import DatabaseConversationStore
+from .department_directory import DEFAULT_DEPARTMENT_EMAIL, department_directory
+from .department_router import DepartmentRouter
+from .embedding_cache import EmbeddingCache
+from .ingest_pipeline import IngestPipeline
+from .lexical_index import BM25Index, tokenize
+from .llm_scheduler import BULK, INTERACTIVE, LLMScheduler, SchedulerBusy
+from .email_outbox import OutboxSender, queue_support_email
+from .models import ConversationTurn, DepartmentEmail, EmailOutbox
+from .pdf_processor import generation_stamp, index_build_lock, iter_split_text, split_text
+from .prompt_builder import build_messages, record_prompt_eval
+from .semantic_chunker import cluster_sentences, semantic_split_text
+from .trace_log import TraceLog
+from .vector_store import NumpyBackend, NumpyVectorStore, VectorStore
+
+
+def reference_split_text(text, max_chunk_size=200):
+    """split_text as it was before it streamed: one character at a time"""
+    chunks = []
+    current_chunk = ""
+    for character in text:
+        current_chunk += character
+        if len(current_chunk) >= max_chunk_size:
+            if '.' in current_chunk:
+                split_index = current_chunk.rfind('.') + 1
+            elif ',' in current_chunk:
+                split_index = current_chunk.rfind(',') + 1
+            elif ' ' in current_chunk:
+                split_index = current_chunk.rfind(' ')
+            else:
+                split_index = max_chunk_size
+            chunks.append(current_chunk[:split_index].strip())
+            current_chunk = current_chunk[split_index:].strip()
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def random_text(rng, length):
+    alphabet = "abcdefghij" * 5 + " " * 10 + ".,\n"
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+class SplitTextTests(SimpleTestCase):
+    def test_matches_reference_on_random_text(self):
+        rng = random.Random(5)
+        for _ in range(200):
+            text = random_text(rng, rng.randint(0, 2000))
+            size = rng.choice([20, 50, 200])
+            self.assertEqual(split_text(text, size), reference_split_text(text, size))
+
+    def test_page_boundaries_do_not_change_chunks(self):
+        rng = random.Random(7)
+        for _ in range(100):
+            text = random_text(rng, rng.randint(0, 3000))
+            cuts = sorted(rng.sample(range(len(text) + 1), min(5, len(text) + 1)))
+            pages = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+            self.assertEqual(list(iter_split_text(pages)), reference_split_text(text))
+
+    def test_edge_cases(self):
+        for text in ["", "   ", "no separators" * 40, "a" * 450, ("word " * 100), "x." * 150, " ,  " * 80]:
+            self.assertEqual(split_text(text), reference_split_text(text))
+
+
+def topic_embed(texts):
+    """Fake embedding model: one axis per topic word"""
+    topics = ["baggage", "refund", "pets"]
+    return [[1.0 if topic in text else 0.0 for topic in topics] + [0.1] for text in texts]
+
+
+class SemanticChunkerTests(SimpleTestCase):
+    def sentences(self, count):
+        topics = ["baggage", "refund", "pets"]
+        return [f"Rule {i} about {topics[(i // 10) % 3]} applies here." for i in range(count)]
+
+    def test_chunks_keep_sentences_in_order_under_the_cap(self):
+        sentences = self.sentences(90)
+        pages = [" ".join(sentences[i:i + 7]) + "\n" for i in range(0, len(sentences), 7)]
+        chunks = list(semantic_split_text(pages, topic_embed, max_chunk_size=200, window_size=16))
+        self.assertEqual(" ".join(chunks), " ".join(sentences))
+        self.assertTrue(all(len(chunk) <= 200 for chunk in chunks))
+        for chunk in chunks:
+            self.assertEqual(sum(topic in chunk for topic in ["baggage", "refund", "pets"]), 1, chunk)
+
+    def test_chunks_are_produced_before_all_pages_are_read(self):
+        pages_read = []
+
+        def pages():
+            for i in range(1000):
+                pages_read.append(i)
+                yield " ".join(self.sentences(10)) + "\n"
+
+        first = next(iter(semantic_split_text(pages(), topic_embed, window_size=32)))
+        self.assertTrue(first)
+        self.assertLess(len(pages_read), 10)
+
+    def test_chunk_joins_group_by_centroid(self):
+        angles = np.radians([0, 0, 40, 80])
+        vectors = np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+        sentences = ["a" * 10, "b" * 10, "c" * 10, "d" * 10]
+        # Segments [a b] [c] [d]. c is close enough to the first group to join it;
+        # d is as close to c as c was to the group, but far from the group's centroid
+        groups = cluster_sentences(sentences, vectors, 100, break_percentile=100, merge_threshold=0.75)
+        self.assertEqual(groups, [(0, 3), (3, 4)])
+
+
+class IndexGenerationTests(SimpleTestCase):
+    def test_generation_stamps_order_by_build_time(self):
+        self.assertLess(generation_stamp("pdfs_collection"), generation_stamp("pdfs_collection_20250101120000_77"))
+        self.assertLess(
+            generation_stamp("pdfs_collection_20250101120000_9999"),
+            generation_stamp("pdfs_collection_20250101120001_1"),
+        )
+
+    def test_build_lock_is_exclusive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(pdf_processor, "INDEX_LOCK_PATH", os.path.join(directory, "index.lock")):
+                with index_build_lock() as held:
+                    self.assertTrue(held)
+                    with index_build_lock(blocking=False) as other:
+                        self.assertFalse(other)
+                with index_build_lock(blocking=False) as after:
+                    self.assertTrue(after)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AnswerCache(max_entries=2, ttl=60, similarity_threshold=0.95)
+
+    def test_near_duplicate_query_hits(self):
+        self.cache.store("English", ["a_chunk1"], [1.0, 0.0], {"response": "yes"}, "Can I bring a pet?")
+        self.assertEqual(self.cache.lookup("english ", ["a_chunk1"], [0.99, 0.05], "can i bring my pet")["response"], "yes")
+        self.assertIsNone(self.cache.lookup("English", ["a_chunk1"], [0.0, 1.0], "something else"))
+        self.assertIsNone(self.cache.lookup("English", ["a_chunk2"], [1.0, 0.0], "Can I bring a pet?"))
+        self.assertIsNone(self.cache.lookup("French", ["a_chunk1"], [1.0, 0.0], "Can I bring a pet?"))
+
+    def test_lexical_answers_match_on_normalised_text(self):
+        self.cache.store("English", ["a_chunk1"], None, {"response": "yes"}, "Baggage  limit?")
+        self.assertEqual(self.cache.lookup("English", ["a_chunk1"], None, "baggage limit?")["response"], "yes")
+        self.assertIsNone(self.cache.lookup("English", ["a_chunk1"], None, "baggage fees?"))
+
+    def test_entries_expire_after_ttl(self):
+        with mock.patch("processor.answer_cache.time.time", return_value=1000.0):
+            self.cache.store("English", ["a_chunk1"], [1.0, 0.0], {"response": "yes"}, "q")
+        with mock.patch("processor.answer_cache.time.time", return_value=1059.0):
+            self.assertIsNotNone(self.cache.lookup("English", ["a_chunk1"], [1.0, 0.0], "q"))
+        with mock.patch("processor.answer_cache.time.time", return_value=1061.0):
+            self.assertIsNone(self.cache.lookup("English", ["a_chunk1"], [1.0, 0.0], "q"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.store("English", ["a"], [1.0, 0.0], {"response": "a"}, "a")
+        self.cache.store("English", ["b"], [1.0, 0.0], {"response": "b"}, "b")
+        self.cache.lookup("English", ["a"], [1.0, 0.0], "a")  # a is now more recent than b
+        self.cache.store("English", ["c"], [1.0, 0.0], {"response": "c"}, "c")
+        self.assertIsNotNone(self.cache.lookup("English", ["a"], [1.0, 0.0], "a"))
+        self.assertIsNone(self.cache.lookup("English", ["b"], [1.0, 0.0], "b"))
+        self.assertIsNotNone(self.cache.lookup("English", ["c"], [1.0, 0.0], "c"))
+
+    def test_cleared_when_a_new_collection_is_swapped_in(self):
+        from . import index_service
+        from .chat_service import answer_cache
+
+        answer_cache.store("English", ["a_chunk1"], [1.0, 0.0], {"response": "old"}, "q")
+        previous, was_ready = index_service._collection, index_service._ready.is_set()
+        try:
+            index_service.swap_collection(SimpleNamespace(name="generation_1"))
+            answer_cache.store("English", ["a_chunk1"], [1.0, 0.0], {"response": "old"}, "q")
+            index_service.swap_collection(SimpleNamespace(name="generation_2"))
+            self.assertIsNone(answer_cache.lookup("English", ["a_chunk1"], [1.0, 0.0], "q"))
+        finally:
+            index_service._collection = previous
+            if not was_ready:
+                index_service._ready.clear()
+
+
+class NumpyVectorStoreTests(SimpleTestCase):
+    def test_top_k_matches_brute_force(self):
+        rng = np.random.default_rng(12)
+        vectors = rng.standard_normal((500, 16)).astype(np.float32)
+        queries = rng.standard_normal((20, 16)).astype(np.float32)
+        store = NumpyVectorStore("test", os.devnull)
+        for start in range(0, len(vectors), 128):  # Several adds, assembled on the first query
+            rows = range(start, min(start + 128, len(vectors)))
+            store.add([f"doc_chunk{i}" for i in rows], [f"text {i}" for i in rows], vectors[start:start + 128].tolist(),
+                      [{"source": "doc.pdf"} for _ in rows])
+
+        for k in (1, 5, 500, 600):
+            result = store.query(queries.tolist(), n_results=k)
+            for row, query in enumerate(queries):
+                distances = ((vectors - query) ** 2).sum(axis=1)
+                expected = np.argsort(distances)[:k]
+                self.assertEqual(result["ids"][row], [f"doc_chunk{i}" for i in expected])
+                np.testing.assert_allclose(result["distances"][row], distances[expected], rtol=1e-4, atol=1e-3)
+                self.assertEqual(result["documents"][row][0], f"text {expected[0]}")
+
+    def test_persisted_store_loads_and_reads_back_a_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = NumpyBackend(directory)
+            store = backend.create("generation")
+            store.add(["a_chunk1", "b_chunk1"], ["a", "b"], [[1.0, 0.0], [0.0, 1.0]], [{"source": "a.pdf"}, {"source": "b.pdf"}])
+            store.persist()
+            loaded = backend.open("generation")
+            self.assertEqual(backend.list_names(), ["generation"])
+            self.assertEqual(loaded.count(), 2)
+            self.assertEqual(loaded.get_source("b.pdf")["embeddings"], [[0.0, 1.0]])
+            self.assertEqual(loaded.query([[0.9, 0.1]], n_results=1)["ids"], [["a_chunk1"]])
+
+    def test_backends_must_implement_the_interface(self):
+        class Incomplete(VectorStore):
+            def add(self, ids, documents, embeddings, metadatas):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class HybridRetrievalTests(SimpleTestCase):
+    def build_index(self):
+        index = BM25Index()
+        index.add(
+            ["a_chunk1", "a_chunk2", "a_chunk3", "b_chunk1"],
+            [
+                "Checked baggage allowance is 23 kg per bag.",
+                "Pets travel in the cabin in an approved carrier.",
+                "Excess baggage fees apply to each extra bag and to overweight baggage.",
+                "Refunds are processed within seven days.",
+            ],
+            [{"source": "a.pdf"}, {"source": "a.pdf"}, {"source": "a.pdf"}, {"source": "b.pdf"}],
+        )
+        index.finalize()
+        return index
+
+    def test_bm25_scores_match_the_formula(self):
+        index = self.build_index()
+        hits = index.search("excess baggage fees", 4)
+        self.assertEqual(hits["indices"][:2], [2, 0])
+
+        n, k1, b = 4, index.k1, index.b
+        average = sum(index.doc_lengths) / n
+        expected = 0.0
+        for term, frequency in (("excess", 1), ("baggage", 2), ("fees", 1)):
+            containing = sum(term in tokenize(document) for document in index.documents)
+            idf = math.log(1 + (n - containing + 0.5) / (containing + 0.5))
+            expected += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * index.doc_lengths[2] / average))
+        self.assertAlmostEqual(hits["scores"][0], expected)
+        self.assertAlmostEqual(hits["coverage"], 1.0)
+
+    def test_unknown_terms_lower_coverage(self):
+        hits = self.build_index().search("baggage refund policy for infants", 4)
+        self.assertLess(hits["coverage"], 0.5)
+
+    def test_saved_index_ranks_the_same(self):
+        index = self.build_index()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "lexical", "generation.json")
+            index.save(path)
+            loaded = BM25Index.load(path)
+        self.assertEqual(loaded.search("pets cabin carrier"), index.search("pets cabin carrier"))
+
+    def test_confident_lexical_match_needs_coverage_and_margin(self):
+        self.assertTrue(is_confident_lexical_match({"scores": [3.0, 1.0], "coverage": 1.0}))
+        self.assertFalse(is_confident_lexical_match({"scores": [3.0, 2.5], "coverage": 1.0}))
+        self.assertFalse(is_confident_lexical_match({"scores": [3.0, 1.0], "coverage": 0.5}))
+        self.assertFalse(is_confident_lexical_match({"scores": [], "coverage": 0.0}))
+
+    def test_reciprocal_rank_fusion(self):
+        index = self.build_index()
+        # Vector ranking: a_chunk2, a_chunk1, b_chunk1; BM25 ranking: a_chunk1, a_chunk3
+        ids, documents, distances, metadatas = fuse_rankings(
+            index,
+            {"indices": [0, 2], "scores": [2.0, 1.0], "coverage": 1.0},
+            ["a_chunk2", "a_chunk1", "b_chunk1"],
+            [index.documents[1], index.documents[0], index.documents[3]],
+            [0.1, 0.2, 0.3],
+            [{"source": "a.pdf"}, {"source": "a.pdf"}, {"source": "b.pdf"}],
+        )
+        # a_chunk1: 1/62 + 1/61 beats a_chunk2 (1/61) and a_chunk3 (1/62)
+        self.assertEqual(ids, ["a_chunk1", "a_chunk2"])
+        self.assertEqual(documents, [index.documents[0], index.documents[1]])
+        self.assertEqual(distances, [0.2, 0.1])
+        self.assertEqual(metadatas, [{"source": "a.pdf"}, {"source": "a.pdf"}])
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = EmbeddingCache(os.path.join(directory.name, "embeddings.sqlite3"), max_entries=20)
+
+    def test_round_trip_with_normalised_text_and_model_keys(self):
+        self.cache.put_many("all-minilm", ["Baggage  allowance"], [[0.5, -1.25]])
+        self.assertEqual(self.cache.get_many("all-minilm", ["Baggage allowance ", "other"]), [[0.5, -1.25], None])
+        self.assertEqual(self.cache.get_many("other-model", ["Baggage allowance"]), [None])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 2, 1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        clock = iter(range(1000, 2000))
+        with mock.patch("processor.embedding_cache.time.time", side_effect=lambda: next(clock)):
+            for i in range(20):
+                self.cache.put_many("m", [f"text {i}"], [[float(i)]])
+            self.cache.get_many("m", ["text 0"])  # Used again, so newer than text 1..19
+            self.cache.put_many("m", ["text 20"], [[20.0]])
+
+        # One over the cap evicts the oldest, plus 5% of the cap so eviction is not run on every insert
+        results = self.cache.get_many("m", [f"text {i}" for i in range(21)])
+        self.assertEqual(results[0], [0.0])
+        self.assertEqual(results[1:3], [None, None])
+        self.assertEqual(results[3:], [[float(i)] for i in range(3, 21)])
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+
+
+class PromptEvalTests(SimpleTestCase):
+    def record(self, documents, query, evaluated, duration_ms):
+        with mock.patch.object(prompt_builder.metrics, "observe") as observe, \
+                mock.patch.object(prompt_builder.metrics, "increment") as increment:
+            record_prompt_eval(
+                {"prompt_eval_count": evaluated, "prompt_eval_duration": duration_ms * 1e6},
+                build_messages(documents, query, "English"),
+            )
+        return {call.args[0]: call.args[1] for call in observe.call_args_list}, [call.args[0] for call in increment.call_args_list]
+
+    def test_savings_are_measured_against_the_cold_evaluation_of_the_context(self):
+        documents = [f"Checked baggage rule {random.random()} allows 23 kg."]
+        observed, counted = self.record(documents, "What is the allowance?", 400, 80.0)
+        self.assertEqual((observed["prompt_eval_tokens"], observed["prompt_eval_ms"]), (400, 80.0))
+        self.assertNotIn("prompt_reused_tokens", observed)
+        self.assertEqual(counted, ["prompt_eval_cold"])
+
+        observed, counted = self.record(documents, "Can I bring two bags?", 12, 5.0)
+        self.assertEqual((observed["prompt_eval_tokens"], observed["prompt_eval_ms"]), (12, 5.0))
+        self.assertEqual((observed["prompt_reused_tokens"], observed["prompt_eval_saved_ms"]), (388, 75.0))
+        self.assertEqual(counted, ["prompt_eval_warm"])
+
+        observed, counted = self.record(["Another policy entirely."], "Can I bring two bags?", 12, 5.0)
+        self.assertEqual(counted, ["prompt_eval_cold"])
+
+    def test_a_larger_evaluation_replaces_a_warm_first_sighting(self):
+        documents = [f"Pets travel in an approved carrier {random.random()}."]
+        self.record(documents, "Can my cat fly?", 30, 6.0)  # Prefix already cached by another worker
+        _, counted = self.record(documents, "Can my dog fly?", 350, 70.0)
+        self.assertEqual(counted, ["prompt_eval_cold"])
+        observed, _ = self.record(documents, "Can my bird fly?", 20, 4.0)
+        self.assertEqual(observed["prompt_reused_tokens"], 330)
+
+
+class LLMSchedulerTests(SimpleTestCase):
+    async def test_interactive_requests_are_served_before_bulk(self):
+        scheduler = LLMScheduler(max_in_flight=1, max_queue_depth=8, queue_timeout=5)
+        order = []
+
+        async def generate(name, priority):
+            async with scheduler.aslot(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        async with scheduler.aslot(INTERACTIVE):
+            tasks = [asyncio.create_task(generate(name, priority)) for name, priority in (
+                ("bulk 1", BULK), ("chat 1", INTERACTIVE), ("bulk 2", BULK), ("chat 2", INTERACTIVE)
+            )]
+            await asyncio.sleep(0.01)
+            stats = scheduler.stats()
+            self.assertEqual((stats["queued_interactive"], stats["queued_bulk"]), (2, 2))
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ["chat 1", "chat 2", "bulk 1", "bulk 2"])
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    async def test_bulk_is_shed_at_half_the_queue_depth(self):
+        scheduler = LLMScheduler(max_in_flight=1, max_queue_depth=4, queue_timeout=5)
+
+        async def generate(priority):
+            async with scheduler.aslot(priority):
+                pass
+
+        async with scheduler.aslot(INTERACTIVE):
+            tasks = [asyncio.create_task(generate(BULK)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            with self.assertRaises(SchedulerBusy):
+                scheduler.admit(BULK)
+            with self.assertRaises(SchedulerBusy):
+                async with scheduler.aslot(BULK):
+                    pass
+            scheduler.admit(INTERACTIVE)
+
+            tasks += [asyncio.create_task(generate(INTERACTIVE)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            with self.assertRaises(SchedulerBusy):
+                scheduler.admit(INTERACTIVE)
+        await asyncio.gather(*tasks)
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    def test_waiting_past_the_timeout_sheds_the_request(self):
+        scheduler = LLMScheduler(max_in_flight=1, max_queue_depth=4, queue_timeout=0.05)
+        with scheduler.slot(INTERACTIVE):
+            with self.assertRaises(SchedulerBusy):
+                with scheduler.slot(BULK):
+                    self.fail("slot granted while the only one is held")
+            stats = scheduler.stats()
+            self.assertEqual((stats["in_flight"], stats["queued_bulk"]), (1, 0))
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        scheduler = LLMScheduler(max_in_flight=1, max_queue_depth=4, queue_timeout=5)
+
+        async def generate():
+            async with scheduler.aslot(INTERACTIVE):
+                self.fail("cancelled waiter was granted a slot")
+
+        async with scheduler.aslot(INTERACTIVE):
+            waiter = asyncio.create_task(generate())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(scheduler.stats()["queued_interactive"], 0)
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+
+class FakeAsyncClient:
+    """Stands in for ollama.AsyncClient: streams the given pieces, or raises `error`"""
+
+    def __init__(self, pieces, error=None):
+        self.pieces = pieces
+        self.error = error
+        self.calls = 0
+
+    async def chat(self, model, messages, stream):
+        self.calls += 1
+        if self.error:
+            raise self.error
+
+        async def parts():
+            for piece in self.pieces:
+                await asyncio.sleep(0)
+                yield {"message": {"content": piece}, "done": False}
+            yield {"message": {"content": ""}, "done": True, "prompt_eval_count": 40, "prompt_eval_duration": 2000000}
+        return parts()
+
+
+def make_retrieval(query_id="a_chunk1"):
+    return {
+        "embedding": [1.0, 0.0], "ids": [query_id], "documents": ["Checked baggage allowance is 23 kg."],
+        "distances": [0.1], "source": "a.pdf", "path": "vector", "ms": 1.0,
+    }
+
+
+class ChatServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.client_stub = FakeAsyncClient(["Bags ", "may weigh ", "23 kg."])
+        self.scheduler = LLMScheduler(max_in_flight=1, max_queue_depth=4, queue_timeout=5)
+        for name, value in (
+            ("scheduler", self.scheduler),
+            ("answer_cache", AnswerCache(max_entries=10, ttl=60, similarity_threshold=0.95)),
+            ("get_async_client", lambda: self.client_stub),
+            ("get_client", lambda: None),
+            ("retrieve", lambda query, client: make_retrieval()),
+        ):
+            patcher = mock.patch.object(chat_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.record_turn = mock.patch.object(chat_service, "record_turn").start()
+        self.addCleanup(mock.patch.stopall)
+
+    async def test_stream_yields_tokens_then_done(self):
+        events = await chat_service.astream_chat_query("baggage limit?", "English", False)
+        received = [event async for event in events]
+        self.assertEqual(received[:-1], [{"token": "Bags "}, {"token": "may weigh "}, {"token": "23 kg."}])
+        self.assertEqual(received[-1], {"done": True, "source": "a.pdf", "send_satisfaction_prompt": True})
+        self.assertEqual(self.record_turn.call_args.args[0], "stream")
+        self.assertEqual(self.record_turn.call_args.args[4], "Bags may weigh 23 kg.")
+        self.assertEqual(self.scheduler.stats()["in_flight"], 0)
+
+    async def test_closing_the_stream_releases_the_slot(self):
+        events = await chat_service.astream_chat_query("baggage limit?", "English", False)
+        self.assertEqual(await events.__anext__(), {"token": "Bags "})
+        self.assertEqual(self.scheduler.stats()["in_flight"], 1)
+        await events.aclose()
+        self.assertEqual(self.scheduler.stats()["in_flight"], 0)
+        self.record_turn.assert_not_called()
+
+    async def test_chat_query_reuses_the_cached_answer(self):
+        first = await chat_service.aprocess_chat_query("baggage limit?", "English", False)
+        second = await chat_service.aprocess_chat_query("baggage limit?", "English", False)
+        self.assertEqual(first["response"], "Bags may weigh 23 kg.")
+        self.assertEqual(second, first)
+        self.assertEqual(self.client_stub.calls, 1)
+        self.assertEqual(self.record_turn.call_args.args[0], "chat")
+
+    async def test_model_errors_are_not_cached(self):
+        self.client_stub.error = ConnectionError("model server down")
+        for _ in range(2):
+            result = await chat_service.aprocess_chat_query("baggage limit?", "English", False)
+            self.assertEqual(result["response"], pdf_processor.LLAMA_ERROR_RESPONSE)
+        self.assertEqual(self.client_stub.calls, 2)
+        self.assertEqual(self.record_turn.call_args.kwargs["outcome"], "model_error")
+
+    async def test_satisfaction_replies_are_traced(self):
+        await chat_service.ahandle_satisfaction_response("YES", False)
+        self.assertEqual(self.record_turn.call_args.args[:2], ("satisfaction", "YES"))
+        self.assertEqual(self.record_turn.call_args.kwargs["outcome"], "satisfied")
+
+        await chat_service.ahandle_satisfaction_response("NO", False)
+        self.assertEqual(self.record_turn.call_args.kwargs["outcome"], "needs_contact_info")
+
+    def test_text_query_keeps_chunk_order_and_isolates_failures(self):
+        chunks = ["first part", "second part", "third part"]
+        delays = {"first part": 0.03, "second part": 0.0, "third part": 0.01}
+
+        async def answer(query, output_language, retrieval, priority):
+            await asyncio.sleep(delays[query])
+            if query == "second part":
+                raise RuntimeError("generation failed")
+            return f"answer to {query}"
+
+        with mock.patch.object(chat_service, "initialize_collection", return_value=object()), \
+                mock.patch.object(chat_service, "split_text", return_value=chunks), \
+                mock.patch.object(chat_service, "retrieve_many", return_value=[make_retrieval(c) for c in chunks]), \
+                mock.patch.object(chat_service, "aanswer_with_cache", answer), \
+                mock.patch.object(chat_service, "log_chat_history"):
+            results = chat_service.process_text_query(" ".join(chunks), "English")
+
+        self.assertEqual([r["query"] for r in results], chunks)
+        self.assertEqual(results[0]["response"], "answer to first part")
+        self.assertEqual(results[1]["source_pdf"], "Error")
+        self.assertIn("generation failed", results[1]["response"])
+        self.assertEqual(results[2]["response"], "answer to third part")
+
+
+class DepartmentDirectoryTests(TestCase):
+    def setUp(self):
+        department_directory.clear()
+        self.addCleanup(department_directory.clear)
+        self.row = DepartmentEmail.objects.create(department_name="Baggage Services Department", email="bags@airline.com")
+
+    def test_lookup_is_served_from_memory(self):
+        department_directory.lookup("Baggage Services Department")
+        with self.assertNumQueries(0):
+            self.assertEqual(department_directory.lookup("baggage services department"), "bags@airline.com")
+            self.assertEqual(department_directory.lookup("Baggage claims"), "bags@airline.com")
+
+    def test_save_and_delete_reload_the_directory(self):
+        self.assertEqual(department_directory.lookup("Baggage Services Department"), "bags@airline.com")
+
+        self.row.email = "baggage@airline.com"
+        self.row.save()
+        self.assertEqual(department_directory.lookup("Baggage Services Department"), "baggage@airline.com")
+
+        DepartmentEmail.objects.create(department_name="Special Services Department", email="special@airline.com")
+        self.assertEqual(department_directory.lookup("Special Services Department"), "special@airline.com")
+
+        self.row.delete()
+        self.assertEqual(department_directory.lookup("Baggage Services Department"), DEFAULT_DEPARTMENT_EMAIL)
+
+    def test_rows_read_before_commit_are_dropped_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.row.email = "baggage@airline.com"
+            self.row.save()
+            self.assertEqual(department_directory.lookup("Baggage Services Department"), "baggage@airline.com")
+        # The commit clears the rows loaded inside the transaction
+        with self.assertNumQueries(1):
+            department_directory.lookup("Baggage Services Department")
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP: records each session, raising queued `failures` from send_message"""
+
+    def __init__(self, host, port, timeout, sessions, failures):
+        self.address = (host, port)
+        self.sent = []
+        self.login_args = None
+        self.closed = False
+        self.failures = failures
+        sessions.append(self)
+
+    def set_debuglevel(self, level):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        self.login_args = (user, password)
+
+    def send_message(self, msg):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append(msg)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class CredentialsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.secrets_file = os.path.join(directory.name, "support_email_password")
+        with open(self.secrets_file, "w") as f:
+            f.write("file-password\n")
+        environ = {name: value for name, value in os.environ.items() if not name.startswith("SUPPORT_EMAIL_")}
+        for patcher in (
+            mock.patch.object(email_system, "_credentials", None),
+            mock.patch.object(email_system, "DEFAULT_PASSWORD_FILE", os.path.join(directory.name, "missing")),
+            mock.patch.dict(os.environ, environ, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def credentials(self):
+        email_system._credentials = None
+        return email_system.get_credentials()
+
+    def test_settings_then_environment_then_secrets_file(self):
+        os.environ.update({
+            "SUPPORT_EMAIL_FROM": "env@airline.com",
+            "SUPPORT_EMAIL_PASSWORD": "env-password",
+            "SUPPORT_EMAIL_PASSWORD_FILE": self.secrets_file,
+        })
+        with override_settings(SUPPORT_EMAIL_FROM="settings@airline.com", SUPPORT_EMAIL_PASSWORD="settings-password"):
+            self.assertEqual(self.credentials(), ("settings@airline.com", "settings-password"))
+        self.assertEqual(self.credentials(), ("env@airline.com", "env-password"))
+        del os.environ["SUPPORT_EMAIL_PASSWORD"]
+        self.assertEqual(self.credentials(), ("env@airline.com", "file-password"))
+        del os.environ["SUPPORT_EMAIL_PASSWORD_FILE"]
+        with override_settings(SUPPORT_EMAIL_PASSWORD_FILE=self.secrets_file):
+            self.assertEqual(self.credentials(), ("env@airline.com", "file-password"))
+
+    def test_credentials_are_looked_up_once(self):
+        os.environ["SUPPORT_EMAIL_PASSWORD"] = "env-password"
+        first = self.credentials()
+        os.environ["SUPPORT_EMAIL_PASSWORD"] = "rotated-password"
+        self.assertEqual(email_system.get_credentials(), first)
+
+    def test_without_a_password_the_session_skips_login(self):
+        self.assertEqual(self.credentials(), (email_system.DEFAULT_FROM_EMAIL, None))
+        with open(self.secrets_file, "w") as f:
+            f.write("\n")
+        os.environ["SUPPORT_EMAIL_PASSWORD_FILE"] = self.secrets_file
+        self.assertEqual(self.credentials(), (email_system.DEFAULT_FROM_EMAIL, None))
+
+        sessions = []
+        with mock.patch.object(smtplib, "SMTP", lambda host, port, timeout: FakeSMTP(host, port, timeout, sessions, [])):
+            email_system.open_smtp_session().quit()
+        self.assertIsNone(sessions[0].login_args)
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.sessions, self.failures = [], []
+
+        def smtp(host, port, timeout):
+            return FakeSMTP(host, port, timeout, self.sessions, self.failures)
+
+        for patcher in (
+            mock.patch.object(smtplib, "SMTP", smtp),
+            mock.patch.object(email_system, "_credentials", ("support@airline.com", "app-password")),
+            mock.patch.object(email_outbox, "EMAIL_OUTBOX_ENABLED", False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sender = OutboxSender()
+        self.addCleanup(self.sender.close)
+
+    def queue(self, to_email="bags@airline.com"):
+        self.assertTrue(queue_support_email(to_email, "Escalated chat", "Chat History: ..."))
+        return EmailOutbox.objects.latest("id")
+
+    def test_due_messages_are_sent_over_one_session(self):
+        first, second = self.queue("bags@airline.com"), self.queue("special@airline.com")
+        self.assertEqual(self.sender.send_due(), 2)
+
+        self.assertEqual(len(self.sessions), 1)
+        session = self.sessions[0]
+        self.assertEqual(session.login_args, ("support@airline.com", "app-password"))
+        self.assertEqual([msg["To"] for msg in session.sent], ["bags@airline.com", "special@airline.com"])
+        for message in (first, second):
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), (EmailOutbox.SENT, 1))
+            self.assertIsNotNone(message.sent_at)
+        self.assertEqual(self.sender.send_due(), 0)
+
+    def test_claimed_message_is_hidden_until_the_lease_expires(self):
+        message = self.queue()
+        # A sender that claims the message and then dies before recording the result
+        with mock.patch.object(OutboxSender, "_send", return_value=False):
+            OutboxSender().send_due()
+        message.refresh_from_db()
+        self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=email_outbox.EMAIL_OUTBOX_LEASE - 10))
+
+        self.assertEqual(self.sender.send_due(), 0)
+        self.assertEqual(self.sessions, [])
+        after_lease = timezone.now() + timedelta(seconds=email_outbox.EMAIL_OUTBOX_LEASE + 1)
+        with mock.patch.object(email_outbox.timezone, "now", return_value=after_lease):
+            self.assertEqual(self.sender.send_due(), 1)
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.SENT)
+
+    def test_failures_are_retried_with_exponential_backoff(self):
+        message = self.queue()
+        self.failures.extend(smtplib.SMTPDataError(451, b"try again later") for _ in range(3))
+        backoff = email_outbox.EMAIL_OUTBOX_BACKOFF
+        for attempt, delay in enumerate((backoff, backoff * 2, backoff * 4), 1):
+            EmailOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+            started = timezone.now()
+            self.assertEqual(self.sender.send_due(), 0)
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), (EmailOutbox.PENDING, attempt))
+            self.assertIn("try again later", message.last_error)
+            wait = (message.next_attempt_at - started).total_seconds()
+            self.assertTrue(delay - 1 <= wait <= delay + 1, f"attempt {attempt} waits {wait}s, expected {delay}s")
+            self.assertTrue(self.sessions[-1].closed)
+
+        EmailOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(self.sender.send_due(), 1)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts, message.last_error), (EmailOutbox.SENT, 4, ""))
+
+    def test_message_fails_after_the_last_attempt(self):
+        message = self.queue()
+        self.failures.extend(smtplib.SMTPRecipientsRefused({}) for _ in range(2))
+        with mock.patch.object(email_outbox, "EMAIL_OUTBOX_MAX_ATTEMPTS", 2):
+            for _ in range(2):
+                EmailOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+                self.sender.send_due()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (EmailOutbox.FAILED, 2))
+        EmailOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(self.sender.send_due(), 0)
+
+    def test_dropped_session_is_reopened_and_the_message_resent(self):
+        message = self.queue()
+        self.failures.append(smtplib.SMTPServerDisconnected("Connection unexpectedly closed"))
+        self.assertEqual(self.sender.send_due(), 1)
+
+        self.assertEqual(len(self.sessions), 2)
+        self.assertTrue(self.sessions[0].closed)
+        self.assertEqual(len(self.sessions[1].sent), 1)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (EmailOutbox.SENT, 1))
+
+
+class DatabaseConversationStoreTests(TestCase):
+    def setUp(self):
+        self.store = DatabaseConversationStore(max_turns=3)
+
+    def test_append_keeps_only_the_newest_turns_of_the_session(self):
+        self.store.append("other", "Hello", "Hi", "a.pdf")
+        for i in range(5):
+            self.store.append("session", f"question {i}", f"answer {i}", "a.pdf")
+        self.store.append("session", "NO", "Please provide your email", "Support System")
+
+        self.assertEqual(
+            self.store.turns("session"),
+            [("question 3", "answer 3", "a.pdf"), ("question 4", "answer 4", "a.pdf"), ("NO", "Please provide your email", "Support System")],
+        )
+        self.assertEqual(ConversationTurn.objects.filter(session_key="session").count(), 3)
+        self.assertEqual(self.store.last_user_query("session"), "question 4")
+        self.assertEqual(self.store.turns("other"), [("Hello", "Hi", "a.pdf")])
+
+    def test_prune_expired_drops_old_turns(self):
+        self.store.append("abandoned", "Old question", "Old answer")
+        self.store.append("active", "New question", "New answer")
+        ConversationTurn.objects.filter(session_key="abandoned").update(created_at=timezone.now() - timedelta(days=31))
+
+        self.assertEqual(self.store.prune_expired(30), 1)
+        self.assertEqual(self.store.turns("abandoned"), [])
+        self.assertEqual(self.store.turns("active"), [("New question", "New answer", "")])
+
+
+class ChatViewTraceTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(views, "record_turn")
+        self.record_turn = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_failed_chat_turn_is_traced_with_its_error(self):
+        with mock.patch.object(views, "aprocess_chat_query", side_effect=RuntimeError("vector store offline")):
+            response = await self.async_client.post(
+                "/get_response/", {"query": "baggage limit?"}, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 400)
+        args, kwargs = self.record_turn.call_args
+        self.assertEqual(args[:3], ("chat", "baggage limit?", "English"))
+        self.assertEqual((kwargs["outcome"], kwargs["error"]), ("error", "vector store offline"))
+
+    async def test_shed_stream_is_traced_as_busy(self):
+        with mock.patch.object(views, "astream_chat_query", side_effect=SchedulerBusy("busy")):
+            response = await self.async_client.post(
+                "/stream_response/", {"query": "baggage limit?"}, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.record_turn.call_args.args[0], "stream")
+        self.assertEqual(self.record_turn.call_args.kwargs["outcome"], "busy")
+
+
+class EscalationTests(TestCase):
+    def setUp(self):
+        store = DatabaseConversationStore(max_turns=10)
+        for patcher in (
+            mock.patch.object(chat_service, "conversation_store", store),
+            mock.patch.object(conversation_store_module, "conversation_store", store),
+            mock.patch.object(chat_service.department_router, "route", return_value="Baggage Services Department"),
+            mock.patch.object(chat_service, "get_client", lambda: None),
+            mock.patch.object(chat_service, "record_turn"),
+            mock.patch.object(email_outbox, "EMAIL_OUTBOX_ENABLED", False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        department_directory.clear()
+        self.addCleanup(department_directory.clear)
+        DepartmentEmail.objects.create(department_name="Baggage Services Department", email="bags@airline.com")
+
+    async def test_escalation_queues_the_conversation_on_the_request_connection(self):
+        await sync_to_async(chat_service.log_chat_history)("My bag is lost", "Sorry to hear that", "a.pdf", "session")
+        result = await chat_service.ahandle_satisfaction_response(
+            "NO", True, {"email": "traveller@example.com", "phone": "123"}, "session"
+        )
+
+        self.assertIn("forwarded to our Baggage Services Department", result["response"])
+        outbox = await sync_to_async(list)(EmailOutbox.objects.values_list("to_email", "body"))
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(outbox[0][0], "bags@airline.com")
+        self.assertIn("USER: My bag is lost", outbox[0][1])
+        turns = await sync_to_async(ConversationTurn.objects.filter(session_key="session").count)()
+        self.assertEqual(turns, 1)  # History cleared on escalation, then the contact turn logged
+
+
+class StartupTests(SimpleTestCase):
+    def test_background_services_start_only_for_runserver(self):
+        for argv, env, expected in (
+            (["manage.py", "runserver"], {"RUN_MAIN": "true"}, True),
+            (["/usr/lib/python3/site-packages/django/__main__.py", "runserver", "--noreload"], {}, True),
+            (["manage.py", "runserver"], {}, False),  # Autoreloader parent
+            (["manage.py", "migrate"], {}, False),
+            (["django-admin", "migrate"], {}, False),
+            (["/usr/lib/python3/site-packages/django/__main__.py", "test"], {}, False),
+            (["pytest", "processor/tests.py"], {}, False),
+            (["celery", "-A", "llm", "worker"], {}, False),
+        ):
+            with mock.patch.object(apps.sys, "argv", argv), mock.patch.dict(os.environ, env, clear=True):
+                self.assertEqual(apps._is_runserver(), expected, argv)
+
+
+class IndexReadinessTests(TestCase):
+    def setUp(self):
+        for name, value in (("_ready", threading.Event()), ("_collection", None), ("_last_error", None)):
+            patcher = mock.patch.object(index_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_readyz_turns_ready_once_the_index_is_swapped_in(self):
+        response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual((response.json()["ready"], response.json()["collection"]), (False, None))
+
+        index_service.swap_collection(SimpleNamespace(name="pdf_documents_20260101T000000"))
+        response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["collection"], "pdf_documents_20260101T000000")
+
+    async def test_chat_while_the_index_builds_gets_a_fast_503(self):
+        with mock.patch.object(index_service, "start_index_warmup") as start_warmup, \
+                mock.patch.object(views, "record_turn") as record_turn:
+            response = await self.async_client.post(
+                "/get_response/", {"query": "baggage limit?"}, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["error"], "index_not_ready")
+        start_warmup.assert_called_once()
+        self.assertEqual(record_turn.call_args.kwargs["outcome"], "index_not_ready")
+
+
+def make_pdf(path, pages):
+    """Write a PDF whose pages have the given (text, [image widths]) contents"""
+    with fitz.open() as doc:
+        for text, widths in pages:
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(36, 36, 560, 400), text, fontsize=9)
+            for i, width in enumerate(widths):
+                image = Image.new("L", (width, 40), 255)
+                image.paste(0, (0, 0, width // 2, 40))
+                png = io.BytesIO()
+                image.save(png, format="PNG")
+                page.insert_image(fitz.Rect(36 + i * 200, 420, 36 + i * 200 + width, 460), stream=png.getvalue())
+        doc.save(path)
+
+
+class StubEmbedClient:
+    """Stands in for ollama.Client.embed: deterministic vectors, counting calls and texts"""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.texts = 0
+        self.error = error
+
+    def embed(self, model, input):
+        self.calls += 1
+        self.texts += len(input)
+        if self.error:
+            raise self.error
+        return {"embeddings": [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in input]}
+
+
+class NoEmbeddingCache:
+    def get_many(self, model, texts):
+        return [None] * len(texts)
+
+    def put_many(self, model, texts, embeddings):
+        pass
+
+
+def thread_pool(max_workers, mp_context=None):
+    """ProcessPoolExecutor stand-in, so tests can patch what the workers run"""
+    return ThreadPoolExecutor(max_workers)
+
+
+class IngestPipelineTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for patcher in (
+            mock.patch.object(pdf_processor, "embedding_cache", NoEmbeddingCache()),
+            mock.patch.object(pdf_processor, "CHUNKING_STRATEGY", "fixed"),
+            mock.patch.object(ingest_pipeline, "ProcessPoolExecutor", thread_pool),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pages = [(f"Page {n} policy text. " * 12, [100 + n]) for n in range(1, 13)]
+        self.pdf = os.path.join(self.directory, "policy.pdf")
+        make_pdf(self.pdf, self.pages)
+
+    def run_pipeline(self, client=None, workers=3):
+        store = NumpyVectorStore("test", os.devnull)
+        done = []
+        pipeline = IngestPipeline(store, client or StubEmbedClient(), on_file_done=lambda f, n: done.append((f, n)), workers=workers)
+        outcome = {}
+
+        def run():
+            try:
+                outcome["counts"] = pipeline.run([("policy.pdf", self.pdf, "hash")])
+            except Exception as e:
+                outcome["error"] = e
+
+        # Run in a thread so a pipeline that fails to drain shows up as a failure, not a hung suite
+        runner = threading.Thread(target=run, daemon=True)
+        runner.start()
+        runner.join(30)
+        self.assertFalse(runner.is_alive(), "pipeline did not finish")
+        return store.get_source("policy.pdf"), done, outcome
+
+    def test_pages_keep_their_order_and_chunk_ids_are_stable(self):
+        def slow_early_pages(data, width, height):
+            time.sleep(max(0.0, (113 - width) * 0.003))  # Later pages finish OCR first
+            return f"ocr of image {width}"
+
+        with mock.patch.object(ingest_pipeline, "ocr_image", slow_early_pages):
+            first, done, outcome = self.run_pipeline()
+            second, _, _ = self.run_pipeline(workers=1)
+
+        self.assertNotIn("error", outcome)
+        self.assertEqual(done, [("policy.pdf", len(first["ids"]))])
+        self.assertEqual(outcome["counts"]["images"], 12)
+        self.assertEqual(first["ids"], [f"policy.pdf_chunk{i}" for i in range(1, len(first["ids"]) + 1)])
+        text = " ".join(first["documents"])
+        positions = [text.index(f"ocr of image {100 + n}") for n in range(1, 13)]
+        self.assertEqual(positions, sorted(positions))
+        self.assertLess(text.index("Page 3 policy"), positions[2])
+        self.assertLess(positions[2], text.index("Page 4 policy"))
+        self.assertEqual((second["ids"], second["documents"]), (first["ids"], first["documents"]))
+
+    def test_failing_stage_stops_and_drains_the_pipeline(self):
+        client = StubEmbedClient(error=RuntimeError("embedding server down"))
+        with mock.patch.object(ingest_pipeline, "ocr_image", lambda data, width, height: "text"):
+            stored, done, outcome = self.run_pipeline(client=client)
+        self.assertIsInstance(outcome["error"], RuntimeError)
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(done, [])
+        self.assertEqual(stored["ids"], [])
+
+    def test_unreadable_image_is_skipped_but_a_broken_pool_fails_the_file(self):
+        def unreadable_page_two(data, width, height):
+            if width == 102:
+                raise OSError("cannot identify image file")
+            return "text"
+
+        with mock.patch.object(ingest_pipeline, "ocr_image", unreadable_page_two):
+            stored, done, outcome = self.run_pipeline()
+        self.assertNotIn("error", outcome)
+        self.assertEqual((done, outcome["counts"]["images"]), ([("policy.pdf", len(stored["ids"]))], 11))
+
+        def pool_crashes(data, width, height):
+            if width == 105:
+                raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+            return "text"
+
+        with mock.patch.object(ingest_pipeline, "ocr_image", pool_crashes):
+            _, done, outcome = self.run_pipeline()
+        self.assertIsInstance(outcome["error"], BrokenProcessPool)
+        self.assertEqual(done, [])
+
+
+class OcrImageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = os.path.join(directory.name, "ocr_cache")
+        self.tesseract = mock.Mock(return_value="Gate 12 closes 20 minutes before departure")
+        for patcher in (
+            mock.patch.object(pdf_processor, "OCR_CACHE_DIR", self.cache_dir),
+            mock.patch.dict(pdf_processor._ocr_cache, clear=True),
+            mock.patch.object(pdf_processor.pytesseract, "image_to_string", self.tesseract),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def png(self, width, height, low=0, high=255):
+        rng = np.random.default_rng(width * height)
+        image = Image.fromarray(rng.integers(low, high + 1, (height, width), dtype=np.uint8), "L")
+        data = io.BytesIO()
+        image.save(data, format="PNG")
+        return data.getvalue(), width, height
+
+    def test_text_is_cached_in_memory_and_on_disk(self):
+        image = self.png(200, 60)
+        self.assertEqual(pdf_processor.ocr_image(*image), "Gate 12 closes 20 minutes before departure")
+        self.assertEqual(pdf_processor.ocr_image(*image), "Gate 12 closes 20 minutes before departure")
+        self.assertEqual(self.tesseract.call_count, 1)
+
+        # Another worker process: nothing in memory, the text comes from disk
+        pdf_processor._ocr_cache.clear()
+        self.assertEqual(pdf_processor.ocr_image(*image), "Gate 12 closes 20 minutes before departure")
+        self.assertEqual(self.tesseract.call_count, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_small_images_are_skipped(self):
+        narrow = self.png(pdf_processor.OCR_MIN_IMAGE_WIDTH - 1, 60)
+        short = self.png(200, pdf_processor.OCR_MIN_IMAGE_HEIGHT - 1)
+        blank = Image.new("L", (200, 60), 255)
+        data = io.BytesIO()
+        blank.save(data, format="PNG")
+        self.assertLess(len(data.getvalue()), pdf_processor.OCR_MIN_IMAGE_BYTES)
+        for image in (narrow, short, (data.getvalue(), 200, 60)):
+            self.assertIsNone(pdf_processor.ocr_image(*image))
+        self.tesseract.assert_not_called()
+
+    def test_low_contrast_images_are_skipped(self):
+        faint = self.png(200, 60, low=120, high=120 + pdf_processor.OCR_MIN_CONTRAST - 1)
+        self.assertIsNone(pdf_processor.ocr_image(*faint))
+        self.assertIsNone(pdf_processor.ocr_image(*faint))
+        self.tesseract.assert_not_called()
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class PdfSyncTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.folder = os.path.join(directory.name, "pdf")
+        os.makedirs(self.folder)
+        index = os.path.join(directory.name, "index")
+        self.client = StubEmbedClient()
+        builds = iter(range(1, 100))
+        # One build stamp per generation, so syncs within a second still order
+        clock = SimpleNamespace(strftime=lambda fmt: f"2026010100{next(builds):04d}", sleep=time.sleep)
+        for patcher in (
+            mock.patch.object(pdf_processor, "PDF_FOLDER_PATH", self.folder),
+            mock.patch.object(pdf_processor, "CHROMA_PERSIST_PATH", index),
+            mock.patch.object(pdf_processor, "INDEX_MANIFEST_PATH", os.path.join(index, "manifest.json")),
+            mock.patch.object(pdf_processor, "INDEX_LOCK_PATH", os.path.join(index, "index.lock")),
+            mock.patch.object(pdf_processor, "LEXICAL_INDEX_DIR", os.path.join(index, "lexical")),
+            mock.patch.object(pdf_processor, "VECTOR_STORE_BACKEND", "numpy"),
+            mock.patch.object(pdf_processor, "_vector_backend", None),
+            mock.patch.object(pdf_processor, "embedding_cache", NoEmbeddingCache()),
+            mock.patch.object(pdf_processor, "CHUNKING_STRATEGY", "fixed"),
+            mock.patch.object(pdf_processor, "time", clock),
+            mock.patch.object(ingest_pipeline, "ProcessPoolExecutor", thread_pool),
+            mock.patch.object(ingest_pipeline, "ocr_image", lambda data, width, height: ""),
+            mock.patch.object(ollama_client, "get_client", lambda: self.client),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.write_pdf("fares.pdf", "Fares are refundable within 24 hours of booking. " * 20)
+        self.write_pdf("baggage.pdf", "Each passenger may check one bag of 23 kg. " * 20)
+
+    def write_pdf(self, filename, text):
+        make_pdf(os.path.join(self.folder, filename), [(text, [])])
+
+    def sync(self):
+        self.client.calls = self.client.texts = 0
+        return pdf_processor.sync_pdf_collection()
+
+    def test_unchanged_pdfs_are_reused_without_embedding(self):
+        first = self.sync()
+        self.assertGreater(self.client.calls, 0)
+        second = self.sync()
+        self.assertEqual(self.client.calls, 0)
+        self.assertEqual((second.name, second.count()), (first.name, first.count()))
+
+    def test_changed_pdf_is_reembedded_alone(self):
+        first = self.sync()
+        baggage_ids = first.get_source("baggage.pdf")["ids"]
+        self.write_pdf("fares.pdf", "Fares can be changed for a fee of 50 euros. " * 20)
+        second = self.sync()
+        fares = second.get_source("fares.pdf")
+        self.assertNotEqual(second.name, first.name)
+        self.assertEqual(self.client.texts, len(fares["ids"]))
+        self.assertIn("50 euros", fares["documents"][0])
+        self.assertEqual(second.get_source("baggage.pdf")["ids"], baggage_ids)
+        manifest = pdf_processor.load_manifest()
+        self.assertEqual(manifest["collection"], second.name)
+        self.assertEqual(manifest["files"]["fares.pdf"]["sha256"], pdf_processor.file_sha256(os.path.join(self.folder, "fares.pdf")))
+
+    def test_deleted_pdf_is_removed(self):
+        first = self.sync()
+        fares_count = len(first.get_source("fares.pdf")["ids"])
+        os.remove(os.path.join(self.folder, "baggage.pdf"))
+        second = self.sync()
+        self.assertEqual(self.client.calls, 0)
+        self.assertEqual(second.get_source("baggage.pdf")["ids"], [])
+        self.assertEqual(second.count(), fares_count)
+        self.assertEqual(set(pdf_processor.load_manifest()["files"]), {"fares.pdf"})
+
+    def test_chunker_model_or_backend_change_rebuilds_everything(self):
+        def other_vector_store():
+            # As if the index had been built with Chroma before switching to NumPy
+            manifest = pdf_processor.load_manifest()
+            manifest["vector_store"] = "chroma"
+            pdf_processor.save_manifest(manifest)
+            return nullcontext()
+
+        changes = {
+            "chunker": lambda: mock.patch.object(pdf_processor, "CHUNKER_VERSION", "split_text-200-v4"),
+            "model": lambda: mock.patch.object(pdf_processor, "EMBEDDING_MODEL", "nomic-embed-text"),
+            "vector store": other_vector_store,
+        }
+        for change, patch in changes.items():
+            with self.subTest(change=change):
+                total = self.sync().count()
+                with patch():
+                    rebuilt = self.sync()
+                self.assertEqual(self.client.texts, total)
+                self.assertEqual(rebuilt.count(), total)
+
+    def test_pdf_without_text_is_recorded_and_not_retried(self):
+        make_pdf(os.path.join(self.folder, "scan.pdf"), [("", [])])
+        first = self.sync()
+        entry = pdf_processor.load_manifest()["files"]["scan.pdf"]
+        self.assertEqual(entry["chunks"], 0)
+        self.assertEqual(first.get_source("scan.pdf")["ids"], [])
+        with mock.patch.object(ingest_pipeline, "IngestPipeline") as pipeline:
+            second = self.sync()
+        pipeline.assert_not_called()
+        self.assertEqual(second.name, first.name)
+
+
+class TraceLogTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def make_log(self, **options):
+        options = dict(dict(flush_interval=0.05, batch_size=100, max_bytes=1024 * 1024, backups=3, queue_size=1000), **options)
+        log = TraceLog(os.path.join(self.directory, "requests.jsonl"), **options)
+        self.addCleanup(lambda: log._file and log._file.close())
+        return log
+
+    def lines(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def rotated(self):
+        return sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory)
+             if name.startswith("requests.") and name.endswith(".gz")),
+            key=os.path.getmtime
+        )
+
+    def unzip(self, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("trace log was not written in time")
+            time.sleep(0.01)
+
+    def test_queued_events_are_written_in_batches(self):
+        log = self.make_log(batch_size=3, flush_interval=0.5)
+        for n in range(7):
+            log._queue.put({"n": n})
+        with mock.patch.object(log, "_write", wraps=log._write) as write:
+            log.record({"n": 7})
+            self.wait_for(lambda: len(self.lines(log.path)) == 8)
+        self.assertEqual([len(call.args[0]) for call in write.call_args_list], [3, 3, 2])
+        self.assertEqual(self.lines(log.path), [{"n": n} for n in range(8)])
+        self.assertEqual(os.path.basename(log.path), f"requests.{os.getpid()}.jsonl")
+
+    def test_partial_batch_is_written_after_the_flush_interval(self):
+        log = self.make_log(batch_size=100, flush_interval=0.1)
+        log.record({"n": 1})
+        self.wait_for(lambda: self.lines(log.path) == [{"n": 1}])
+
+    def test_full_file_is_rotated_and_gzipped(self):
+        log = self.make_log(max_bytes=300)
+        log.path = os.path.join(self.directory, "requests.1234.jsonl")
+        events = [{"n": n, "query": "x" * 40} for n in range(10)]
+        log._write(events[:4])
+        self.assertEqual(self.rotated(), [])
+        log._write(events[4:8])
+        [backup] = self.rotated()
+        self.assertEqual(self.unzip(backup), events[:8])
+        self.assertFalse(os.path.exists(log.path))
+        log._write(events[8:])
+        self.assertEqual(self.lines(log.path), events[8:])
+
+    def test_only_the_newest_backups_are_kept(self):
+        # Backups of another worker process count too; other logs are left alone
+        other_worker = os.path.join(self.directory, "requests.999.jsonl.20260101-000000-000.gz")
+        unrelated = os.path.join(self.directory, "audit.jsonl.gz")
+        for path in (other_worker, unrelated):
+            with gzip.open(path, "wt") as f:
+                f.write("{}\n")
+            os.utime(path, (time.time() - 60, time.time() - 60))
+
+        log = self.make_log(max_bytes=1, backups=2)
+        log.path = os.path.join(self.directory, "requests.1234.jsonl")
+        for n in range(4):
+            log._write([{"n": n}])
+            time.sleep(0.02)  # Distinct modification times
+        self.assertEqual([self.unzip(path) for path in self.rotated()], [[{"n": 2}], [{"n": 3}]])
+        self.assertFalse(os.path.exists(other_worker))
+        self.assertTrue(os.path.exists(unrelated))
+
+
+class VectorEmbedClient:
+    """Stands in for ollama.Client.embed with fixed vectors per text"""
+
+    def __init__(self, vectors, error=None):
+        self.vectors = vectors
+        self.error = error
+
+    def embed(self, model, input):
+        if self.error and any(text not in self.vectors for text in input):
+            raise self.error
+        return {"embeddings": [self.vectors[text] for text in input]}
+
+
+class DepartmentRouterTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(pdf_processor, "embedding_cache", NoEmbeddingCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = VectorEmbedClient({
+            "lost suitcase": [1.0, 0.0, 0.0],
+            "damaged bag": [0.9, 0.1, 0.0],
+            "wheelchair": [0.0, 1.0, 0.0],
+            "where is my bag": [1.0, 0.2, 0.0],
+            "bag for my wheelchair": [1.0, 1.0, 0.0],
+        })
+        self.router = DepartmentRouter({
+            "Baggage Services Department": ["lost suitcase", "damaged bag"],
+            "Special Services Department": ["wheelchair"],
+        }, min_margin=0.05)
+
+    def counter(self, name):
+        return metrics.snapshot()["counters"].get(name, 0)
+
+    def test_clear_match_is_routed_by_embedding(self):
+        self.assertEqual(self.router.route("where is my bag", self.client), "Baggage Services Department")
+
+    def test_low_margin_falls_back_to_the_llm(self):
+        fallbacks = self.counter("department_route_llm_fallback")
+        department, margin, _ = self.router.classify("bag for my wheelchair", self.client)
+        self.assertLess(margin, 0.05)
+        self.assertIsNone(self.router.route("bag for my wheelchair", self.client))
+        self.assertEqual(self.counter("department_route_llm_fallback"), fallbacks + 1)
+
+        with mock.patch.object(chat_service, "department_router", self.router), \
+                mock.patch.object(chat_service, "get_client", return_value=self.client), \
+                mock.patch.object(chat_service, "allm_department", return_value="Special Services Department") as llm, \
+                mock.patch.object(chat_service, "get_department_email", return_value="special@example.com"):
+            routed = asyncio.run(chat_service.acategorize_department("bag for my wheelchair"))
+        llm.assert_awaited_once_with("bag for my wheelchair")
+        self.assertEqual(routed, ("Special Services Department", "special@example.com"))
+
+    def test_failing_embedding_call_returns_none(self):
+        # Prototypes embed fine, the query does not
+        self.router.route("where is my bag", self.client)
+        self.client.error = ConnectionError("embedding server down")
+        self.assertIsNone(self.router.route("a new question", self.client))
+
+        # Nothing cached yet: the prototypes fail too, and are retried next time
+        router = DepartmentRouter(self.router.descriptions, min_margin=0.05)
+        self.assertIsNone(router.route("a new question", VectorEmbedClient({}, error=ConnectionError("down"))))
+        self.assertIsNone(router._prototypes)
+        self.assertEqual(router.route("where is my bag", self.client), "Baggage Services Department")
@@ -0,0 +1,158 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+TRACE_LOG_ENABLED = getattr(settings, 'TRACE_LOG_ENABLED', True)
+TRACE_LOG_PATH = getattr(settings, 'TRACE_LOG_PATH', os.path.join("chat_logs", "trace", "requests.jsonl"))
+TRACE_LOG_FLUSH_INTERVAL = getattr(settings, 'TRACE_LOG_FLUSH_INTERVAL', 1.0)  # seconds
+TRACE_LOG_BATCH_SIZE = getattr(settings, 'TRACE_LOG_BATCH_SIZE', 256)  # Events written per flush at most
+TRACE_LOG_MAX_BYTES = getattr(settings, 'TRACE_LOG_MAX_BYTES', 50 * 1024 * 1024)
+TRACE_LOG_BACKUPS = getattr(settings, 'TRACE_LOG_BACKUPS', 10)  # Compressed files kept
+TRACE_LOG_QUEUE_SIZE = getattr(settings, 'TRACE_LOG_QUEUE_SIZE', 10000)
+
+
+class TraceLog:
+    """
+    Write-behind JSONL log of chat turns.
+
+    record() only puts the event on a bounded in-memory queue, so the request
+    thread never waits on disk; if the queue is full the event is dropped and
+    counted. A background thread serializes events in batches, flushes every
+    `flush_interval` seconds, and rotates the file past `max_bytes`, gzipping
+    the rotated file and keeping the newest `backups`. Each worker process
+    writes its own file (the pid is added to the name).
+    """
+
+    def __init__(self, path: str, flush_interval: float, batch_size: int, max_bytes: int, backups: int, queue_size: int):
+        self.base_path = path
+        self.path = None  # Set per process when the writer starts
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+
+    def record(self, event: dict):
+        """Queue one event; never blocks"""
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            metrics.increment("trace_events_dropped")
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                root, ext = os.path.splitext(self.base_path)
+                self.path = f"{root}.{os.getpid()}{ext}"
+                self._thread = threading.Thread(target=self._run, name="trace-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """Write whatever is queued (called at exit)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(event, default=str, ensure_ascii=False) + "\n" for event in batch)
+        with self._lock:
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(lines)
+                self._file.flush()
+                metrics.increment("trace_events_written", len(batch))
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+            except Exception as e:
+                print(f"Error writing trace log: {e}")
+
+    def _rotate(self):
+        # Caller holds the lock
+        self._file.close()
+        self._file = None
+        now = time.time()
+        rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+
+        # Keep the newest compressed files across all worker processes
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.splitext(os.path.basename(self.base_path))[0] + "."
+        compressed = sorted(
+            (os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(".gz")),
+            key=os.path.getmtime
+        )
+        for path in compressed[:-self.backups] if self.backups else compressed:
+            os.remove(path)
+
+
+trace_log = TraceLog(
+    TRACE_LOG_PATH, TRACE_LOG_FLUSH_INTERVAL, TRACE_LOG_BATCH_SIZE,
+    TRACE_LOG_MAX_BYTES, TRACE_LOG_BACKUPS, TRACE_LOG_QUEUE_SIZE,
+)
+
+
+def record_turn(endpoint: str, query: str, output_language: str, retrieval, response: str, timings: dict,
+                outcome: str = "ok", error: str = None):
+    """
+    Trace one chat turn: the query, what was retrieved, how long each stage
+    took, the answer size, and how the turn ended (`outcome`, with the `error`
+    message when it failed)
+    """
+    if not TRACE_LOG_ENABLED:
+        return
+    trace_log.record({
+        "ts": time.time(),
+        "endpoint": endpoint,
+        "query": query,
+        "language": output_language,
+        "retrieval_path": retrieval.get("path") if retrieval else None,
+        "chunk_ids": retrieval.get("ids") if retrieval else [],
+        "distances": retrieval.get("distances") if retrieval else [],
+        "source": retrieval.get("source") if retrieval else None,
+        "timings_ms": {stage: round(ms, 2) for stage, ms in timings.items()},
+        "response_chars": len(response or ""),
+        "outcome": outcome,
+        "error": error,
+    })
@@ -10,6 +10,10 @@ urlpatterns = [
     path('accounts/logout/', views.logout_view, name='logout'),  # Add this line
     path('accounts/', include('django.contrib.auth.urls')), 
     path('get_response/', views.get_response, name='get_response'),
+    path('stream_response/', views.stream_response, name='stream_response'),
     path('handle_satisfaction/', views.handle_satisfaction, name='handle_satisfaction'),
+    path('healthz', views.healthz, name='healthz'),
+    path('readyz', views.readyz, name='readyz'),
+    path('metrics', views.metrics, name='metrics'),
 
 ]
\ No newline at end of file
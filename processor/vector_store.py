@@ -0,0 +1,229 @@
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class VectorStore(ABC):
+    """
+    The small part of a vector index that ingestion and retrieval rely on.
+
+    Distances are squared L2 (Chroma's default), so results and thresholds are
+    comparable between backends.
+    """
+
+    name = None
+    lexical_index = None  # BM25Index built alongside this store, if any
+
+    @abstractmethod
+    def add(self, ids, documents, embeddings, metadatas):
+        """Add chunks with their embeddings"""
+
+    @abstractmethod
+    def get_source(self, source: str) -> dict:
+        """All chunks of one PDF as a dict of ids, documents, embeddings and metadatas"""
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results: int = 2) -> dict:
+        """
+        Top-n_results chunks for each query embedding, as a dict of ids,
+        documents, distances and metadatas with one list per query
+        """
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of chunks in the store"""
+
+    def persist(self):
+        """Make everything added so far durable (a no-op for stores that write through)"""
+
+
+class ChromaVectorStore(VectorStore):
+    """VectorStore backed by a Chroma collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def add(self, ids, documents, embeddings, metadatas):
+        self.collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def get_source(self, source):
+        result = self.collection.get(where={"source": source}, include=["documents", "embeddings", "metadatas"])
+        return {
+            "ids": result["ids"],
+            "documents": result["documents"],
+            "embeddings": [list(embedding) for embedding in result["embeddings"]],
+            "metadatas": result["metadatas"],
+        }
+
+    def query(self, query_embeddings, n_results=2):
+        result = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents", "distances", "metadatas"]
+        )
+        return {key: result[key] for key in ("ids", "documents", "distances", "metadatas")}
+
+    def count(self):
+        return self.collection.count()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact search over a contiguous float32 matrix held in process memory.
+
+    For a corpus of a few thousand short chunks a brute-force matrix product is
+    faster and lighter than an ANN index. Queries are batched: all query vectors
+    are scored in one product and the top k per row picked with argpartition.
+    Stored on disk as vectors.npy plus a JSON file of ids, documents and metadata.
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._pending = []  # Arrays added since the matrix was last assembled
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, name, path):
+        store = cls(name, path)
+        with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        store.ids = chunks["ids"]
+        store.documents = chunks["documents"]
+        store.metadatas = chunks["metadatas"]
+        store._set_matrix(np.load(os.path.join(path, "vectors.npy")))
+        return store
+
+    def _set_matrix(self, matrix):
+        self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self._norms = np.einsum("ij,ij->i", self._matrix, self._matrix)
+
+    def _assembled(self):
+        with self._lock:
+            if self._pending:
+                parts = [self._matrix] + self._pending if len(self._matrix) else self._pending
+                self._set_matrix(np.concatenate(parts))
+                self._pending = []
+            return self._matrix, self._norms
+
+    def add(self, ids, documents, embeddings, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self.ids.extend(ids)
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            self._pending.append(vectors)
+
+    def get_source(self, source):
+        matrix, _ = self._assembled()
+        rows = [i for i, metadata in enumerate(self.metadatas) if metadata.get("source") == source]
+        return {
+            "ids": [self.ids[i] for i in rows],
+            "documents": [self.documents[i] for i in rows],
+            "embeddings": matrix[rows].tolist() if rows else [],
+            "metadatas": [self.metadatas[i] for i in rows],
+        }
+
+    def query(self, query_embeddings, n_results=2):
+        matrix, norms = self._assembled()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        k = min(n_results, len(matrix))
+        if k == 0:
+            empty = [[] for _ in range(len(queries))]
+            return {"ids": empty, "documents": empty, "distances": empty, "metadatas": empty}
+
+        # Squared L2 distance for every (query, chunk) pair in one matrix product
+        distances = np.einsum("ij,ij->i", queries, queries)[:, None] + norms[None, :] - 2.0 * (queries @ matrix.T)
+        if k < len(matrix):
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(len(matrix)), (len(queries), len(matrix)))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.maximum(np.take_along_axis(top_distances, order, axis=1), 0.0)
+
+        return {
+            "ids": [[self.ids[i] for i in row] for row in top],
+            "documents": [[self.documents[i] for i in row] for row in top],
+            "distances": top_distances.tolist(),
+            "metadatas": [[self.metadatas[i] for i in row] for row in top],
+        }
+
+    def count(self):
+        return len(self.ids)
+
+    def persist(self):
+        matrix, _ = self._assembled()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "vectors.npy"), matrix)
+        with open(os.path.join(tmp_path, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp_path, self.path)
+
+
+class ChromaBackend:
+    """Creates, opens and deletes Chroma-backed stores in one persistent directory"""
+
+    def __init__(self, path: str):
+        import chromadb
+        self.client = chromadb.PersistentClient(path=path)
+
+    def create(self, name):
+        return ChromaVectorStore(self.client.create_collection(name))
+
+    def open(self, name):
+        return ChromaVectorStore(self.client.get_collection(name))
+
+    def delete(self, name):
+        self.client.delete_collection(name)
+
+    def list_names(self):
+        # Older Chroma versions return Collection objects instead of names
+        return [getattr(item, "name", item) for item in self.client.list_collections()]
+
+
+class NumpyBackend:
+    """Creates, opens and deletes NumPy stores, one sub-directory per store"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def create(self, name):
+        return NumpyVectorStore(name, os.path.join(self.path, name))
+
+    def open(self, name):
+        store_path = os.path.join(self.path, name)
+        if not os.path.exists(os.path.join(store_path, "vectors.npy")):
+            raise FileNotFoundError(f"No NumPy vector store at {store_path}")
+        return NumpyVectorStore.load(name, store_path)
+
+    def delete(self, name):
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def list_names(self):
+        if not os.path.exists(self.path):
+            return []
+        return [name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)) and not name.endswith(".tmp")]
+
+
+def get_vector_backend(backend: str, path: str):
+    """Backend for VECTOR_STORE_BACKEND: "chroma" or "numpy" """
+    if backend == "numpy":
+        return NumpyBackend(os.path.join(path, "numpy"))
+    if backend == "chroma":
+        return ChromaBackend(path)
+    raise ValueError(f"Unknown vector store backend: {backend}")
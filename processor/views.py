@@ -2,16 +2,27 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST  # Add this import
 import json
+import time
+from contextlib import aclosing
+
+from asgiref.sync import sync_to_async
 
 from .chat_service import (
+    answer_cache,
     process_text_query,
-    handle_satisfaction_response,
-    process_chat_query
+    aprocess_chat_query,
+    ahandle_satisfaction_response,
+    astream_chat_query
 )
+from .index_service import IndexNotReady, index_status
+from .llm_scheduler import SchedulerBusy
+from .pdf_processor import embedding_cache
+from .trace_log import record_turn
+from . import metrics as runtime_metrics
 from .forms import TextProcessorForm, UserCreationForm
 
 @login_required
@@ -32,7 +43,13 @@ def text_processor(request):
             user_text = form.cleaned_data['user_text']
             output_language = form.cleaned_data['output_language']
             
-            results = process_text_query(user_text, output_language)
+            try:
+                results = process_text_query(user_text, output_language, conversation_key(request))
+            except SchedulerBusy as e:
+                return render(request, 'text_processor/text_processor.html', {
+                    'form': form,
+                    'support_message': str(e)
+                }, status=503)
             
             return render(request, 'text_processor/text_processor.html', {
                 'results': results,
@@ -44,6 +61,29 @@ def text_processor(request):
     
     return render(request, 'text_processor/text_processor.html', {'form': form})
 
+def conversation_key(request):
+    """Session key identifying the visitor's conversation, creating the session if needed"""
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+def busy_response(e):
+    """Fast 503 telling the client the model server is saturated"""
+    response = JsonResponse({
+        'response': str(e),
+        'source': "Support System",
+        'error': 'busy',
+        'send_satisfaction_prompt': False
+    }, status=503)
+    response['Retry-After'] = '5'
+    return response
+
+def trace_failure(endpoint, query, output_language, started, outcome, error):
+    """Trace a turn that ended without an answer"""
+    record_turn(endpoint, query, output_language, None, "", {
+        "total": (time.perf_counter() - started) * 1000
+    }, outcome=outcome, error=str(error))
+
 def signup(request):
     print("Processing signup request...")
     if request.method == 'POST':
@@ -68,8 +108,12 @@ def logout_view(request):
     return redirect('login')
 
 @csrf_exempt
-def get_response(request):
+async def get_response(request):
     if request.method == 'POST':
+        started = time.perf_counter()
+        user = await request.auser()
+        session_key = await sync_to_async(conversation_key)(request)
+        endpoint, query, output_language = "chat", None, None
         try:
             data = json.loads(request.body)
             query = data.get('query')
@@ -77,45 +121,63 @@ def get_response(request):
             
             # Check if user is providing contact information (email/phone)
             if 'contact_info' in data:
+                endpoint = "satisfaction"
                 user_data = {
                     'email': data.get('contact_info', {}).get('email', ''),
                     'phone': data.get('contact_info', {}).get('phone', '')
                 }
                 
                 # Process the NO response with the user's contact information
-                response = handle_satisfaction_response(
+                response = await ahandle_satisfaction_response(
                     "NO",  # The original query was NO
-                    request.user.is_authenticated,
-                    user_data
+                    user.is_authenticated,
+                    user_data,
+                    session_key
                 )
                 return JsonResponse(response)
             
             # Check if the user is responding with "YES" or "NO" to the satisfaction question
             if query.strip().upper() in ["YES", "NO"]:
-                response = handle_satisfaction_response(
+                endpoint = "satisfaction"
+                response = await ahandle_satisfaction_response(
                     query, 
-                    request.user.is_authenticated
+                    user.is_authenticated,
+                    session_key=session_key
                 )
                 return JsonResponse(response)
             
             if not query.strip():
                 return JsonResponse({'error': 'Query cannot be empty'}, status=400)
             
-            response = process_chat_query(
+            response = await aprocess_chat_query(
                 query, 
                 output_language, 
-                request.user.is_authenticated
+                user.is_authenticated,
+                session_key
             )
             return JsonResponse(response)
             
+        except SchedulerBusy as e:
+            trace_failure(endpoint, query, output_language, started, "busy", e)
+            return busy_response(e)
+        except IndexNotReady as e:
+            trace_failure(endpoint, query, output_language, started, "index_not_ready", e)
+            # Answer immediately instead of waiting for the index to finish building
+            return JsonResponse({
+                'response': str(e),
+                'source': "Support System",
+                'error': 'index_not_ready',
+                'send_satisfaction_prompt': False
+            }, status=503)
         except Exception as e:
             print(f"Error in get_response: {e}")
             error_message = str(e)
+            trace_failure(endpoint, query, output_language, started, "error", e)
             
             # Log the error if user is authenticated
-            if 'query' in locals() and request.user.is_authenticated:
+            if query and user.is_authenticated:
                 from .chat_service import log_chat_history
-                log_chat_history(query, f"Error: {error_message}")
+                await sync_to_async(log_chat_history)(query, f"Error: {error_message}", "", session_key)
             
             return JsonResponse({
                 'error': error_message,
@@ -124,9 +186,66 @@ def get_response(request):
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+@csrf_exempt
+@require_POST
+async def stream_response(request):
+    """
+    Streaming version of get_response for regular questions.
+
+    Sends Server-Sent Events: one `data: {"token": ...}` event per piece of the
+    answer as the model generates it, then a final event carrying the source and
+    the satisfaction prompt flag. Satisfaction replies still go to get_response.
+    """
+    started = time.perf_counter()
+    query, output_language = None, None
+    try:
+        data = json.loads(request.body)
+        query = data.get('query') or ''
+        output_language = data.get('output_language', 'English')
+        if not query.strip():
+            return JsonResponse({'error': 'Query cannot be empty'}, status=400)
+        is_authenticated = (await request.auser()).is_authenticated
+        session_key = await sync_to_async(conversation_key)(request)
+        events = await astream_chat_query(query, output_language, is_authenticated, session_key)
+    except SchedulerBusy as e:
+        trace_failure("stream", query, output_language, started, "busy", e)
+        return busy_response(e)
+    except IndexNotReady as e:
+        trace_failure("stream", query, output_language, started, "index_not_ready", e)
+        return JsonResponse({
+            'response': str(e),
+            'source': "Support System",
+            'error': 'index_not_ready',
+            'send_satisfaction_prompt': False
+        }, status=503)
+    except Exception as e:
+        print(f"Error in stream_response: {e}")
+        trace_failure("stream", query, output_language, started, "error", e)
+        return JsonResponse({
+            'error': str(e),
+            'send_satisfaction_prompt': False
+        }, status=400)
+
+    async def event_stream():
+        try:
+            async with aclosing(events):
+                async for event in events:
+                    yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"Error while streaming response: {e}")
+            trace_failure("stream", query, output_language, started, "busy" if isinstance(e, SchedulerBusy) else "error", e)
+            yield f"data: {json.dumps({'error': str(e), 'send_satisfaction_prompt': False})}\n\n"
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop reverse proxies from buffering the stream
+    return response
+
 @require_POST
-def handle_satisfaction(request):
+async def handle_satisfaction(request):
     """Handle satisfaction responses and contact information"""
+    started = time.perf_counter()
+    query = None
     try:
         # Parse the JSON data
         data = json.loads(request.body)
@@ -134,15 +253,38 @@ def handle_satisfaction(request):
         user_data = data.get('user_data', None)
         
         # Get user authentication status
-        is_authenticated = request.user.is_authenticated
+        is_authenticated = (await request.auser()).is_authenticated
+        session_key = await sync_to_async(conversation_key)(request)
         
         # Process the satisfaction response
-        result = handle_satisfaction_response(query, is_authenticated, user_data)
+        result = await ahandle_satisfaction_response(query, is_authenticated, user_data, session_key)
         
         # Return the response
         return JsonResponse(result)
+    except SchedulerBusy as e:
+        trace_failure("satisfaction", query, None, started, "busy", e)
+        return busy_response(e)
     except Exception as e:
+        trace_failure("satisfaction", query, None, started, "error", e)
         return JsonResponse({
             'response': f"Error processing request: {str(e)}",
             'source': "Error"
-        })  
\ No newline at end of file
+        })
+
+def healthz(request):
+    """Liveness probe: the process is up and serving requests"""
+    return JsonResponse({'status': 'ok'})
+
+def readyz(request):
+    """Readiness probe: 200 once the policy index is loaded, 503 while it is still building"""
+    status = index_status()
+    return JsonResponse(status, status=200 if status['ready'] else 503)
+
+def metrics(request):
+    """Runtime counters for this worker process"""
+    return JsonResponse({
+        'index': index_status(),
+        'embedding_cache': embedding_cache.stats(),
+        'answer_cache': answer_cache.stats(),
+        **runtime_metrics.snapshot(),
+    })